@@ -6,40 +6,189 @@ from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
+from datetime import timedelta
 from os import environ
+from app.replicas import RoutingSession
 
 load_dotenv(override=True)
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 jwt = JWTManager()
 
 
-def create_app():
+def create_app(test_config=None):
     """
     This function creates the app and returns it.
+
+    Args:
+        test_config: Optional settings that override the environment
     """
+    from app.serialization import FastJSONProvider
+
     app = Flask(__name__)
+    app.json = FastJSONProvider(app)
 
     # Configuring the app
     app.config["SQLALCHEMY_DATABASE_URI"] = environ.get("DATABASE_URI")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    # Connection pool profile (see app/pool.py)
+    app.config["DB_POOL_PROFILE"] = environ.get("DB_POOL_PROFILE", "default")
+    # Read replicas for GET requests (see app/replicas.py)
+    app.config["DATABASE_REPLICA_URIS"] = [
+        uri.strip()
+        for uri in environ.get("DATABASE_REPLICA_URIS", "").split(",")
+        if uri.strip()
+    ]
+    app.config["DB_REPLICA_STRATEGY"] = environ.get(
+        "DB_REPLICA_STRATEGY", "round-robin"
+    )
+    app.config["DB_REPLICA_RETRY_SECONDS"] = float(
+        environ.get("DB_REPLICA_RETRY_SECONDS", 30)
+    )
+    # Hash-sharded user and organisation storage (see app/sharding.py)
+    app.config["DATABASE_SHARDS"] = environ.get("DATABASE_SHARDS", "")
     app.config["JWT_SECRET_KEY"] = environ.get("JWT_SECTET_KEY")
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(
+        minutes=float(environ.get("ACCESS_TOKEN_MINUTES", 5))
+    )
+    app.config["JWT_REFRESH_TOKEN_EXPIRES"] = timedelta(
+        days=float(environ.get("REFRESH_TOKEN_DAYS", 30))
+    )
+    # Seconds a membership check result may be reused by this worker (0 = off)
+    app.config["MEMBERSHIP_CACHE_TTL"] = float(
+        environ.get("MEMBERSHIP_CACHE_TTL", 0)
+    )
+    app.config["MEMBERSHIP_CACHE_SIZE"] = int(
+        environ.get("MEMBERSHIP_CACHE_SIZE", 10000)
+    )
+    # Seconds a worker may reuse a loaded JWT identity (0 = off)
+    app.config["IDENTITY_CACHE_TTL"] = float(
+        environ.get("IDENTITY_CACHE_TTL", 0)
+    )
+    app.config["IDENTITY_CACHE_SIZE"] = int(
+        environ.get("IDENTITY_CACHE_SIZE", 10000)
+    )
+    # Password hashing (see app/hashing.py)
+    app.config["HASH_PROFILE"] = environ.get("HASH_PROFILE", "scrypt")
+    # An explicit werkzeug method string overrides the profile
+    app.config["HASH_METHOD"] = environ.get("HASH_METHOD")
+    app.config["HASH_SALT_LENGTH"] = int(environ.get("HASH_SALT_LENGTH", 16))
+    app.config["HASH_POOL_WORKERS"] = int(environ.get("HASH_POOL_WORKERS", 0))
+    app.config["HASH_POOL_QUEUE_DEPTH"] = int(
+        environ.get("HASH_POOL_QUEUE_DEPTH", 4)
+    )
+    app.config["HASH_POOL_ACQUIRE_TIMEOUT"] = float(
+        environ.get("HASH_POOL_ACQUIRE_TIMEOUT", 0.1)
+    )
+    app.config["INTERNAL_TOKEN"] = environ.get("INTERNAL_TOKEN")
+    # Bulk user imports through /internal/users/import
+    app.config["IMPORT_CHUNK_SIZE"] = int(
+        environ.get("IMPORT_CHUNK_SIZE", 1000)
+    )
+    app.config["IMPORT_HASH_WORKERS"] = int(
+        environ.get("IMPORT_HASH_WORKERS", 0)
+    ) or None
+    # Most rows one request may import; larger loads use `flask import-users`
+    app.config["IMPORT_MAX_ROWS"] = int(
+        environ.get("IMPORT_MAX_ROWS", 1000)
+    )
+    # Organisations read per query by /internal/organisations/export
+    app.config["EXPORT_CHUNK_SIZE"] = int(
+        environ.get("EXPORT_CHUNK_SIZE", 1000)
+    )
+    # Apply pending migrations at boot (development only; deploys run
+    # `flask db upgrade` once instead of every worker checking the schema)
+    app.config["DB_AUTO_UPGRADE"] = (
+        environ.get("DB_AUTO_UPGRADE", "false").lower() == "true"
+    )
+    # Raise on lazy loads the views did not declare (see app/loading.py)
+    app.config["DB_STRICT_LOADING"] = (
+        environ.get("DB_STRICT_LOADING", "false").lower() == "true"
+    )
+    # Request metrics (see app/metrics.py)
+    app.config["METRICS_DIR"] = environ.get("METRICS_DIR")
+    app.config["METRICS_FLUSH_SECONDS"] = float(
+        environ.get("METRICS_FLUSH_SECONDS", 5)
+    )
+    # Log requests taking at least this many seconds (0 = off)
+    app.config["SLOW_REQUEST_SECONDS"] = float(
+        environ.get("SLOW_REQUEST_SECONDS", 0)
+    )
+    if test_config:
+        app.config.update(test_config)
 
+    from app import (
+        hashing,
+        identity,
+        loading,
+        membership,
+        metrics,
+        pool,
+        replicas,
+        sharding,
+    )
     from app.api import api
     from app.auth import auth
+    from app.exporter import export_organisations_command
+    from app.importer import import_users_command
+    from app.internal import internal
+    import migrations
 
     # Registering the blueprints
     app.register_blueprint(api, url_prefix="/api")
     app.register_blueprint(auth, url_prefix="/auth")
+    app.register_blueprint(internal, url_prefix="/internal")
 
     from models.user import User
     from models.organisation import Organisation
+    from models.refresh_token import RefreshToken
+    import models.search
 
+    if app.config["SQLALCHEMY_DATABASE_URI"]:
+        app.config.setdefault(
+            "SQLALCHEMY_ENGINE_OPTIONS",
+            pool.engine_options(
+                app.config["SQLALCHEMY_DATABASE_URI"],
+                app.config["DB_POOL_PROFILE"],
+                environ,
+            ),
+        )
+    if app.config["DATABASE_REPLICA_URIS"]:
+        app.config["SQLALCHEMY_BINDS"] = {
+            **app.config.get("SQLALCHEMY_BINDS", {}),
+            **replicas.binds(
+                app.config["DATABASE_REPLICA_URIS"],
+                app.config["DB_POOL_PROFILE"],
+                environ,
+            ),
+        }
+    shards = app.config["DATABASE_SHARDS"]
+    if isinstance(shards, str):
+        shards = app.config["DATABASE_SHARDS"] = sharding.parse(shards)
+    if shards:
+        app.config["SQLALCHEMY_BINDS"] = {
+            **app.config.get("SQLALCHEMY_BINDS", {}),
+            **sharding.binds(shards, app.config["DB_POOL_PROFILE"], environ),
+        }
     db.init_app(app)
+    pool.init_app(app, db)
+    metrics.init_app(app, db)
+    loading.init_app(app)
+    replicas.init_app(app, db)
+    sharding.init_app(app, db)
     jwt.init_app(app)
+    membership.init_app(app)
+    identity.init_app(app)
+    hashing.init_app(app)
+
+    if app.config["DB_AUTO_UPGRADE"]:
+        with app.app_context(), db.engine.begin() as connection:
+            migrations.upgrade(connection, db.metadata)
 
-    with app.app_context():
-        db.create_all()
+    app.cli.add_command(import_users_command)
+    app.cli.add_command(export_organisations_command)
+    app.cli.add_command(migrations.db_command)
+    app.cli.add_command(sharding.shards_command)
 
     app.url_map.strict_slashes = False
     return app
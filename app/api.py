@@ -1,11 +1,47 @@
 #!/usr/bin/env python
 """
 This file defines all the routes for the API blueprint.
+
+With shards configured, users, organisations and memberships are read and
+written through the app's ShardedStore (see app.sharding); the searches
+answer 501 Not Implemented, as they read the primary database's tables.
 """
-from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+import uuid
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from flask_jwt_extended import current_user, jwt_required
+from sqlalchemy import func, select
 from models.user import User
-from models.organisation import Organisation
+from models.organisation import Organisation, organisation_user_table
+from models.types import is_valid_id
+from app.conditional import (
+    conditional_requested,
+    etag_for,
+    not_modified,
+    tagged,
+)
+from app.dto import OrganisationDTO, UserDTO
+from app.loading import eager_loads
+from app.membership import (
+    add_member,
+    add_members_bulk,
+    invalidate,
+    is_member,
+    shares_organisation,
+)
+from app.search import (
+    MATCH_MODES,
+    search_members,
+    search_organisations,
+    terms,
+)
+from app.sharding import get_store
 from app import db
 
 api = Blueprint("api", __name__)
@@ -15,61 +51,402 @@ server_error = {
     "message": "An error occurred while processing your request",
 }
 
+# Rows fetched per round trip when streaming large responses
+STREAM_BATCH_SIZE = 500
+# Most user ids accepted by one bulk membership request
+BULK_MEMBERSHIP_LIMIT = 5000
+# Default and largest page sizes of the member listing
+MEMBER_PAGE_SIZE = 100
+MAX_MEMBER_PAGE_SIZE = 1000
+# Default and largest page sizes of the searches, and the deepest offset
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+MAX_SEARCH_OFFSET = 1000
+
 
 @api.route("/users/<id>", methods=["GET"], endpoint="get_user")
 @jwt_required()
+@eager_loads()
 def get_user(id):
+    """
+    This route returns a user who shares an organisation with the caller.
+    Responses carry an ETag; a matching If-None-Match gets a 304.
+    """
     try:
-        current_user = User.query.filter_by(
-            userId=get_jwt_identity()["userId"]
-        ).first()
-        user = User.query.filter_by(userId=id).first()
-        if current_user.userId == id or any(
-            [org in user.organisations for org in current_user.organisations]
+        if current_user.userId == id:
+            etag = etag_for("user", id, current_user.version)
+            return not_modified(etag) or tagged(
+                jsonify(
+                    {
+                        "status": "success",
+                        "message": "User retrieved successfully",
+                        "data": current_user.to_dict(),
+                    }
+                ),
+                etag,
+            )
+        if not is_valid_id(id) or not shares_organisation(
+            current_user.userId, id
         ):
-            return jsonify(
-                {
-                    "status": "success",
-                    "message": "User retrieved successfully",
-                    "data": user.to_dict(),
-                }
+            return (
+                jsonify(
+                    {
+                        "status": "Bad Request",
+                        "message": "Authentication failed",
+                        "statusCode": 401,
+                    }
+                ),
+                401,
             )
-        return (
+        store = get_store()
+        if store is not None:
+            row = store.user(id)
+            user = row and UserDTO.from_model(row)
+        else:
+            if conditional_requested():
+                version = db.session.scalar(
+                    select(User.version).where(User.userId == id)
+                )
+                if version is not None:
+                    response = not_modified(etag_for("user", id, version))
+                    if response:
+                        return response
+            row = db.session.execute(
+                select(User.version, *UserDTO.columns).where(
+                    User.userId == id
+                )
+            ).first()
+            user = row and UserDTO.from_row(row[1:])
+        if not row:
+            return (
+                jsonify(
+                    {
+                        "status": "failure",
+                        "message": "User not found",
+                        "statusCode": 404,
+                    }
+                ),
+                404,
+            )
+        etag = etag_for("user", user.userId, row.version)
+        return not_modified(etag) or tagged(
             jsonify(
                 {
-                    "status": "Bad Request",
-                    "message": "Authentication failed",
-                    "statusCode": 401,
-                    "cuo": [org.org_id for org in current_user.organisations],
-                    "uo": [org.org_id for org in user.organisations],
+                    "status": "success",
+                    "message": "User retrieved successfully",
+                    "data": user,
                 }
             ),
-            401,
+            etag,
         )
     except Exception as e:
         return jsonify(server_error), 500
 
 
+def _bad_request():
+    return (
+        jsonify(
+            {
+                "status": "Bad Request",
+                "message": "Client error",
+                "statusCode": 400,
+            }
+        ),
+        400,
+    )
+
+
+def _user_organisations(
+    user_id, after=None, limit=None, columns=OrganisationDTO.columns
+):
+    """
+    Builds the keyset query for a user's organisations, ordered by org_id.
+    By default the rows hold the columns of an OrganisationDTO.
+    """
+    t = organisation_user_table
+    query = (
+        select(*columns)
+        .join(t, t.c.org_id == Organisation.org_id)
+        .where(t.c.user_id == user_id)
+        .order_by(t.c.org_id)
+    )
+    if after:
+        query = query.where(t.c.org_id > after)
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def _count_user_organisations(user_id):
+    t = organisation_user_table
+    return db.session.scalar(
+        select(func.count()).select_from(t).where(t.c.user_id == user_id)
+    )
+
+
+def _stream_organisations(query, total, limit=None):
+    """
+    Yields the organisations response as JSON chunks, reading rows from a
+    server-side cursor so memory use does not grow with the result size.
+    With a limit, the query fetches one row more than the page, which
+    decides nextCursor as on the paged path.
+    """
+    dumps = current_app.json.dumps
+    yield (
+        '{"status": "success", '
+        '"message": "Organisations retrieved successfully", '
+        '"data": {'
+    )
+    if total is not None:
+        yield f'"total": {total}, '
+    yield '"organisations": ['
+    rows = db.session.execute(
+        query.execution_options(yield_per=STREAM_BATCH_SIZE)
+    )
+    last = next_cursor = None
+    for i, row in enumerate(rows):
+        if i == limit:
+            # The extra row: the next page starts after the last one sent
+            next_cursor = last.orgId
+            break
+        last = OrganisationDTO.from_row(row)
+        yield ("," if i else "") + dumps(last)
+    rows.close()
+    if limit is None:
+        yield "]}}"
+    else:
+        yield f'], "nextCursor": {dumps(next_cursor)}}}}}'
+
+
 @api.route("/organisations", methods=["GET"], endpoint="get_organisations")
 @jwt_required()
+@eager_loads()
 def get_organisations():
-    user_id = get_jwt_identity()["userId"]
-    user = User.query.filter_by(userId=user_id).first()
+    """
+    This route lists the caller's organisations.
+
+    Query parameters:
+        limit: Page size; without it every organisation is returned
+        after: The nextCursor of the previous page
+        includeTotal: "true" to include the total number of organisations
+        stream: "true" to stream the response from a server-side cursor
+            (ignored with shards configured)
+    """
+    limit = request.args.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            return _bad_request()
+        limit = int(limit)
+    after = request.args.get("after")
+    if after is not None and not is_valid_id(after):
+        return _bad_request()
+    include_total = request.args.get("includeTotal") == "true"
     try:
-        return (
+        store = get_store()
+        total = None
+        if include_total:
+            total = (
+                store.count_organisations_of(current_user.userId)
+                if store is not None
+                else _count_user_organisations(current_user.userId)
+            )
+        if store is None and request.args.get("stream") == "true":
+            query = _user_organisations(
+                current_user.userId, after, None if limit is None else limit + 1
+            )
+            return Response(
+                stream_with_context(
+                    _stream_organisations(query, total, limit)
+                ),
+                mimetype="application/json",
+            )
+        fetch = None if limit is None else limit + 1
+        # The ETag covers the ids and versions of the rows, which also
+        # decide nextCursor, and the total
+        etag_parts = ("organisations", current_user.userId, limit, after, total)
+        if store is not None:
+            rows = store.organisations_of(current_user.userId, after, fetch)
+            organisations = [OrganisationDTO.from_model(r) for r in rows]
+        else:
+            if conditional_requested():
+                versions = db.session.execute(
+                    _user_organisations(
+                        current_user.userId,
+                        after,
+                        fetch,
+                        columns=(Organisation.org_id, Organisation.version),
+                    )
+                ).all()
+                response = not_modified(
+                    etag_for(*etag_parts, [tuple(v) for v in versions])
+                )
+                if response:
+                    return response
+            rows = db.session.execute(
+                _user_organisations(
+                    current_user.userId,
+                    after,
+                    fetch,
+                    columns=(Organisation.version, *OrganisationDTO.columns),
+                )
+            ).all()
+            organisations = [OrganisationDTO.from_row(r[1:]) for r in rows]
+        etag = etag_for(
+            *etag_parts,
+            [(o.orgId, r.version) for o, r in zip(organisations, rows)],
+        )
+        if limit is None:
+            data = {"organisations": organisations}
+        else:
+            page = organisations[:limit]
+            data = {
+                "organisations": page,
+                "nextCursor": page[-1].orgId if len(rows) > limit else None,
+            }
+        if total is not None:
+            data["total"] = total
+        return not_modified(etag) or tagged(
             jsonify(
                 {
                     "status": "success",
                     "message": "Organisations retrieved successfully",
-                    "data": {
-                        "organisations": [
-                            organisation.to_dict()
-                            for organisation in user.organisations
-                        ]
-                    },
+                    "data": data,
                 }
             ),
-            200,
+            etag,
+        )
+    except Exception as e:
+        return jsonify(server_error), 500
+
+
+def _search_arguments():
+    """
+    Parses the query parameters shared by the searches.
+
+    Returns:
+        The query terms, match mode, limit and offset, or None if any is
+        invalid
+    """
+    words = terms(request.args.get("q", ""))
+    match = request.args.get("match", "auto")
+    limit = request.args.get("limit", str(SEARCH_PAGE_SIZE))
+    offset = request.args.get("offset", "0")
+    if (
+        not words
+        or match not in MATCH_MODES
+        or not limit.isdigit()
+        or not 1 <= int(limit) <= MAX_SEARCH_PAGE_SIZE
+        or not offset.isdigit()
+        or int(offset) > MAX_SEARCH_OFFSET
+    ):
+        return None
+    return words, match, int(limit), int(offset)
+
+
+def _search_unavailable():
+    return (
+        jsonify(
+            {
+                "status": "Not Implemented",
+                "message": "Search is not available with sharded storage",
+                "statusCode": 501,
+            }
+        ),
+        501,
+    )
+
+
+def _search_page(key, results, mode, limit, offset):
+    page = results[:limit]
+    return {
+        key: page,
+        "match": mode,
+        "nextOffset": offset + limit if len(results) > limit else None,
+    }
+
+
+@api.route(
+    "/organisations/search", methods=["GET"], endpoint="search_organisations"
+)
+@jwt_required()
+@eager_loads()
+def search_organisations_route():
+    """
+    This route searches the caller's organisations by name and description.
+
+    Query parameters:
+        q: The search terms (at least one of 3 or more characters)
+        match: "exact", "fuzzy" or "auto" (exact, or fuzzy when the first
+            page has no exact match); pass the returned match to get the
+            next page
+        limit: Page size (default 20, at most 100)
+        offset: The nextOffset of the previous page (at most 1000)
+    """
+    if get_store() is not None:
+        return _search_unavailable()
+    arguments = _search_arguments()
+    if arguments is None:
+        return _bad_request()
+    words, match, limit, offset = arguments
+    try:
+        results, mode = search_organisations(
+            current_user.userId, words, match, limit, offset
+        )
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Organisations retrieved successfully",
+                "data": _search_page(
+                    "organisations", results, mode, limit, offset
+                ),
+            }
+        )
+    except Exception as e:
+        return jsonify(server_error), 500
+
+
+@api.route("/users/search", methods=["GET"], endpoint="search_users")
+@jwt_required()
+@eager_loads()
+def search_users_route():
+    """
+    This route searches the users who share an organisation with the
+    caller by name and email.
+
+    Query parameters:
+        orgId: Only search the members of this organisation of the caller
+        q, match, limit, offset: As for /organisations/search
+    """
+    if get_store() is not None:
+        return _search_unavailable()
+    arguments = _search_arguments()
+    if arguments is None:
+        return _bad_request()
+    words, match, limit, offset = arguments
+    org_id = request.args.get("orgId")
+    try:
+        if org_id is not None:
+            org_id = str(uuid.UUID(org_id)) if is_valid_id(org_id) else None
+            if org_id is None or not is_member(current_user.userId, org_id):
+                return (
+                    jsonify(
+                        {
+                            "status": "failure",
+                            "message": "Organisation not found",
+                            "statusCode": 404,
+                        }
+                    ),
+                    404,
+                )
+        results, mode = search_members(
+            current_user.userId, words, match, limit, offset, org_id
+        )
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Users retrieved successfully",
+                "data": _search_page("users", results, mode, limit, offset),
+            }
         )
     except Exception as e:
         return jsonify(server_error), 500
@@ -77,68 +454,219 @@ def get_organisations():
 
 @api.route("/organisations/<id>", methods=["GET"], endpoint="get_organisation")
 @jwt_required()
+@eager_loads()
 def get_organisation(id):
-    user_id = get_jwt_identity()["userId"]
+    """
+    This route returns one of the caller's organisations. Responses carry
+    an ETag; a matching If-None-Match gets a 304.
+    """
     try:
-        organisation = Organisation.query.filter_by(org_id=id).first()
-        response = (
-            jsonify(
-                {
-                    "status": "success",
-                    "message": "Organisation retrieved successfully",
-                    "data": organisation.to_dict(),
-                }
+        org_id = str(uuid.UUID(id)) if is_valid_id(id) else None
+        member = org_id is not None and is_member(current_user.userId, org_id)
+        sharded = get_store() is not None
+        if member and not sharded and conditional_requested():
+            version = db.session.scalar(
+                select(Organisation.version).where(
+                    Organisation.org_id == org_id
+                )
             )
-            if organisation
-            and organisation
-            in User.query.filter_by(userId=user_id).first().organisations
-            else (
-                jsonify(
-                    {
-                        "status": "Bad Request",
-                        "message": "Authentication failed",
-                        "statusCode": 401,
-                    }
+            if version is not None:
+                response = not_modified(
+                    etag_for("organisation", org_id, version)
                 )
-                if organisation
-                else jsonify(
+                if response:
+                    return response
+        organisation = _find_organisation(org_id)
+        if not organisation:
+            return (
+                jsonify(
                     {
                         "status": "failure",
                         "message": "Organisation not found",
                         "statusCode": 404,
                     }
-                )
+                ),
+                404,
             )
+        if not member:
+            return (
+                jsonify(
+                    {
+                        "status": "Bad Request",
+                        "message": "Authentication failed",
+                        "statusCode": 401,
+                    }
+                ),
+                401,
+            )
+        etag = etag_for("organisation", org_id, organisation.version)
+        return not_modified(etag) or tagged(
+            jsonify(
+                {
+                    "status": "success",
+                    "message": "Organisation retrieved successfully",
+                    "data": OrganisationDTO.from_model(organisation),
+                }
+            ),
+            etag,
+        )
+    except Exception as e:
+        return jsonify(server_error), 500
+
+
+def _find_organisation(org_id):
+    """
+    Returns an organisation (a model, or a row from its shard), or None.
+    """
+    if not org_id:
+        return None
+    store = get_store()
+    if store is not None:
+        return store.organisation(org_id)
+    return db.session.get(Organisation, org_id)
+
+
+def _not_a_member(org_id):
+    """
+    Returns the response for a caller outside an organisation: a 401 if
+    the organisation exists, a 404 otherwise.
+    """
+    if _find_organisation(org_id):
+        return (
+            jsonify(
+                {
+                    "status": "Bad Request",
+                    "message": "Authentication failed",
+                    "statusCode": 401,
+                }
+            ),
+            401,
+        )
+    return (
+        jsonify(
+            {
+                "status": "failure",
+                "message": "Organisation not found",
+                "statusCode": 404,
+            }
+        ),
+        404,
+    )
+
+
+def _organisation_members(org_id, after, limit):
+    """
+    Builds the keyset query for an organisation's members, ordered by
+    user_id so it walks the (org_id, user_id) primary key. The rows hold
+    the columns of a UserDTO, never the password hash.
+    """
+    t = organisation_user_table
+    query = (
+        select(*UserDTO.columns)
+        .join(t, t.c.user_id == User.userId)
+        .where(t.c.org_id == org_id)
+        .order_by(t.c.user_id)
+        .limit(limit)
+    )
+    if after:
+        query = query.where(t.c.user_id > after)
+    return query
+
+
+@api.route(
+    "/organisations/<orgId>/users",
+    methods=["GET"],
+    endpoint="get_organisation_users",
+)
+@jwt_required()
+@eager_loads()
+def get_organisation_users(orgId):
+    """
+    This route lists the members of one of the caller's organisations, a
+    page at a time.
+
+    Query parameters:
+        limit: Page size (default 100, at most 1000)
+        after: The nextCursor of the previous page
+        includeTotal: "true" to include the number of members
+    """
+    limit = request.args.get("limit", str(MEMBER_PAGE_SIZE))
+    if not limit.isdigit() or not 1 <= int(limit) <= MAX_MEMBER_PAGE_SIZE:
+        return _bad_request()
+    limit = int(limit)
+    after = request.args.get("after")
+    if after is not None and not is_valid_id(after):
+        return _bad_request()
+    try:
+        org_id = str(uuid.UUID(orgId)) if is_valid_id(orgId) else None
+        if org_id is None or not is_member(current_user.userId, org_id):
+            return _not_a_member(org_id)
+        include_total = request.args.get("includeTotal") == "true"
+        store = get_store()
+        if store is not None:
+            rows = store.members(org_id, after, limit + 1)
+            page = [UserDTO.from_model(r) for r in rows[:limit]]
+            total = store.count_members(org_id) if include_total else None
+        else:
+            rows = db.session.execute(
+                _organisation_members(org_id, after, limit + 1)
+            ).all()
+            page = [UserDTO.from_row(r) for r in rows[:limit]]
+            total = None
+            if include_total:
+                t = organisation_user_table
+                total = db.session.scalar(
+                    select(func.count())
+                    .select_from(t)
+                    .where(t.c.org_id == org_id)
+                )
+        data = {
+            "users": page,
+            "nextCursor": page[-1].userId if len(rows) > limit else None,
+        }
+        if total is not None:
+            data["total"] = total
+        return jsonify(
+            {
+                "status": "success",
+                "message": "Users retrieved successfully",
+                "data": data,
+            }
         )
-        if response.json["status"] == "failure":
-            response.status_code = 404
-        if response.json["status"] == "Bad Request":
-            response.status_code = 401
-        return response
     except Exception as e:
         return jsonify(server_error), 500
 
 
 @api.route("/organisations", methods=["POST"], endpoint="create_organisation")
 @jwt_required()
+@eager_loads()
 def create_organisation():
     try:
         data = request.get_json()
-        organisation = Organisation(
-            name=data["name"], description=data.get("description", "")
-        )
-        user = User.query.filter_by(
-            userId=get_jwt_identity()["userId"]
-        ).first()
-        user.organisations.append(organisation)
-        db.session.add(organisation)
-        db.session.commit()
+        store = get_store()
+        if store is not None:
+            values = {
+                "name": data["name"],
+                "description": data.get("description", ""),
+            }
+            org_id = store.add_organisation(values, current_user.userId)
+            invalidate(current_user.userId)
+            created = OrganisationDTO(org_id, **values)
+        else:
+            organisation = Organisation(
+                name=data["name"], description=data.get("description", "")
+            )
+            db.session.add(organisation)
+            db.session.flush()
+            add_member(organisation.org_id, current_user.userId)
+            created = OrganisationDTO.from_model(organisation)
+            db.session.commit()
         return (
             jsonify(
                 {
                     "status": "success",
                     "message": "Organisation created successfully",
-                    "data": organisation.to_dict(),
+                    "data": created,
                 }
             ),
             201,
@@ -152,29 +680,54 @@ def create_organisation():
     methods=["POST"],
     endpoint="add_user_to_organisation",
 )
+@jwt_required()
+@eager_loads()
 def add_user_to_organisation(orgId):
+    """
+    This route adds a user ({"userId": ...}) or many users
+    ({"userIds": [...]}) to one of the caller's organisations.
+
+    Returns:
+        A JSON response; for many users it holds the result for each id
+    """
     try:
         data = request.get_json()
-        if "userId" not in data:
-            return jsonify(
-                {
-                    "status": "Bad Request",
-                    "message": "Client error",
-                    "statusCode": 400,
-                },
-                400,
+        user_ids = data.get("userIds")
+        if user_ids is not None:
+            if (
+                not isinstance(user_ids, list)
+                or not user_ids
+                or len(user_ids) > BULK_MEMBERSHIP_LIMIT
+                or not all(isinstance(u, str) for u in user_ids)
+            ):
+                return _bad_request()
+        elif "userId" not in data:
+            return _bad_request()
+        org_id = str(uuid.UUID(orgId)) if is_valid_id(orgId) else None
+        if org_id is None or not is_member(current_user.userId, org_id):
+            return _not_a_member(org_id)
+        if user_ids is not None:
+            return _add_users_to_organisation(org_id, user_ids)
+        user = None
+        if is_valid_id(data["userId"]):
+            store = get_store()
+            user = (
+                store.user(data["userId"])
+                if store is not None
+                else db.session.get(User, data["userId"])
             )
-        organisation = Organisation.query.get(orgId)
-        user = User.query.get(data["userId"])
-        if not organisation or not user:
-            return jsonify(
-                {
-                    "status": "failure",
-                    "message": "Organisation or user not found",
-                },
+        if not user:
+            return (
+                jsonify(
+                    {
+                        "status": "failure",
+                        "message": "User not found",
+                        "statusCode": 404,
+                    }
+                ),
                 404,
             )
-        user.organisations.append(organisation)
+        add_member(org_id, user.userId)
         db.session.commit()
         return jsonify(
             {
@@ -184,3 +737,26 @@ def add_user_to_organisation(orgId):
         )
     except Exception as e:
         return jsonify(server_error), 500
+
+
+def _add_users_to_organisation(org_id, user_ids):
+    results = add_members_bulk(org_id, user_ids)
+    db.session.commit()
+    counts = {"added": 0, "already-member": 0, "not-found": 0}
+    for _, result in results:
+        counts[result] += 1
+    return jsonify(
+        {
+            "status": "success",
+            "message": "Users processed successfully",
+            "data": {
+                "added": counts["added"],
+                "alreadyMember": counts["already-member"],
+                "notFound": counts["not-found"],
+                "results": [
+                    {"userId": user_id, "result": result}
+                    for user_id, result in results
+                ],
+            },
+        }
+    )
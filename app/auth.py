@@ -1,17 +1,51 @@
 #!/usr/bin/env python
 """
 This file defines all the routes for the authentication blueprint.
+
+With shards configured, users are registered on and logged in from their
+shard (see app.sharding) instead of db.session.
 """
-from datetime import datetime
-import datetime as dt
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token
+from flask_jwt_extended import get_jwt, jwt_required
+from sqlalchemy.exc import IntegrityError
+from app.dto import UserDTO
+from app.hashing import (
+    HashingPoolSaturated,
+    hash_password,
+    needs_rehash,
+    verify_password,
+)
+from app.identity import forget
+from app.sharding import get_store
+from app.tokens import RefreshTokenRejected, issue_tokens, rotate_tokens
 from models.organisation import Organisation
 from models.user import User
 from app import db
 
 auth = Blueprint("auth", __name__)
 
+registration_failed = {
+    "status": "Bad Request",
+    "message": "Registration was not successful",
+    "statusCode": 400,
+}
+
+
+@auth.errorhandler(HashingPoolSaturated)
+def hashing_pool_saturated(e):
+    """
+    Fails fast when the password hashing pool is saturated.
+    """
+    response = jsonify(
+        {
+            "status": "Service Unavailable",
+            "message": "Server is busy, please try again shortly",
+            "statusCode": 503,
+        }
+    )
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
 
 @auth.route("/register", methods=["POST"])
 def register():
@@ -34,12 +68,11 @@ def register():
                 err["errors"].append(
                     {"field": key, "message": f"{key} cannot be empty"}
                 )
-    if "email" in data and User.query.filter_by(email=data["email"]).first():
-        err["errors"].append(
-            {"field": "email", "message": "Email already exists"}
-        )
     if err["errors"]:
         return jsonify(err), 422
+    store = get_store()
+    if store is not None:
+        return _register_on_shards(store, data)
     user = User(
         firstName=data["firstName"],
         lastName=data["lastName"],
@@ -54,38 +87,83 @@ def register():
         )
         user.organisations.append(users_org)
         db.session.add(users_org)
+        # The user, organisation and membership are inserted in one flush;
+        # the unique index on email rejects duplicates, even concurrent ones.
+        db.session.flush()
+        access_token, refresh_token = issue_tokens(user.userId)
+        # Built before the commit expires the user, which would reload it
+        profile = UserDTO.from_model(user)
         db.session.commit()
-        access_token = create_access_token(
+        return _registered(access_token, refresh_token, profile)
+    except IntegrityError as e:
+        db.session.rollback()
+        if "email" not in str(e.orig):
+            return jsonify(registration_failed), 400
+        return _email_exists()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify(registration_failed), 400
+
+
+def _email_exists():
+    return (
+        jsonify(
+            {"errors": [{"field": "email", "message": "Email already exists"}]}
+        ),
+        422,
+    )
+
+
+def _registered(access_token, refresh_token, profile):
+    return (
+        jsonify(
             {
-                "userId": user.userId,
-                "sub": user.userId,
-                "exp": datetime.now(dt.UTC) + dt.timedelta(minutes=5),
+                "status": "success",
+                "message": "Registration successful",
+                "data": {
+                    "accessToken": access_token,
+                    "refreshToken": refresh_token,
+                    "user": profile,
+                },
             }
-        )
-        return (
-            jsonify(
-                {
-                    "status": "success",
-                    "message": "Registration successful",
-                    "data": {
-                        "accessToken": access_token,
-                        "user": user.to_dict(),
-                    },
-                }
-            ),
-            201,
-        )
+        ),
+        201,
+    )
+
+
+def _register_on_shards(store, data):
+    """
+    Registers a user on their shard, reserving the email in the shard
+    directory, and creates their organisation on its shard.
+    """
+    values = {
+        "firstName": data["firstName"],
+        "lastName": data["lastName"],
+        "email": data["email"],
+        "phone": data.get("phone"),
+    }
+    password = hash_password(data["password"])
+    try:
+        user_id = store.add_user({**values, "password": password})
+    except IntegrityError as e:
+        # The directory's only unique column is the email
+        return _email_exists()
     except Exception as e:
-        return (
-            jsonify(
-                {
-                    "status": "Bad Request",
-                    "message": "Registration was not successful",
-                    "statusCode": 400,
-                }
-            ),
-            400,
+        return jsonify(registration_failed), 400
+    try:
+        store.add_organisation(
+            {
+                "name": f"{values['firstName']}'s Organisation",
+                "description": "",
+            },
+            user_id,
         )
+    except Exception as e:
+        # Leave no user without an organisation; the email is free again
+        store.delete_user(user_id)
+        return jsonify(registration_failed), 400
+    profile = UserDTO(userId=user_id, **values)
+    return _registered(*issue_tokens(user_id), profile)
 
 
 @auth.route("/login", methods=["POST"])
@@ -115,22 +193,78 @@ def login():
                     {"field": key, "message": f"{key} cannot be empty"}
                 )
         return jsonify(err), 422
-    user = User.query.filter_by(email=data["email"]).first()
-    if not user or not user.check_password(data["password"]):
-        return jsonify(bad_request), 401
-    access_token = create_access_token(
-        identity={
-            "userId": user.userId,
-            "sub": user.userId,
-            "exp": datetime.now(dt.UTC) + dt.timedelta(minutes=5),
-        }
-    )
+    store = get_store()
+    if store is not None:
+        # One directory lookup, then one read on the user's shard
+        user = store.user_by_email(data["email"])
+        if not user or not verify_password(user.password, data["password"]):
+            return jsonify(bad_request), 401
+        rehashed = needs_rehash(user.password)
+        if rehashed:
+            store.update_user(
+                user.userId, {"password": hash_password(data["password"])}
+            )
+    else:
+        user = User.query.filter_by(email=data["email"]).first()
+        if not user or not user.check_password(data["password"]):
+            return jsonify(bad_request), 401
+        rehashed = db.session.is_modified(user)
+    # Also persists the password hash if it was upgraded to the current policy
+    access_token, refresh_token = issue_tokens(user.userId)
+    profile = UserDTO.from_model(user)
+    db.session.commit()
+    if rehashed:
+        # The upgrade bumped the user's version, which the identity carries
+        forget(user.userId)
     return (
         jsonify(
             {
                 "status": "success",
                 "message": "Login successful",
-                "data": {"accessToken": access_token, "user": user.to_dict()},
+                "data": {
+                    "accessToken": access_token,
+                    "refreshToken": refresh_token,
+                    "user": profile,
+                },
+            }
+        ),
+        200,
+    )
+
+
+@auth.route("/refresh", methods=["POST"])
+@jwt_required(refresh=True)
+def refresh():
+    """
+    This route exchanges a refresh token for a new access token and a new
+    refresh token. Each refresh token can only be used once.
+
+    Returns:
+        A JSON response with the new access and refresh tokens
+    """
+    try:
+        access_token, refresh_token = rotate_tokens(get_jwt())
+    except RefreshTokenRejected:
+        return (
+            jsonify(
+                {
+                    "status": "Bad Request",
+                    "message": "Authentication failed",
+                    "statusCode": 401,
+                }
+            ),
+            401,
+        )
+    db.session.commit()
+    return (
+        jsonify(
+            {
+                "status": "success",
+                "message": "Token refreshed successfully",
+                "data": {
+                    "accessToken": access_token,
+                    "refreshToken": refresh_token,
+                },
             }
         ),
         200,
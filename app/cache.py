@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+This file defines a small per-worker LRU cache with a time-to-live.
+"""
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+_missing = object()
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache whose entries expire after `ttl` seconds.
+
+    A cache with a ttl of 0 (or less) is disabled: nothing is stored and
+    every lookup misses.
+    """
+
+    def __init__(self, maxsize=1024, ttl=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for `key`, or `default` if it is missing
+        or has expired.
+        """
+        if not self.enabled:
+            return default
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is _missing:
+                return default
+            expires, value = entry
+            if expires < monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        Stores `value` under `key`, evicting the least recently used entry
+        if the cache is full.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._data[key] = (monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard_where(self, predicate):
+        """
+        Removes every entry whose key satisfies `predicate`.
+        """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+This file defines the helpers for conditional GETs with ETags.
+
+ETags are built from the ids and versions of the rows in a response (see
+models/versioning.py) rather than from its body, so a view can answer
+`304 Not Modified` after a cheap version lookup, before loading the full
+rows or serialising them.
+"""
+import hashlib
+from flask import current_app, request
+
+# Bump when the JSON shape of a resource changes, to invalidate old ETags
+REPRESENTATION = 1
+
+
+def etag_for(*parts):
+    """
+    Returns a strong ETag for a resource identified by `parts`, e.g. its
+    kind, id and version.
+    """
+    digest = hashlib.blake2b(
+        repr((REPRESENTATION, *parts)).encode(), digest_size=16
+    )
+    return digest.hexdigest()
+
+
+def conditional_requested():
+    """
+    Checks whether the client sent If-None-Match, i.e. whether looking up
+    versions first may save the full query.
+    """
+    return bool(request.if_none_match)
+
+
+def not_modified(etag):
+    """
+    Returns a 304 response if the client's If-None-Match matches `etag`,
+    else None.
+    """
+    if not request.if_none_match.contains(etag):
+        return None
+    response = current_app.response_class(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def tagged(response, etag):
+    """
+    Sets the ETag of a response and returns it.
+    """
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+This file defines the response objects built from query rows.
+
+They are slotted dataclasses, so building one is cheap and the JSON
+provider can encode them directly (orjson natively, Flask's default
+provider through dataclasses.asdict) without an intermediate dict.
+"""
+from dataclasses import dataclass
+from models.organisation import Organisation
+from models.user import User
+
+
+@dataclass(slots=True)
+class OrganisationDTO:
+    """
+    An organisation as returned by the API.
+    """
+
+    orgId: str
+    name: str
+    description: str
+
+    # The columns to select for `from_row`, in field order
+    columns = (Organisation.org_id, Organisation.name, Organisation.description)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    @classmethod
+    def from_model(cls, organisation):
+        return cls(
+            organisation.org_id, organisation.name, organisation.description
+        )
+
+
+@dataclass(slots=True)
+class UserDTO:
+    """
+    A user as returned by the API.
+    """
+
+    userId: str
+    firstName: str
+    lastName: str
+    email: str
+    phone: str
+
+    columns = (User.userId, User.firstName, User.lastName, User.email, User.phone)
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(*row)
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(
+            user.userId, user.firstName, user.lastName, user.email, user.phone
+        )
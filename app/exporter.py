@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""
+This file defines the bulk export of organisations and their members.
+
+Organisations are read in chunks of consecutive org_ids. Each chunk is one
+query joining the organisations to organisation_user. Its rows come from a
+server-side cursor (yield_per) and are written out as they arrive, so
+memory use does not grow with the number of organisations or members. The
+formats are:
+
+    ndjson  One line per organisation, with its members' userIds
+    csv     One row per membership (orgId, name, description, userId); an
+            organisation without members has one row with no userId
+
+Both are ordered by orgId and then userId. An interrupted export is resumed
+by passing the orgId of the last organisation received completely as
+`after`.
+
+The export is exposed as the `flask export-organisations` command and the
+GET /internal/organisations/export endpoint. Neither is available with shards
+configured.
+"""
+import csv
+import io
+import zlib
+from itertools import groupby
+from time import perf_counter
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+from models.organisation import Organisation, organisation_user_table
+from models.types import is_valid_id
+from app.sharding import get_store
+from app import db
+
+FORMATS = ("ndjson", "csv")
+CSV_FIELDS = ["orgId", "name", "description", "userId"]
+# Rows fetched per round trip within a chunk
+FETCH_SIZE = 1000
+
+
+class ExportReport:
+    """
+    Counts what an export has written so far.
+    """
+
+    def __init__(self):
+        self.organisations = 0
+        self.memberships = 0
+        self.last_org_id = None
+        self.seconds = 0.0
+
+    @property
+    def organisations_per_second(self):
+        return self.organisations / self.seconds if self.seconds else 0.0
+
+
+def _chunk_query(after, chunk_size):
+    t = organisation_user_table
+    organisations = select(
+        Organisation.org_id, Organisation.name, Organisation.description
+    ).order_by(Organisation.org_id)
+    if after is not None:
+        organisations = organisations.where(Organisation.org_id > after)
+    organisations = organisations.limit(chunk_size).subquery()
+    return (
+        select(organisations, t.c.user_id)
+        .outerjoin(t, t.c.org_id == organisations.c.org_id)
+        .order_by(organisations.c.org_id, t.c.user_id)
+        .execution_options(yield_per=FETCH_SIZE)
+    )
+
+
+def _ndjson(org_id, name, description, user_ids):
+    record = {
+        "orgId": org_id,
+        "name": name,
+        "description": description,
+        "members": user_ids,
+    }
+    return current_app.json.dumps(record) + "\n"
+
+
+def _csv(org_id, name, description, user_ids):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerows(
+        [org_id, name, description, user_id] for user_id in user_ids or [""]
+    )
+    return buffer.getvalue()
+
+
+def export_organisations(
+    fmt="ndjson", after=None, limit=None, chunk_size=1000, progress=None
+):
+    """
+    Yields the organisations and their members as text, one chunk of
+    organisations at a time.
+
+    Args:
+        fmt: "ndjson" or "csv"
+        after: Only export the organisations with a greater orgId
+        limit: The most organisations to export (all by default)
+        chunk_size: Organisations read per query
+        progress: Optional callback called with an ExportReport after
+            each chunk
+
+    Yields:
+        Strings of complete NDJSON lines or CSV rows; the CSV header first
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format '{fmt}'.")
+    encode = _ndjson if fmt == "ndjson" else _csv
+    report = ExportReport()
+    start = perf_counter()
+    if fmt == "csv":
+        yield ",".join(CSV_FIELDS) + "\n"
+    while limit is None or report.organisations < limit:
+        size = chunk_size
+        if limit is not None:
+            size = min(size, limit - report.organisations)
+        rows = db.session.execute(_chunk_query(after, size))
+        count, lines = 0, []
+        for (org_id, name, description), members in groupby(
+            rows, key=lambda row: row[:3]
+        ):
+            user_ids = [row.user_id for row in members if row.user_id]
+            lines.append(encode(org_id, name, description, user_ids))
+            count += 1
+            report.memberships += len(user_ids)
+            if len(lines) == FETCH_SIZE:
+                yield "".join(lines)
+                lines = []
+        # End the chunk's transaction, so a long export holds no snapshot
+        db.session.rollback()
+        if lines:
+            yield "".join(lines)
+        if count:
+            after = report.last_org_id = org_id
+            report.organisations += count
+        report.seconds = perf_counter() - start
+        if progress:
+            progress(report)
+        if count < size:
+            break
+
+
+def gzipped(chunks):
+    """
+    Compresses text chunks into one gzip stream. Each chunk is flushed, so
+    whatever was received of an interrupted export can be decompressed.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode()) + compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+    yield compressor.flush()
+
+
+@click.command("export-organisations")
+@click.argument("file", type=click.File("wb"), default="-")
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(FORMATS),
+    help="Output format; guessed from the file extension by default.",
+)
+@click.option("--after", help="Resume after this orgId.")
+@click.option("--limit", type=int, help="Most organisations to export.")
+@click.option("--chunk-size", default=1000, show_default=True)
+@click.option(
+    "--gzip/--no-gzip",
+    "compress",
+    default=None,
+    help="Compress the output; on by default for .gz files.",
+)
+@with_appcontext
+def export_organisations_command(
+    file, fmt, after, limit, chunk_size, compress
+):
+    """
+    Exports the organisations and their members as NDJSON or CSV to FILE
+    (stdout by default).
+    """
+    if get_store() is not None:
+        raise click.ClickException("Not available with DATABASE_SHARDS set.")
+    name = file.name.removesuffix(".gz")
+    fmt = fmt or ("csv" if name.endswith(".csv") else "ndjson")
+    if compress is None:
+        compress = file.name.endswith(".gz")
+    if after is not None and not is_valid_id(after):
+        raise click.BadParameter("not an orgId", param_hint="--after")
+
+    def progress(report):
+        click.echo(
+            f"{report.organisations} organisations, "
+            f"{report.memberships} memberships, up to {report.last_org_id} "
+            f"({report.organisations_per_second:.0f} organisations/sec)",
+            err=True,
+        )
+
+    chunks = export_organisations(fmt, after, limit, chunk_size, progress)
+    if compress:
+        for data in gzipped(chunks):
+            file.write(data)
+    else:
+        for chunk in chunks:
+            file.write(chunk.encode())
+    file.flush()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+"""
+This file defines the password hashing subsystem.
+
+Hashes are computed on a per-worker process pool so that a burst of logins
+does not pin every request thread on PBKDF2/scrypt. The pool only accepts a
+bounded number of hashes at a time; when it is saturated callers get a
+`HashingPoolSaturated` error straight away, which the routes turn into a
+503, instead of queueing behind the backlog.
+
+The limit is per gunicorn worker: it bounds the hashes of the requests a
+worker serves at once, which only happens with the gthread and gevent
+worker classes (gunicorn.conf.py turns the pool on for those and ignores
+HASH_POOL_WORKERS for sync workers, which serve one request at a time).
+With HASH_POOL_WORKERS=0 (the default) hashes run inline on the request
+thread, exactly as before.
+
+The hash method comes from a named profile (HASH_PROFILE) or an explicit
+werkzeug method string (HASH_METHOD). Stored hashes made with other
+parameters are reported by `needs_rehash` so they can be upgraded on the
+next successful login.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from multiprocessing import get_context
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+from flask import current_app
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+from app import metrics
+
+# Named hash profiles. "fast" is only meant for load-test environments.
+HASH_PROFILES = {
+    "fast": "pbkdf2:sha256:1000",
+    "pbkdf2": f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}",
+    "scrypt": "scrypt:32768:8:1",
+}
+
+
+class HashingPoolSaturated(Exception):
+    """
+    Raised when the hashing pool cannot accept another hash in time.
+    """
+
+
+class LatencyStats:
+    """
+    Collects the count, total and a window of recent latency samples.
+    """
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._samples = []
+        self._lock = Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+            self._samples.append(seconds)
+            if len(self._samples) > self.window:
+                del self._samples[: len(self._samples) - self.window]
+
+    def percentile(self, pct):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "totalSeconds": self.total,
+            "maxSeconds": self.max,
+            "p50Seconds": self.percentile(50),
+            "p99Seconds": self.percentile(99),
+        }
+
+
+class HashingPool:
+    """
+    Runs password hashing functions on a bounded process pool.
+
+    Args:
+        workers: Number of hashing processes (0 runs hashes inline)
+        queue_depth: Hashes that may wait for a free process
+        acquire_timeout: Seconds to wait for a slot before giving up
+    """
+
+    def __init__(self, workers=0, queue_depth=0, acquire_timeout=0.1):
+        self.workers = workers
+        self.acquire_timeout = acquire_timeout
+        self.capacity = workers + queue_depth
+        self._slots = BoundedSemaphore(self.capacity) if workers else None
+        self._executor = None
+        self._executor_lock = Lock()
+        # Guards in_flight and rejected, which threads and greenlets share
+        self._lock = Lock()
+        self.in_flight = 0
+        self.rejected = 0
+        self.latency = LatencyStats()
+
+    def _get_executor(self):
+        # The executor is created lazily so that each gunicorn worker gets
+        # its own pool after fork.
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=get_context("spawn")
+                )
+            return self._executor
+
+    def run(self, fn, *args):
+        """
+        Runs `fn(*args)` on the pool and returns its result.
+
+        Raises:
+            HashingPoolSaturated: If no slot frees up within acquire_timeout
+        """
+        if self._slots and not self._slots.acquire(
+            timeout=self.acquire_timeout
+        ):
+            with self._lock:
+                self.rejected += 1
+            raise HashingPoolSaturated()
+        with self._lock:
+            self.in_flight += 1
+        start = perf_counter()
+        try:
+            if not self.workers:
+                return fn(*args)
+            return self._get_executor().submit(fn, *args).result()
+        finally:
+            self.latency.observe(perf_counter() - start)
+            with self._lock:
+                self.in_flight -= 1
+            if self._slots:
+                self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            in_flight, rejected = self.in_flight, self.rejected
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "inFlight": in_flight,
+            "rejected": rejected,
+            "latency": self.latency.to_dict(),
+        }
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+def normalize_method(method):
+    """
+    Expands a werkzeug hash method to the explicit form stored in hashes,
+    e.g. "pbkdf2" becomes "pbkdf2:sha256:600000".
+    """
+    name, *args = method.split(":")
+    if name == "scrypt":
+        return "scrypt:" + ":".join(args or ["32768", "8", "1"])
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = args[1] if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Invalid hash method '{method}'.")
+
+
+def method_for_profile(profile):
+    """
+    Returns the hash method of a named profile.
+    """
+    if profile not in HASH_PROFILES:
+        raise ValueError(f"Unknown hash profile '{profile}'.")
+    return HASH_PROFILES[profile]
+
+
+def init_app(app):
+    """
+    Creates the hashing pool for the app.
+    """
+    app.config["HASH_METHOD"] = normalize_method(
+        app.config["HASH_METHOD"]
+        or method_for_profile(app.config["HASH_PROFILE"])
+    )
+    app.extensions["hashing"] = HashingPool(
+        workers=app.config["HASH_POOL_WORKERS"],
+        queue_depth=app.config["HASH_POOL_QUEUE_DEPTH"],
+        acquire_timeout=app.config["HASH_POOL_ACQUIRE_TIMEOUT"],
+    )
+
+
+def get_pool():
+    return current_app.extensions["hashing"]
+
+
+def hash_password(password):
+    """
+    Hashes a password with the configured method on the hashing pool.
+    """
+    start = perf_counter()
+    try:
+        return get_pool().run(
+            generate_password_hash,
+            password,
+            current_app.config["HASH_METHOD"],
+            current_app.config["HASH_SALT_LENGTH"],
+        )
+    finally:
+        metrics.record("hash", perf_counter() - start)
+
+
+def verify_password(pwhash, password):
+    """
+    Checks a password against a stored hash on the hashing pool.
+    """
+    start = perf_counter()
+    try:
+        return get_pool().run(check_password_hash, pwhash, password)
+    finally:
+        metrics.record("hash", perf_counter() - start)
+
+
+def hash_passwords(passwords, executor):
+    """
+    Hashes many passwords with the configured method, spread over the
+    processes of `executor`. Used by bulk imports, which bypass the bounded
+    request pool.
+    """
+    return list(
+        executor.map(
+            generate_password_hash,
+            passwords,
+            repeat(current_app.config["HASH_METHOD"]),
+            repeat(current_app.config["HASH_SALT_LENGTH"]),
+            chunksize=16,
+        )
+    )
+
+
+def needs_rehash(pwhash):
+    """
+    Checks whether a stored hash was made with parameters other than the
+    configured ones.
+    """
+    method, _, rest = pwhash.partition("$")
+    salt = rest.partition("$")[0]
+    try:
+        method = normalize_method(method)
+    except ValueError:
+        return True
+    return (
+        method != normalize_method(current_app.config["HASH_METHOD"])
+        or len(salt) != current_app.config["HASH_SALT_LENGTH"]
+    )
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+This file defines how the current user is loaded for JWT-protected routes.
+
+The user behind a token is loaded once per request through
+flask_jwt_extended's user lookup, and handlers read it from `current_user`.
+Loaded identities are also kept in a per-worker LRU/TTL cache keyed by
+userId (see IDENTITY_CACHE_TTL), so a steady stream of requests from the
+same user needs no identity query at all. Whatever changes a user's row
+drops their cached identity with `forget`, as login does when it upgrades
+the password hash.
+
+Only the user's own columns are loaded, so the cost of a request does not
+grow with the number of organisations the user belongs to; routes check
+membership of one organisation at a time with `membership.is_member`.
+"""
+from flask import current_app, jsonify
+from sqlalchemy import select
+from models.user import User
+from app.cache import TTLCache
+from app.sharding import get_store
+from app import db, jwt, replicas
+
+
+class CurrentUser:
+    """
+    The authenticated user.
+    """
+
+    __slots__ = (
+        "userId",
+        "firstName",
+        "lastName",
+        "email",
+        "phone",
+        "version",
+    )
+
+    def __init__(self, userId, firstName, lastName, email, phone, version):
+        self.userId = userId
+        self.firstName = firstName
+        self.lastName = lastName
+        self.email = email
+        self.phone = phone
+        self.version = version
+
+    def to_dict(self):
+        return {
+            "userId": self.userId,
+            "firstName": self.firstName,
+            "lastName": self.lastName,
+            "email": self.email,
+            "phone": self.phone,
+        }
+
+    def __repr__(self):
+        return f"<CurrentUser {self.email}>"
+
+
+def init_app(app):
+    """
+    Creates the identity cache for the app.
+    """
+    app.extensions["identity_cache"] = TTLCache(
+        maxsize=app.config["IDENTITY_CACHE_SIZE"],
+        ttl=app.config["IDENTITY_CACHE_TTL"],
+    )
+
+
+def _cache():
+    return current_app.extensions["identity_cache"]
+
+
+def load_identity(user_id):
+    """
+    Loads a user's columns (without the password hash) by primary key,
+    from the user's shard when shards are configured.
+
+    Returns:
+        A CurrentUser, or None if the user does not exist
+    """
+    store = get_store()
+    if store is not None:
+        row = store.user(user_id)
+        if row is None:
+            return None
+        return CurrentUser(
+            row.userId,
+            row.firstName,
+            row.lastName,
+            row.email,
+            row.phone,
+            row.version,
+        )
+    row = db.session.execute(
+        select(
+            User.userId,
+            User.firstName,
+            User.lastName,
+            User.email,
+            User.phone,
+            User.version,
+        ).where(User.userId == user_id)
+    ).first()
+    return None if row is None else CurrentUser(*row)
+
+
+def forget(user_id):
+    """
+    Drops a user's cached identity.
+    """
+    _cache().discard(user_id)
+
+
+@jwt.user_lookup_loader
+def lookup_current_user(jwt_header, jwt_data):
+    user_id = jwt_data["sub"]["userId"]
+    identity = _cache().get(user_id)
+    if identity is None:
+        identity = load_identity(user_id)
+        if identity is None and replicas.use_primary():
+            # A user registered moments ago may not have reached the replica
+            identity = load_identity(user_id)
+        if identity is not None:
+            _cache().set(user_id, identity)
+    return identity
+
+
+@jwt.user_lookup_error_loader
+def current_user_not_found(jwt_header, jwt_data):
+    return (
+        jsonify(
+            {
+                "status": "Bad Request",
+                "message": "Authentication failed",
+                "statusCode": 401,
+            }
+        ),
+        401,
+    )
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+"""
+This file defines the bulk user import pipeline.
+
+Users are read from NDJSON or CSV in chunks. For each chunk the passwords
+are hashed in parallel on a process pool, duplicate emails are found with a
+single query, and the users, their default organisations and memberships
+are written with one batched INSERT per table and one commit.
+
+The pipeline is exposed as the `flask import-users` command and the
+POST /internal/users/import endpoint. Neither is available with shards
+configured. The endpoint imports within the request, so it takes at most
+IMPORT_MAX_ROWS rows and refuses larger bodies before importing anything;
+bulk loads go through the command, which has no time limit.
+"""
+import csv
+import io
+import json
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from multiprocessing import get_context
+from time import perf_counter
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import insert, select
+from models.organisation import Organisation, organisation_user_table
+from models.user import User
+from app.hashing import hash_passwords
+from app.sharding import get_store
+from app import db
+
+REQUIRED_FIELDS = ["firstName", "lastName", "email", "password"]
+# Longest value each field's column holds
+MAX_LENGTHS = {
+    key: User.__table__.c[key].type.length
+    for key in ["firstName", "lastName", "email", "phone"]
+}
+ORGANISATION_NAME_LENGTH = Organisation.__table__.c.name.type.length
+
+
+class ImportTooLarge(Exception):
+    """
+    Raised when an uploaded import has more rows than IMPORT_MAX_ROWS.
+    """
+
+    def __init__(self, limit):
+        super().__init__(f"Imports over {limit} rows must use the command.")
+        self.limit = limit
+
+
+class ImportReport:
+    """
+    Counts the outcome of an import.
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "imported": self.imported,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "rowsPerSecond": round(self.rows_per_second, 1),
+        }
+
+
+def read_records(stream, fmt):
+    """
+    Yields user records from a text stream of NDJSON lines or CSV rows.
+    Lines that are not valid JSON are yielded as None.
+    """
+    if fmt == "csv":
+        yield from csv.DictReader(stream)
+    elif fmt == "ndjson":
+        for line in stream:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+    else:
+        raise ValueError(f"Unsupported import format '{fmt}'.")
+
+
+def _validate(record):
+    if not isinstance(record, dict):
+        return "record must be an object"
+    for key in REQUIRED_FIELDS:
+        if not record.get(key):
+            return f"{key} is required"
+    for key in REQUIRED_FIELDS + ["phone"]:
+        value = record.get(key)
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            return f"{key} must be a string"
+        if key in MAX_LENGTHS and len(value) > MAX_LENGTHS[key]:
+            return f"{key} must be at most {MAX_LENGTHS[key]} characters"
+    return None
+
+
+def _import_chunk(records, first_row, executor, report):
+    valid = {}
+    for row, record in enumerate(records, first_row):
+        error = _validate(record)
+        if error:
+            report.invalid += 1
+            report.errors.append({"row": row, "message": error})
+        elif record["email"] in valid:
+            report.duplicates += 1
+        else:
+            valid[record["email"]] = record
+    existing = set(
+        db.session.scalars(select(User.email).where(User.email.in_(valid)))
+    )
+    report.duplicates += len(existing)
+    records = [r for email, r in valid.items() if email not in existing]
+    if not records:
+        return
+    hashes = hash_passwords([r["password"] for r in records], executor)
+    users, organisations, memberships = [], [], []
+    for record, pwhash in zip(records, hashes):
+        user_id, org_id = str(uuid.uuid4()), str(uuid.uuid4())
+        users.append(
+            {
+                "userId": user_id,
+                "firstName": record["firstName"],
+                "lastName": record["lastName"],
+                "email": record["email"],
+                "password": pwhash,
+                "phone": record.get("phone") or None,
+            }
+        )
+        organisations.append(
+            {
+                "org_id": org_id,
+                "name": f"{record['firstName']}'s Organisation"[
+                    :ORGANISATION_NAME_LENGTH
+                ],
+                "description": "",
+            }
+        )
+        memberships.append({"org_id": org_id, "user_id": user_id})
+    db.session.execute(insert(User), users)
+    db.session.execute(insert(Organisation), organisations)
+    db.session.execute(insert(organisation_user_table), memberships)
+    db.session.commit()
+    report.imported += len(records)
+
+
+def import_users(records, chunk_size=1000, workers=None, progress=None):
+    """
+    Imports user records, each with firstName, lastName, email, password
+    and an optional phone, creating a default organisation for every user.
+
+    Args:
+        records: An iterable of user records
+        chunk_size: Records hashed and written per transaction
+        workers: Hashing processes (defaults to the number of CPUs)
+        progress: Optional callback called with the report after each chunk
+
+    Returns:
+        An ImportReport
+    """
+    report = ImportReport()
+    start = perf_counter()
+    records = iter(records)
+    with ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(), mp_context=get_context("spawn")
+    ) as executor:
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            _import_chunk(chunk, report.rows + 1, executor, report)
+            report.rows += len(chunk)
+            report.seconds = perf_counter() - start
+            if progress:
+                progress(report)
+    report.seconds = perf_counter() - start
+    return report
+
+
+@click.command("import-users")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(["ndjson", "csv"]),
+    help="Input format; guessed from the file extension by default.",
+)
+@click.option("--chunk-size", default=1000, show_default=True)
+@click.option("--workers", type=int, help="Hashing processes.")
+@with_appcontext
+def import_users_command(file, fmt, chunk_size, workers):
+    """
+    Bulk-imports users from an NDJSON or CSV FILE ("-" for stdin).
+    """
+    if get_store() is not None:
+        raise click.ClickException("Not available with DATABASE_SHARDS set.")
+    fmt = fmt or ("csv" if file.name.endswith(".csv") else "ndjson")
+
+    def progress(report):
+        click.echo(
+            f"{report.rows} rows, {report.imported} imported "
+            f"({report.rows_per_second:.0f} rows/sec)"
+        )
+
+    report = import_users(
+        read_records(file, fmt), chunk_size, workers, progress
+    )
+    for error in report.errors:
+        click.echo(f"row {error['row']}: {error['message']}", err=True)
+    click.echo(
+        f"Imported {report.imported} of {report.rows} rows "
+        f"({report.duplicates} duplicates, {report.invalid} invalid) "
+        f"in {report.seconds:.1f}s, {report.rows_per_second:.0f} rows/sec"
+    )
+
+
+def import_request_body(stream, content_type):
+    """
+    Imports users from an uploaded request body of at most IMPORT_MAX_ROWS
+    rows.
+
+    Raises:
+        ImportTooLarge: If the body has more rows; nothing is imported
+    """
+    fmt = "csv" if content_type.startswith("text/csv") else "ndjson"
+    text = io.TextIOWrapper(stream, encoding="utf-8")
+    limit = current_app.config["IMPORT_MAX_ROWS"]
+    records = list(islice(read_records(text, fmt), limit + 1))
+    if len(records) > limit:
+        raise ImportTooLarge(limit)
+    return import_users(
+        records,
+        current_app.config["IMPORT_CHUNK_SIZE"],
+        current_app.config["IMPORT_HASH_WORKERS"],
+    )
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+This file defines the routes for the internal operations blueprint.
+
+These routes are not meant to be reachable from the internet: nginx blocks
+/internal, and every request must also send INTERNAL_TOKEN in the
+X-Internal-Token header. Without INTERNAL_TOKEN they refuse every request.
+"""
+import hmac
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from models.types import is_valid_id
+from app import metrics as request_metrics
+from app.exporter import FORMATS, export_organisations, gzipped
+from app.hashing import get_pool
+from app.importer import ImportTooLarge, import_request_body
+from app.pool import pool_stats
+from app.sharding import get_store
+
+internal = Blueprint("internal", __name__)
+
+
+@internal.before_request
+def check_internal_token():
+    token = current_app.config["INTERNAL_TOKEN"]
+    sent = request.headers.get("X-Internal-Token", "")
+    if not token or not hmac.compare_digest(sent.encode(), token.encode()):
+        return (
+            jsonify(
+                {
+                    "status": "Forbidden",
+                    "message": "Internal endpoint",
+                    "statusCode": 403,
+                }
+            ),
+            403,
+        )
+
+
+def _unavailable_with_shards():
+    # The bulk import and export use the primary database's tables
+    return (
+        jsonify(
+            {
+                "status": "Not Implemented",
+                "message": "Not available with sharded storage",
+                "statusCode": 501,
+            }
+        ),
+        501,
+    )
+
+
+@internal.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    This route returns the worker's runtime metrics.
+
+    Returns:
+        A JSON response with the hashing, connection pool and replica
+        statistics
+    """
+    stats = {"hashing": get_pool().stats(), "pools": pool_stats(current_app)}
+    replicas = current_app.extensions["replicas"]
+    if replicas is not None:
+        stats["replicas"] = replicas.stats()
+    return jsonify(stats)
+
+
+@internal.route("/metrics/prometheus", methods=["GET"])
+def prometheus_metrics():
+    """
+    This route returns the request metrics of all workers.
+
+    Returns:
+        The latency histograms and SQL, hashing and JSON totals by endpoint,
+        in the Prometheus text format
+    """
+    snapshots = current_app.extensions["metrics"].collect()
+    return Response(
+        request_metrics.render(snapshots),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+@internal.route("/users/import", methods=["POST"])
+def import_users():
+    """
+    This route bulk-imports users from an NDJSON (application/x-ndjson) or
+    CSV (text/csv) request body of at most IMPORT_MAX_ROWS rows; larger
+    bodies get a 413 and belong to the `flask import-users` command.
+
+    Returns:
+        A JSON response with the import report
+    """
+    if get_store() is not None:
+        return _unavailable_with_shards()
+    try:
+        report = import_request_body(
+            request.stream, request.content_type or ""
+        )
+    except ImportTooLarge as e:
+        return (
+            jsonify(
+                {
+                    "status": "Payload Too Large",
+                    "message": f"Imports over {e.limit} rows must use "
+                    "the flask import-users command",
+                    "statusCode": 413,
+                }
+            ),
+            413,
+        )
+    return (
+        jsonify(
+            {
+                "status": "success",
+                "message": "Users imported",
+                "data": report.to_dict(),
+            }
+        ),
+        200,
+    )
+
+
+@internal.route("/organisations/export", methods=["GET"])
+def export():
+    """
+    This route streams every organisation with its members, ordered by
+    orgId. The body is gzipped when the client accepts gzip.
+
+    Query parameters:
+        format: "ndjson" (the default) or "csv"
+        after: Resume after this orgId
+        limit: The most organisations to export (all by default)
+
+    Returns:
+        The NDJSON or CSV export (see app/exporter.py)
+    """
+    if get_store() is not None:
+        return _unavailable_with_shards()
+    fmt = request.args.get("format", "ndjson")
+    after = request.args.get("after")
+    limit = request.args.get("limit")
+    if (
+        fmt not in FORMATS
+        or (after is not None and not is_valid_id(after))
+        or (limit is not None and (not limit.isdigit() or int(limit) < 1))
+    ):
+        return (
+            jsonify(
+                {
+                    "status": "Bad Request",
+                    "message": "Client error",
+                    "statusCode": 400,
+                }
+            ),
+            400,
+        )
+    chunks = export_organisations(
+        fmt,
+        after,
+        None if limit is None else int(limit),
+        current_app.config["EXPORT_CHUNK_SIZE"],
+    )
+    headers = {"Vary": "Accept-Encoding"}
+    if "gzip" in request.accept_encodings:
+        chunks = gzipped(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(
+        stream_with_context(chunks),
+        mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+        headers=headers,
+    )
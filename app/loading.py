@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+This file defines how views declare the relationships they load.
+
+`User.organisations` and `Organisation.users` load lazily on first access,
+which turns any access inside a loop into one query per object (an N+1).
+Views therefore declare up front the relationships they need with
+`eager_loads`, e.g.
+
+    @eager_loads(selectinload(User.organisations))
+    def view(): ...
+
+and the loader options are added to every ORM query the view runs for the
+matching entities. With DB_STRICT_LOADING every other relationship is set
+to raise instead of loading lazily, so unplanned lazy loads fail loudly in
+development and tests rather than adding queries in production.
+"""
+from functools import wraps
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, raiseload
+
+
+def eager_loads(*options):
+    """
+    Declares the loader options a view's ORM queries need.
+
+    Args:
+        options: Loader options such as selectinload(User.organisations);
+            none means the view loads no relationships
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.eager_loads = options
+            return view(*args, **kwargs)
+
+        wrapper.eager_loads = options
+        return wrapper
+
+    return decorator
+
+
+def _apply_loader_options(state):
+    if (
+        not state.is_select
+        or state.is_column_load
+        or state.is_relationship_load
+        or not has_app_context()
+    ):
+        return
+    mappers = set(state.all_mappers)
+    options = [
+        option
+        for option in g.get("eager_loads", ())
+        if option.path[0] in mappers
+    ]
+    if current_app.config["DB_STRICT_LOADING"]:
+        options.append(raiseload("*"))
+    if options:
+        state.statement = state.statement.options(*options)
+
+
+def init_app(app):
+    """
+    Applies the views' declared loads (and strict loading) to ORM queries.
+    """
+    if not event.contains(Session, "do_orm_execute", _apply_loader_options):
+        event.listen(Session, "do_orm_execute", _apply_loader_options)
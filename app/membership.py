@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+"""
+This file defines the organisation membership checks used for authorization.
+
+Every check is answered by a single EXISTS query on the organisation_user
+table instead of loading and comparing `organisations` collections in
+Python. Results can optionally be kept in a short-lived per-worker cache
+(see MEMBERSHIP_CACHE_TTL). Cached results of the users whose memberships
+changed are dropped once the change is committed, so a concurrent request
+cannot cache the old result again after they were dropped. With shards
+configured, the checks and writes go to the ShardedStore instead.
+"""
+import uuid
+from flask import current_app
+from sqlalchemy import event, exists, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import aliased
+from models.organisation import organisation_user_table
+from models.types import is_valid_id
+from models.user import User
+from app.cache import TTLCache
+from app.replicas import RoutingSession
+from app.sharding import get_store
+from app import db
+
+
+def init_app(app):
+    """
+    Creates the membership cache for the app.
+    """
+    app.extensions["membership_cache"] = TTLCache(
+        maxsize=app.config["MEMBERSHIP_CACHE_SIZE"],
+        ttl=app.config["MEMBERSHIP_CACHE_TTL"],
+    )
+    event.listen(RoutingSession, "after_commit", _invalidate_committed)
+    event.listen(RoutingSession, "after_rollback", _discard_pending)
+
+
+def _cache():
+    return current_app.extensions["membership_cache"]
+
+
+def shares_organisation(user_id, other_id):
+    """
+    Checks whether two users belong to at least one common organisation.
+
+    Args:
+        user_id: The id of the first user
+        other_id: The id of the second user
+
+    Returns:
+        True if both users are members of the same organisation
+    """
+    key = ("shares",) + tuple(sorted((user_id, other_id)))
+    cached = _cache().get(key)
+    if cached is not None:
+        return cached
+    store = get_store()
+    if store is not None:
+        result = store.shares_organisation(user_id, other_id)
+    else:
+        mine = aliased(organisation_user_table)
+        theirs = aliased(organisation_user_table)
+        result = db.session.execute(
+            select(
+                exists()
+                .where(mine.c.user_id == user_id)
+                .where(theirs.c.org_id == mine.c.org_id)
+                .where(theirs.c.user_id == other_id)
+            )
+        ).scalar()
+    _cache().set(key, result)
+    return result
+
+
+def is_member(user_id, org_id):
+    """
+    Checks whether a user belongs to an organisation.
+
+    Args:
+        user_id: The id of the user
+        org_id: The id of the organisation
+
+    Returns:
+        True if the user is a member of the organisation
+    """
+    key = ("member", user_id, org_id)
+    cached = _cache().get(key)
+    if cached is not None:
+        return cached
+    store = get_store()
+    if store is not None:
+        result = store.is_member(user_id, org_id)
+    else:
+        t = organisation_user_table
+        result = db.session.execute(
+            select(
+                exists()
+                .where(t.c.user_id == user_id)
+                .where(t.c.org_id == org_id)
+            )
+        ).scalar()
+    _cache().set(key, result)
+    return result
+
+
+def invalidate(*user_ids):
+    """
+    Drops every cached membership result of the given users. Call this
+    whenever a user joins or leaves an organisation.
+    """
+    ids = set(user_ids)
+    _cache().discard_where(lambda key: not ids.isdisjoint(key[1:]))
+
+
+def _invalidate_after_commit(user_ids):
+    pending = db.session.info.setdefault("stale_memberships", set())
+    pending.update(user_ids)
+
+
+def _invalidate_committed(session):
+    user_ids = session.info.pop("stale_memberships", None)
+    if user_ids:
+        invalidate(*user_ids)
+
+
+def _discard_pending(session):
+    session.info.pop("stale_memberships", None)
+
+
+def _insert_ignoring_duplicates(rows):
+    """
+    Returns a multi-row INSERT into organisation_user that skips rows which
+    already exist instead of failing on the primary key.
+    """
+    t = organisation_user_table
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(t).values(rows).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        return t.insert().values(rows).prefix_with("OR IGNORE")
+    return t.insert().values(rows)
+
+
+def add_members(org_id, user_ids):
+    """
+    Adds users to an organisation in a single statement. Users that are
+    already members are left untouched. The caller commits the session,
+    which drops the users' cached membership results.
+
+    Args:
+        org_id: The id of the organisation
+        user_ids: The ids of the users to add
+
+    Returns:
+        The number of memberships that were created
+    """
+    if not user_ids:
+        return 0
+    store = get_store()
+    if store is not None:
+        created = len(store.add_members(org_id, user_ids))
+        # The store has committed already
+        invalidate(*user_ids)
+        return created
+    created = db.session.execute(
+        _insert_ignoring_duplicates(
+            [{"org_id": org_id, "user_id": u} for u in user_ids]
+        )
+    ).rowcount
+    _invalidate_after_commit(user_ids)
+    return created
+
+
+def add_member(org_id, user_id):
+    """
+    Adds a user to an organisation if they are not a member already.
+
+    Returns:
+        True if the membership was created
+    """
+    return add_members(org_id, [user_id]) > 0
+
+
+def add_members_bulk(org_id, user_ids):
+    """
+    Adds many users to an organisation using one query to find the users,
+    one to find existing memberships and one multi-row insert. The caller
+    commits the session.
+
+    Args:
+        org_id: The id of the organisation
+        user_ids: The ids of the users to add
+
+    Returns:
+        A list of (user id, result) pairs in input order, one for each
+        distinct id as the client spelt it, where result is "added",
+        "already-member" or "not-found". Spellings of the same UUID share
+        a result.
+    """
+    # Ids are matched in their canonical form, as the database returns them
+    canonical = {
+        user_id: str(uuid.UUID(user_id)) if is_valid_id(user_id) else None
+        for user_id in user_ids
+    }
+    valid_ids = list(dict.fromkeys(filter(None, canonical.values())))
+    store = get_store()
+    if store is not None:
+        found = {row.userId for row in store.users(valid_ids)}
+        added = store.add_members(
+            org_id, [u for u in valid_ids if u in found]
+        )
+        members = found - set(added)
+        invalidate(*added)
+        return _bulk_results(canonical, found, members)
+    found = set(
+        db.session.scalars(select(User.userId).where(User.userId.in_(valid_ids)))
+    )
+    t = organisation_user_table
+    members = set(
+        db.session.scalars(
+            select(t.c.user_id)
+            .where(t.c.org_id == org_id)
+            .where(t.c.user_id.in_(found))
+        )
+    )
+    add_members(org_id, [u for u in valid_ids if u in found - members])
+    return _bulk_results(canonical, found, members)
+
+
+def _bulk_results(canonical, found, members):
+    return [
+        (
+            user_id,
+            (
+                "not-found"
+                if canonical[user_id] not in found
+                else (
+                    "already-member"
+                    if canonical[user_id] in members
+                    else "added"
+                )
+            ),
+        )
+        for user_id in canonical
+    ]
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+"""
+This file defines the per-request performance instrumentation.
+
+Every request records its latency in a histogram per endpoint, method and
+status, and adds up where its time went: SQL statements (counted through
+engine events), password hashes and JSON encoding. The totals are kept per
+worker and exported in the Prometheus text format by /internal/metrics.
+
+gunicorn workers are separate processes, so when METRICS_DIR is set each
+worker also writes its totals to a file in that directory (at most every
+METRICS_FLUSH_SECONDS) and a scrape served by any worker adds up the files
+of all workers, including ones that have exited, so counters never go
+backwards. The directory is emptied when gunicorn starts.
+
+Requests slower than SLOW_REQUEST_SECONDS are logged with their breakdown.
+"""
+import json
+import os
+import uuid
+from threading import Lock
+from time import monotonic, perf_counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-request totals, exported as <name>_total counters labelled by endpoint
+COUNTERS = {
+    "sql_statements": "SQL statements executed",
+    "sql_seconds": "Seconds spent executing SQL statements",
+    "hashes": "Password hashes computed or verified",
+    "hash_seconds": "Seconds spent hashing passwords",
+    "json_seconds": "Seconds spent encoding JSON responses",
+}
+
+
+class RequestTimings:
+    """
+    Where the time of the current request went.
+    """
+
+    __slots__ = ("start", "counts")
+
+    def __init__(self):
+        self.start = perf_counter()
+        self.counts = dict.fromkeys(COUNTERS, 0)
+
+
+class MetricsRegistry:
+    """
+    The request metrics of one worker.
+    """
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._pid = None
+        self._reset()
+
+    def _reset(self):
+        # (endpoint, method, status) -> [bucket counts..., sum, count]
+        self.histograms = {}
+        # (counter, endpoint) -> total
+        self.counters = {}
+        self._flushed = monotonic()
+
+    def _check_pid(self):
+        # A forked worker starts from scratch with a file of its own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._path = None
+            if self.directory:
+                name = f"{self._pid}-{uuid.uuid4().hex[:8]}.json"
+                self._path = os.path.join(self.directory, name)
+            self._reset()
+
+    def observe(self, endpoint, method, status, seconds, counts):
+        """
+        Records a finished request.
+        """
+        with self._lock:
+            self._check_pid()
+            key = (endpoint, method, str(status))
+            series = self.histograms.get(key)
+            if series is None:
+                series = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+            for name, value in counts.items():
+                if value:
+                    key = (name, endpoint)
+                    self.counters[key] = self.counters.get(key, 0) + value
+            if self._path and monotonic() - self._flushed > self.flush_interval:
+                self._flush()
+
+    def snapshot(self):
+        """
+        Returns this worker's totals as JSON-serialisable lists.
+        """
+        return {
+            "histograms": [
+                [*key, series] for key, series in self.histograms.items()
+            ],
+            "counters": [
+                [*key, value] for key, value in self.counters.items()
+            ],
+        }
+
+    def _flush(self):
+        temporary = f"{self._path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, self._path)
+        self._flushed = monotonic()
+
+    def collect(self):
+        """
+        Returns the totals of every worker sharing the metrics directory, or
+        of this worker alone without one.
+        """
+        with self._lock:
+            self._check_pid()
+            if not self._path:
+                return [self.snapshot()]
+            self._flush()
+        snapshots = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed or being replaced; its totals come next scrape
+                continue
+        return snapshots
+
+
+def merge(snapshots):
+    """
+    Adds up the totals of several workers.
+    """
+    histograms, counters = {}, {}
+    for snapshot in snapshots:
+        for *key, series in snapshot["histograms"]:
+            total = histograms.setdefault(tuple(key), [0] * len(series))
+            for i, value in enumerate(series):
+                total[i] += value
+        for *key, value in snapshot["counters"]:
+            counters[tuple(key)] = counters.get(tuple(key), 0) + value
+    return histograms, counters
+
+
+def _labels(**labels):
+    def escape(value):
+        return (
+            str(value)
+            .replace("\\", "\\\\")
+            .replace('"', '\\"')
+            .replace("\n", "\\n")
+        )
+
+    return ",".join(f'{k}="{escape(v)}"' for k, v in labels.items())
+
+
+def render(snapshots):
+    """
+    Renders the totals of several workers in the Prometheus text format.
+    """
+    histograms, counters = merge(snapshots)
+    name = "http_request_duration_seconds"
+    lines = [
+        f"# HELP {name} Request latency by endpoint, method and status.",
+        f"# TYPE {name} histogram",
+    ]
+    for (endpoint, method, status), series in sorted(histograms.items()):
+        labels = _labels(endpoint=endpoint, method=method, status=status)
+        for bound, count in zip(BUCKETS, series):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {series[-1]}')
+        lines.append(f"{name}_sum{{{labels}}} {series[-2]}")
+        lines.append(f"{name}_count{{{labels}}} {series[-1]}")
+    for counter, description in COUNTERS.items():
+        name = f"http_request_{counter}_total"
+        lines.append(f"# HELP {name} {description}, by endpoint.")
+        lines.append(f"# TYPE {name} counter")
+        for (kind, endpoint), value in sorted(counters.items()):
+            if kind == counter:
+                lines.append(f"{name}{{{_labels(endpoint=endpoint)}}} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def record(kind, seconds):
+    """
+    Adds time spent on hashing ("hash") or JSON encoding ("json") to the
+    current request, if there is one.
+    """
+    if has_request_context():
+        timings = g.get("timings")
+        if timings is not None:
+            counts = timings.counts
+            if kind == "hash":
+                counts["hashes"] += 1
+            counts[f"{kind}_seconds"] += seconds
+
+
+def _start_request():
+    g.timings = RequestTimings()
+
+
+def _finish_request(response):
+    timings = g.pop("timings", None)
+    if timings is None:
+        return response
+    seconds = perf_counter() - timings.start
+    endpoint = request.endpoint or "unmatched"
+    current_app.extensions["metrics"].observe(
+        endpoint, request.method, response.status_code, seconds, timings.counts
+    )
+    slow = current_app.config["SLOW_REQUEST_SECONDS"]
+    if slow and seconds >= slow:
+        counts = timings.counts
+        current_app.logger.warning(
+            "Slow request: %s %s (%s) %d in %.3fs; sql %d statements "
+            "%.3fs, hashing %d %.3fs, json %.3fs",
+            request.method,
+            request.path,
+            endpoint,
+            response.status_code,
+            seconds,
+            counts["sql_statements"],
+            counts["sql_seconds"],
+            counts["hashes"],
+            counts["hash_seconds"],
+            counts["json_seconds"],
+        )
+    return response
+
+
+def instrument(engine):
+    """
+    Counts the statements an engine runs for the current request.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, params, context, many):
+        if context is not None:
+            context.metrics_start = perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, params, context, many):
+        if context is None or not has_request_context():
+            return
+        timings = g.get("timings")
+        if timings is not None:
+            timings.counts["sql_statements"] += 1
+            timings.counts["sql_seconds"] += (
+                perf_counter() - context.metrics_start
+            )
+
+
+def init_app(app, db):
+    """
+    Instruments the app's requests and database engines.
+    """
+    directory = app.config["METRICS_DIR"]
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    app.extensions["metrics"] = MetricsRegistry(
+        directory, app.config["METRICS_FLUSH_SECONDS"]
+    )
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument(engine)
+
+
+def clear_directory(directory):
+    """
+    Removes the metrics files of a previous run.
+    """
+    if directory and os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.endswith((".json", ".json.tmp")):
+                os.unlink(os.path.join(directory, name))
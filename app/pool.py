@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+"""
+This file defines the database connection pool profiles and pool metrics.
+
+DB_POOL_PROFILE picks a set of engine options and the individual DB_POOL_*
+variables override them:
+
+    default     SQLAlchemy's defaults
+    web         A small pool per worker with pre-ping and recycling
+    pgbouncer   No client-side pooling and no server-side prepared
+                statements, for PgBouncer in transaction pooling mode
+
+Every engine reports connects, checkouts, checkout wait time, timeouts and
+overflow use, which /internal/metrics exposes.
+"""
+from time import perf_counter
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+from app.hashing import LatencyStats
+
+POOL_PROFILES = {
+    "default": {},
+    "web": {
+        "pool_size": 5,
+        "max_overflow": 5,
+        "pool_timeout": 5,
+        "pool_recycle": 1800,
+        "pool_pre_ping": True,
+    },
+    "pgbouncer": {"poolclass": NullPool},
+}
+
+# Environment variables that override a profile, with their converters
+POOL_OVERRIDES = {
+    "DB_POOL_SIZE": ("pool_size", int),
+    "DB_MAX_OVERFLOW": ("max_overflow", int),
+    "DB_POOL_TIMEOUT": ("pool_timeout", float),
+    "DB_POOL_RECYCLE": ("pool_recycle", int),
+    "DB_POOL_PRE_PING": ("pool_pre_ping", lambda v: v.lower() == "true"),
+}
+
+
+class PoolStats:
+    """
+    Counts the events of one engine's connection pool.
+    """
+
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait = LatencyStats()
+
+    def to_dict(self, pool):
+        stats = {
+            "pool": type(pool).__name__,
+            "connects": self.connects,
+            "checkouts": self.checkouts,
+            "checkins": self.checkins,
+            "invalidations": self.invalidations,
+            "timeouts": self.timeouts,
+            "checkoutWait": self.wait.to_dict(),
+        }
+        if isinstance(pool, QueuePool):
+            stats.update(
+                {
+                    "size": pool.size(),
+                    "checkedOut": pool.checkedout(),
+                    "checkedIn": pool.checkedin(),
+                    "overflow": max(pool.overflow(), 0),
+                }
+            )
+        return stats
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A QueuePool that records how long each checkout waited for a connection.
+    """
+
+    stats = None
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            if self.stats:
+                self.stats.timeouts += 1
+            raise
+        finally:
+            if self.stats:
+                self.stats.wait.observe(perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def engine_options(uri, profile, environ):
+    """
+    Builds the SQLAlchemy engine options for a database URI.
+
+    Args:
+        uri: The database URI
+        profile: The name of a pool profile
+        environ: A mapping holding the DB_POOL_* overrides
+    """
+    if profile not in POOL_PROFILES:
+        raise ValueError(f"Unknown pool profile '{profile}'.")
+    url = make_url(uri)
+    if url.get_backend_name() == "sqlite" and url.database in (
+        None,
+        "",
+        ":memory:",
+    ):
+        # In-memory SQLite uses a single static connection
+        return {}
+    options = dict(POOL_PROFILES[profile])
+    for name, (option, convert) in POOL_OVERRIDES.items():
+        if environ.get(name):
+            options[option] = convert(environ[name])
+    if profile == "pgbouncer":
+        if url.get_driver_name() == "psycopg":
+            options["connect_args"] = {"prepare_threshold": None}
+        elif url.get_driver_name() == "asyncpg":
+            options["connect_args"] = {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+            }
+    if options.get("poolclass", QueuePool) is QueuePool:
+        options["poolclass"] = InstrumentedQueuePool
+    else:
+        for option in ["pool_size", "max_overflow", "pool_timeout"]:
+            options.pop(option, None)
+    return options
+
+
+def instrument(engine):
+    """
+    Attaches a PoolStats to an engine's pool and returns it.
+    """
+    stats = PoolStats()
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.stats = stats
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        stats.connects += 1
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.checkouts += 1
+
+    @event.listens_for(engine, "checkin")
+    def on_checkin(dbapi_connection, connection_record):
+        stats.checkins += 1
+
+    @event.listens_for(engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        stats.invalidations += 1
+
+    return stats
+
+
+def init_app(app, db):
+    """
+    Instruments every engine of the app.
+    """
+    with app.app_context():
+        app.extensions["pool_stats"] = {
+            key or "default": (engine, instrument(engine))
+            for key, engine in db.engines.items()
+        }
+
+
+def after_fork(app):
+    """
+    Drops the connections a forked worker inherited from its parent.
+
+    The parent keeps using its own connections, so they are discarded
+    without being closed, and the worker starts with fresh pool metrics.
+    """
+    for engine, stats in app.extensions["pool_stats"].values():
+        engine.dispose(close=False)
+        stats.__init__()
+
+
+def pool_stats(app):
+    return {
+        key: stats.to_dict(engine.pool)
+        for key, (engine, stats) in app.extensions["pool_stats"].items()
+    }
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+This file defines the routing of read-only requests to database replicas.
+
+With DATABASE_REPLICA_URIS set, every GET or HEAD request checks out a
+connection to one replica when it starts, picked by DB_REPLICA_STRATEGY:
+
+    round-robin         Each replica in turn
+    least-connections   The replica with the fewest requests in flight in
+                        this worker
+
+The session sends plain SELECTs to that connection and everything else
+(flushes, INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE, raw SQL) to the
+primary. Once anything has gone to the primary the rest of the request
+stays there, so a request always reads its own writes. Other requests, the
+CLI and the tests without replicas use the primary only.
+
+A replica that cannot be connected to, or drops its connection, is skipped
+for DB_REPLICA_RETRY_SECONDS and the request falls back to the next replica
+or the primary. Replicas may lag behind the primary: a read that must see
+a write from an earlier request (such as the user behind a fresh token)
+can call `use_primary()` and retry.
+"""
+from itertools import count
+from threading import Lock
+from time import monotonic
+from flask import current_app, g, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from app.pool import engine_options
+
+STRATEGIES = ("round-robin", "least-connections")
+
+# Request methods served from a replica
+READ_METHODS = frozenset(["GET", "HEAD"])
+
+
+def _is_read(clause):
+    return (
+        clause is not None
+        and getattr(clause, "is_select", False)
+        and getattr(clause, "_for_update_arg", None) is None
+    )
+
+
+class RoutingSession(Session):
+    """
+    A session that sends the reads of a read-only request to its replica
+    connection.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get("replica")
+        if replica is not None and bind is None:
+            if _is_read(clause):
+                return replica
+            # Anything else pins the rest of the request to the primary
+            del self.info["replica"]
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
+class Replica:
+    """
+    One replica engine and its usage in this worker.
+    """
+
+    __slots__ = ("name", "engine", "in_use", "checkouts", "down_until")
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.in_use = 0
+        self.checkouts = 0
+        self.down_until = 0.0
+
+    def to_dict(self, now):
+        return {
+            "name": self.name,
+            "inUse": self.in_use,
+            "checkouts": self.checkouts,
+            "down": self.down_until > now,
+        }
+
+
+class ReplicaSet:
+    """
+    Picks the replica for each read-only request.
+    """
+
+    def __init__(self, engines, strategy="round-robin", retry_seconds=30.0):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown replica strategy '{strategy}'.")
+        self.replicas = [
+            Replica(name, engine) for name, engine in engines.items()
+        ]
+        self.strategy = strategy
+        self.retry_seconds = retry_seconds
+        self.fallbacks = 0
+        self._turn = count()
+        self._lock = Lock()
+
+    def candidates(self):
+        """
+        Returns the replicas that are up, in the order to try them.
+        """
+        now = monotonic()
+        with self._lock:
+            start = next(self._turn) % len(self.replicas)
+            rotated = self.replicas[start:] + self.replicas[:start]
+            if self.strategy == "least-connections":
+                rotated.sort(key=lambda replica: replica.in_use)
+        return [replica for replica in rotated if replica.down_until <= now]
+
+    def mark_down(self, replica):
+        replica.down_until = monotonic() + self.retry_seconds
+
+    def checkout(self):
+        """
+        Connects to the first replica that answers.
+
+        Returns:
+            A (replica, connection) pair, or None to use the primary
+        """
+        for replica in self.candidates():
+            try:
+                connection = replica.engine.connect()
+            except DBAPIError as error:
+                self.mark_down(replica)
+                current_app.logger.warning(
+                    "Replica %s unavailable for %ss: %s",
+                    replica.name,
+                    self.retry_seconds,
+                    error.orig,
+                )
+                continue
+            with self._lock:
+                replica.in_use += 1
+                replica.checkouts += 1
+            return replica, connection
+        with self._lock:
+            self.fallbacks += 1
+        return None
+
+    def release(self, replica, connection):
+        connection.close()
+        with self._lock:
+            replica.in_use -= 1
+
+    def stats(self):
+        now = monotonic()
+        return {
+            "strategy": self.strategy,
+            "fallbacks": self.fallbacks,
+            "replicas": [replica.to_dict(now) for replica in self.replicas],
+        }
+
+
+def binds(uris, profile, environ):
+    """
+    Builds the SQLALCHEMY_BINDS entries of the replicas.
+
+    Args:
+        uris: The replica database URIs
+        profile: The name of the pool profile, as for the primary
+        environ: A mapping holding the DB_POOL_* overrides
+    """
+    return {
+        f"replica_{i}": {"url": uri, **engine_options(uri, profile, environ)}
+        for i, uri in enumerate(uris, 1)
+    }
+
+
+def _watch(replica_set, replica):
+    @event.listens_for(replica.engine, "handle_error")
+    def on_error(context):
+        if context.is_disconnect:
+            replica_set.mark_down(replica)
+
+
+def use_primary():
+    """
+    Sends the rest of the current request's queries to the primary.
+
+    Returns:
+        True if the request was reading from a replica
+    """
+    from app import db
+
+    return db.session.info.pop("replica", None) is not None
+
+
+def _route_request():
+    if request.method not in READ_METHODS:
+        return
+    from app import db
+
+    checkout = current_app.extensions["replicas"].checkout()
+    if checkout is not None:
+        g.replica = checkout
+        db.session.info["replica"] = checkout[1]
+
+
+def _release_replica(exc):
+    checkout = g.pop("replica", None)
+    if checkout is None:
+        return
+    from app import db
+
+    # End the session's transaction before giving the connection back
+    db.session.close()
+    db.session.info.pop("replica", None)
+    current_app.extensions["replicas"].release(*checkout)
+
+
+def init_app(app, db):
+    """
+    Routes the app's read-only requests to the configured replicas.
+    """
+    with app.app_context():
+        engines = {
+            key: engine
+            for key, engine in db.engines.items()
+            if key and key.startswith("replica_")
+        }
+    for key in engines:
+        # The binds hold no tables of their own; without their (shared)
+        # metadata create_all and drop_all leave them alone
+        db.metadatas.pop(key, None)
+    if not engines:
+        app.extensions["replicas"] = None
+        return
+    replica_set = ReplicaSet(
+        engines,
+        app.config["DB_REPLICA_STRATEGY"],
+        app.config["DB_REPLICA_RETRY_SECONDS"],
+    )
+    for replica in replica_set.replicas:
+        _watch(replica_set, replica)
+    app.extensions["replicas"] = replica_set
+    app.before_request(_route_request)
+    app.teardown_request(_release_replica)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+"""
+This file defines the ranked search over organisations and users.
+
+A query is split into lower-cased terms of at least MIN_TERM_LENGTH
+characters. An "exact" search finds the rows containing every term (so
+prefixes and parts of words match too). A "fuzzy" search finds the rows
+sharing trigrams with the terms, so misspellings still match. With the
+default "auto" matching, a first page without exact results is searched
+fuzzily instead.
+
+SQLite searches the FTS5 trigram tables, ranked by bm25, and Postgres the
+pg_trgm indexes, ranked by trigram similarity (see models/search.py).
+Other databases fall back to exact matching with a scan, by name.
+
+Results are ranked over every match, so a term matching a large share of
+the rows (such as a three-letter syllable) costs more than a specific
+one; on SQLite the ranking is done inside FTS5 and the joins stop at the
+page size.
+"""
+from sqlalchemy import and_, exists, func, literal, select
+from models.organisation import Organisation, organisation_user_table
+from models.search import (
+    document,
+    organisations_search,
+    organisations_search_keys,
+    users_search,
+    users_search_keys,
+)
+from models.user import User
+from app.dto import OrganisationDTO, UserDTO
+from app import db
+
+MATCH_MODES = ("auto", "exact", "fuzzy")
+# Shorter terms have no trigrams and are ignored
+MIN_TERM_LENGTH = 3
+# Most trigrams a fuzzy query looks up
+MAX_TRIGRAMS = 32
+
+
+def terms(q):
+    """
+    Returns the searchable terms of a query, lower-cased, in order.
+    """
+    words = []
+    for word in q.lower().split():
+        if len(word) >= MIN_TERM_LENGTH and word not in words:
+            words.append(word)
+    return words
+
+
+def trigrams(words):
+    grams = []
+    for word in words:
+        for i in range(len(word) - 2):
+            if word[i : i + 3] not in grams:
+                grams.append(word[i : i + 3])
+    return grams[:MAX_TRIGRAMS]
+
+
+def _fts_phrase(value):
+    return '"' + value.replace('"', '""') + '"'
+
+
+def _search(model, index, keys, key, columns, scope, words, fuzzy):
+    """
+    Builds the ranked query for one mode on the app's database.
+
+    Args:
+        model: Organisation or User
+        index, keys: The model's FTS5 table and key table
+        key: The model's id column
+        columns: The columns to select
+        scope: A condition restricting the rows to those the caller may see
+        words: The query terms
+        fuzzy: Whether to match trigrams instead of every term
+
+    Returns:
+        The query, or None if the database cannot match fuzzily
+    """
+    dialect = db.engine.dialect.name
+    name = model.name if model is Organisation else model.firstName
+    query = select(*columns).where(scope)
+    if dialect == "sqlite":
+        if fuzzy:
+            match = " OR ".join(_fts_phrase(g) for g in trigrams(words))
+        else:
+            match = " ".join(_fts_phrase(word) for word in words)
+        return (
+            query.join(keys, keys.c[key.key] == key)
+            .join(index, index.c.rowid == keys.c.rowid)
+            .where(index.c[index.name].op("MATCH")(match))
+            # FTS5 hands the matches over in rank order
+            .order_by(index.c.rank)
+        )
+    text = document(model)
+    q = literal(" ".join(words))
+    if fuzzy:
+        if dialect != "postgresql":
+            return None
+        return query.where(q.op("<%")(text)).order_by(
+            func.word_similarity(q, text).desc(), name, key
+        )
+    query = query.where(
+        and_(*[text.contains(word, autoescape=True) for word in words])
+    )
+    if dialect == "postgresql":
+        return query.order_by(func.similarity(text, q).desc(), name, key)
+    return query.order_by(name, key)
+
+
+def _run(build, words, match, limit, offset):
+    """
+    Runs an exact or fuzzy search, as `match` asks.
+
+    Returns:
+        The rows (up to limit + 1, to tell whether there is a next page)
+        and the mode that produced them
+    """
+    rows = []
+    if match != "fuzzy":
+        rows = db.session.execute(
+            build(words, False).limit(limit + 1).offset(offset)
+        ).all()
+        if rows or match == "exact" or offset:
+            return rows, "exact"
+    query = build(words, True)
+    if query is None:
+        return rows, "exact"
+    rows = db.session.execute(query.limit(limit + 1).offset(offset)).all()
+    return rows, "fuzzy"
+
+
+def search_organisations(user_id, words, match, limit, offset):
+    """
+    Searches the organisations a user belongs to by name and description.
+
+    Returns:
+        The OrganisationDTOs (up to limit + 1) and the mode used
+    """
+    t = organisation_user_table
+    scope = exists().where(
+        t.c.org_id == Organisation.org_id, t.c.user_id == user_id
+    )
+
+    def build(words, fuzzy):
+        return _search(
+            Organisation,
+            organisations_search,
+            organisations_search_keys,
+            Organisation.org_id,
+            OrganisationDTO.columns,
+            scope,
+            words,
+            fuzzy,
+        )
+
+    rows, mode = _run(build, words, match, limit, offset)
+    return [OrganisationDTO.from_row(row) for row in rows], mode
+
+
+def search_members(user_id, words, match, limit, offset, org_id=None):
+    """
+    Searches the users sharing an organisation with a user (or belonging to
+    one of their organisations) by name and email.
+
+    Returns:
+        The UserDTOs (up to limit + 1) and the mode used
+    """
+    mine = organisation_user_table.alias("mine")
+    theirs = organisation_user_table.alias("theirs")
+    if org_id is None:
+        scope = exists().where(
+            theirs.c.user_id == User.userId,
+            mine.c.org_id == theirs.c.org_id,
+            mine.c.user_id == user_id,
+        )
+    else:
+        scope = exists().where(
+            theirs.c.user_id == User.userId, theirs.c.org_id == org_id
+        )
+
+    def build(words, fuzzy):
+        return _search(
+            User,
+            users_search,
+            users_search_keys,
+            User.userId,
+            UserDTO.columns,
+            scope,
+            words,
+            fuzzy,
+        )
+
+    rows, mode = _run(build, words, match, limit, offset)
+    return [UserDTO.from_row(row) for row in rows], mode
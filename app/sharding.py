@@ -0,0 +1,752 @@
+#!/usr/bin/env python
+"""
+This file defines the optional hash-sharded storage of users and
+organisations.
+
+DATABASE_SHARDS names the shard databases (`name=uri,name=uri,...`). Every
+user lives on the shard its userId hashes to and every organisation on the
+shard its org_id hashes to, using rendezvous hashing over the shard names:
+adding a shard only moves the rows the new shard wins, and removing one
+only moves its own rows. Names, not URIs, decide placement, so a shard can
+move to another server under the same name.
+
+Memberships are stored alongside the organisation (organisation_user on
+the organisation's shard) and mirrored on the member's shard
+(user_organisations), so listing an organisation's members and a user's
+organisations each start on a single shard. The rows they point to are
+then read with one query per shard involved. A user's refresh token
+families live on the user's shard too.
+
+Emails are unique across shards through the shard_directory table in the
+primary database (DATABASE_URI), which maps each email to its userId, so a
+login is one directory lookup and one read on the user's shard instead of
+a query to every shard.
+
+With shards configured, the auth routes, the JWT identity, the membership
+checks and the /api routes read and write users, organisations and
+memberships through the app's ShardedStore (`get_store()`) instead of
+db.session. The searches and the bulk import and export read the primary
+tables and are not available.
+
+Writes that touch two shards are not atomic: the organisation's shard is
+the source of truth for memberships and is written first.
+
+After adding shards to DATABASE_SHARDS, or to empty one before removing
+it, move the rows to their new shards with
+
+    flask --app run shards rebalance [--drain NAME]
+
+Moves are copied then deleted in chunks and a rebalance can be re-run
+after an interruption. Rows are briefly unreachable while they move, so
+rebalance while writes are paused.
+"""
+import hashlib
+import uuid
+from collections import defaultdict
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    MetaData,
+    String,
+    Table,
+    delete,
+    exists,
+    func,
+    insert,
+    select,
+    update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from models.organisation import Organisation
+from models.refresh_token import RefreshToken
+from models.types import GUID
+from models.user import User
+from app.pool import engine_options
+
+# The tables of each shard: copies of the app's users, organisations and
+# refresh_tokens tables, and both halves of every membership
+shard_metadata = MetaData()
+shard_users = User.__table__.to_metadata(shard_metadata)
+shard_organisations = Organisation.__table__.to_metadata(shard_metadata)
+shard_refresh_tokens = RefreshToken.__table__.to_metadata(shard_metadata)
+shard_members = Table(
+    "organisation_user",
+    shard_metadata,
+    Column(
+        "org_id",
+        GUID(),
+        ForeignKey("organisations.org_id"),
+        primary_key=True,
+    ),
+    # The user may live on another shard
+    Column("user_id", GUID(), primary_key=True),
+)
+shard_user_organisations = Table(
+    "user_organisations",
+    shard_metadata,
+    Column("user_id", GUID(), ForeignKey("users.userId"), primary_key=True),
+    # The organisation may live on another shard
+    Column("org_id", GUID(), primary_key=True),
+)
+
+# The email directory, in the primary database
+directory_metadata = MetaData()
+directory_table = Table(
+    "shard_directory",
+    directory_metadata,
+    Column("email", String(50), primary_key=True),
+    Column("user_id", GUID(), nullable=False),
+    Index("ix_shard_directory_user_id", "user_id"),
+)
+
+# Most org_ids sent in one IN list by ShardedStore.shares_organisation
+SHARED_ORGANISATIONS_CHUNK = 500
+
+# What moves together when a row changes shards: the table, its key, and
+# the (table, key column) of the rows stored with it
+PLACEMENTS = {
+    "users": (
+        shard_users,
+        "userId",
+        [
+            (shard_user_organisations, "user_id"),
+            (shard_refresh_tokens, "user_id"),
+        ],
+    ),
+    "organisations": (
+        shard_organisations,
+        "org_id",
+        [(shard_members, "org_id")],
+    ),
+}
+
+
+def owner(key, names):
+    """
+    Returns the name of the shard a userId or org_id belongs to.
+
+    Args:
+        key: The id, as a string or uuid.UUID
+        names: The names of the shards to choose from
+    """
+    key = str(uuid.UUID(str(key)))
+    return max(
+        names,
+        key=lambda name: hashlib.blake2b(
+            f"{name}/{key}".encode(), digest_size=8
+        ).digest(),
+    )
+
+
+def parse(value):
+    """
+    Parses DATABASE_SHARDS (`name=uri,name=uri,...`) into a dict.
+    """
+    shards = {}
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, sep, uri = entry.partition("=")
+        if not sep or not name.strip() or not uri.strip():
+            raise ValueError(f"Invalid shard '{entry.strip()}', use name=uri.")
+        shards[name.strip()] = uri.strip()
+    return shards
+
+
+def binds(shards, profile, environ):
+    """
+    Builds the SQLALCHEMY_BINDS entries of the shards.
+
+    Args:
+        shards: A dict of shard names to database URIs
+        profile: The name of the pool profile, as for the primary
+        environ: A mapping holding the DB_POOL_* overrides
+    """
+    return {
+        f"shard_{name}": {"url": uri, **engine_options(uri, profile, environ)}
+        for name, uri in shards.items()
+    }
+
+
+def _insert_ignoring_duplicates(connection, table, rows, key):
+    """
+    Inserts rows, skipping those whose primary key already exists, so two
+    concurrent adds of the same row both succeed.
+
+    Returns:
+        The set of the `key` column of the rows actually inserted
+    """
+    dialect = connection.dialect.name
+    if dialect == "postgresql":
+        statement = postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect == "sqlite":
+        statement = sqlite.insert(table).on_conflict_do_nothing()
+    else:
+        connection.execute(insert(table), rows)
+        return {row[key] for row in rows}
+    return set(
+        connection.scalars(statement.values(rows).returning(table.c[key]))
+    )
+
+
+class RebalanceReport:
+    """
+    Counts the rows a rebalance moved.
+    """
+
+    def __init__(self):
+        self.scanned = 0
+        self.moved = defaultdict(int)
+
+    def to_dict(self):
+        return {"scanned": self.scanned, "moved": dict(self.moved)}
+
+
+class ShardedStore:
+    """
+    Reads and writes users, organisations and memberships on their shards.
+    """
+
+    def __init__(self, engines, directory):
+        """
+        Args:
+            engines: A dict of shard names to engines
+            directory: The engine of the database holding shard_directory
+        """
+        self.engines = engines
+        self.names = sorted(engines)
+        self.directory = directory
+
+    def shard_for(self, key):
+        return owner(key, self.names)
+
+    def engine_for(self, key):
+        return self.engines[self.shard_for(key)]
+
+    def create_all(self):
+        """
+        Creates the missing tables on every shard and the directory.
+        """
+        directory_metadata.create_all(self.directory)
+        for engine in self.engines.values():
+            shard_metadata.create_all(engine)
+
+    def add_user(self, values):
+        """
+        Stores a new user, reserving their email in the directory first.
+
+        Args:
+            values: The users columns; a userId is generated if missing
+
+        Returns:
+            The userId
+
+        Raises:
+            IntegrityError: If the email is already taken
+        """
+        values = {"userId": str(uuid.uuid4()), **values}
+        user_id = values["userId"]
+        with self.directory.begin() as connection:
+            connection.execute(
+                insert(directory_table).values(
+                    email=values["email"], user_id=user_id
+                )
+            )
+        try:
+            with self.engine_for(user_id).begin() as connection:
+                connection.execute(insert(shard_users).values(**values))
+        except Exception:
+            with self.directory.begin() as connection:
+                connection.execute(
+                    delete(directory_table).where(
+                        directory_table.c.email == values["email"]
+                    )
+                )
+            raise
+        return user_id
+
+    def delete_user(self, user_id):
+        """
+        Deletes a user, the rows stored with them and their email's entry
+        in the directory.
+        """
+        with self.engine_for(user_id).begin() as connection:
+            self._delete(connection, "users", [user_id])
+        with self.directory.begin() as connection:
+            connection.execute(
+                delete(directory_table).where(
+                    directory_table.c.user_id == user_id
+                )
+            )
+
+    def user(self, user_id):
+        """
+        Returns a user's row, or None.
+        """
+        with self.engine_for(user_id).connect() as connection:
+            return connection.execute(
+                select(shard_users).where(shard_users.c.userId == user_id)
+            ).one_or_none()
+
+    def user_by_email(self, email):
+        """
+        Returns the row of the user with an email, or None.
+        """
+        with self.directory.connect() as connection:
+            user_id = connection.scalar(
+                select(directory_table.c.user_id).where(
+                    directory_table.c.email == email
+                )
+            )
+        return None if user_id is None else self.user(user_id)
+
+    def add_organisation(self, values, owner_id):
+        """
+        Stores a new organisation with its creator as the first member.
+
+        Returns:
+            The org_id
+        """
+        values = {"org_id": str(uuid.uuid4()), **values}
+        org_id = values["org_id"]
+        with self.engine_for(org_id).begin() as connection:
+            connection.execute(insert(shard_organisations).values(**values))
+            connection.execute(
+                insert(shard_members).values(org_id=org_id, user_id=owner_id)
+            )
+        self._mirror(self.engine_for(owner_id), org_id, [owner_id])
+        return org_id
+
+    def update_user(self, user_id, values):
+        """
+        Updates a user's columns and increments their version.
+        """
+        with self.engine_for(user_id).begin() as connection:
+            connection.execute(
+                update(shard_users)
+                .where(shard_users.c.userId == user_id)
+                .values(**values, version=shard_users.c.version + 1)
+            )
+
+    def add_members(self, org_id, user_ids):
+        """
+        Adds users to an organisation, leaving existing members untouched.
+
+        Returns:
+            The ids of the users that were added
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return []
+        with self.engine_for(org_id).begin() as connection:
+            inserted = _insert_ignoring_duplicates(
+                connection,
+                shard_members,
+                [{"org_id": org_id, "user_id": u} for u in user_ids],
+                "user_id",
+            )
+        # Every mirror is (re)written, which also repairs one an interrupted
+        # add left missing
+        by_shard = defaultdict(list)
+        for user_id in user_ids:
+            by_shard[self.shard_for(user_id)].append(user_id)
+        for name, ids in by_shard.items():
+            self._mirror(self.engines[name], org_id, ids)
+        return [u for u in user_ids if u in inserted]
+
+    def add_member(self, org_id, user_id):
+        """
+        Adds a user to an organisation if they are not a member already.
+
+        Returns:
+            True if the membership was created
+        """
+        return bool(self.add_members(org_id, [user_id]))
+
+    def _mirror(self, engine, org_id, user_ids):
+        with engine.begin() as connection:
+            _insert_ignoring_duplicates(
+                connection,
+                shard_user_organisations,
+                [{"user_id": u, "org_id": org_id} for u in user_ids],
+                "user_id",
+            )
+
+    def is_member(self, user_id, org_id):
+        """
+        Checks on the organisation's shard whether a user belongs to it.
+        """
+        with self.engine_for(org_id).connect() as connection:
+            return connection.scalar(
+                select(
+                    exists()
+                    .where(shard_members.c.org_id == org_id)
+                    .where(shard_members.c.user_id == user_id)
+                )
+            )
+
+    def shares_organisation(self, user_id, other_id):
+        """
+        Checks whether two users belong to a common organisation, from the
+        membership mirrors on their shards. The other user's organisations
+        are read and looked up on the user's shard a chunk at a time, so no
+        statement grows with the number of memberships.
+        """
+        mine = shard_user_organisations
+        if self.shard_for(user_id) == self.shard_for(other_id):
+            theirs = mine.alias()
+            with self.engine_for(user_id).connect() as connection:
+                return connection.scalar(
+                    select(
+                        exists()
+                        .where(mine.c.user_id == user_id)
+                        .where(theirs.c.org_id == mine.c.org_id)
+                        .where(theirs.c.user_id == other_id)
+                    )
+                )
+        after = None
+        while True:
+            org_ids = self._page(
+                self.engine_for(other_id),
+                mine.c.org_id,
+                mine.c.user_id == other_id,
+                after,
+                SHARED_ORGANISATIONS_CHUNK,
+            )
+            if not org_ids:
+                return False
+            with self.engine_for(user_id).connect() as connection:
+                if connection.scalar(
+                    select(
+                        exists()
+                        .where(mine.c.user_id == user_id)
+                        .where(mine.c.org_id.in_(org_ids))
+                    )
+                ):
+                    return True
+            if len(org_ids) < SHARED_ORGANISATIONS_CHUNK:
+                return False
+            after = org_ids[-1]
+
+    def organisation(self, org_id):
+        """
+        Returns an organisation's row, or None.
+        """
+        with self.engine_for(org_id).connect() as connection:
+            return connection.execute(
+                select(shard_organisations).where(
+                    shard_organisations.c.org_id == org_id
+                )
+            ).one_or_none()
+
+    def _page(self, engine, column, where, after, limit):
+        # A keyset page of the ids in `column`
+        query = select(column).where(where).order_by(column)
+        if after:
+            query = query.where(column > after)
+        if limit is not None:
+            query = query.limit(limit)
+        with engine.connect() as connection:
+            return connection.scalars(query).all()
+
+    def _count(self, engine, table, where):
+        with engine.connect() as connection:
+            return connection.scalar(
+                select(func.count()).select_from(table).where(where)
+            )
+
+    def members(self, org_id, after=None, limit=None):
+        """
+        Returns the rows of an organisation's members, ordered by userId.
+
+        Args:
+            after: Only the members with a greater userId
+            limit: The most members to return
+        """
+        user_ids = self._page(
+            self.engine_for(org_id),
+            shard_members.c.user_id,
+            shard_members.c.org_id == org_id,
+            after,
+            limit,
+        )
+        return self._fetch("users", user_ids)
+
+    def count_members(self, org_id):
+        return self._count(
+            self.engine_for(org_id),
+            shard_members,
+            shard_members.c.org_id == org_id,
+        )
+
+    def organisations_of(self, user_id, after=None, limit=None):
+        """
+        Returns the rows of the organisations a user belongs to, ordered by
+        org_id.
+
+        Args:
+            after: Only the organisations with a greater org_id
+            limit: The most organisations to return
+        """
+        org_ids = self._page(
+            self.engine_for(user_id),
+            shard_user_organisations.c.org_id,
+            shard_user_organisations.c.user_id == user_id,
+            after,
+            limit,
+        )
+        return self._fetch("organisations", org_ids)
+
+    def count_organisations_of(self, user_id):
+        return self._count(
+            self.engine_for(user_id),
+            shard_user_organisations,
+            shard_user_organisations.c.user_id == user_id,
+        )
+
+    def users(self, user_ids):
+        """
+        Returns the rows of the users that exist among `user_ids`, ordered
+        by userId.
+        """
+        return self._fetch("users", user_ids)
+
+    def _fetch(self, kind, keys):
+        # One query per shard holding any of the rows
+        table, key, _ = PLACEMENTS[kind]
+        by_shard = defaultdict(list)
+        for value in keys:
+            by_shard[self.shard_for(value)].append(value)
+        rows = []
+        for name, values in sorted(by_shard.items()):
+            with self.engines[name].connect() as connection:
+                rows.extend(
+                    connection.execute(
+                        select(table).where(table.c[key].in_(values))
+                    )
+                )
+        return sorted(rows, key=lambda row: row._mapping[key])
+
+    def start_token_family(self, values, now):
+        """
+        Stores a new refresh token family on its user's shard, dropping the
+        user's expired families.
+        """
+        t = shard_refresh_tokens
+        with self.engine_for(values["user_id"]).begin() as connection:
+            connection.execute(
+                delete(t)
+                .where(t.c.user_id == values["user_id"])
+                .where(t.c.expires_at < now)
+            )
+            connection.execute(insert(t).values(**values))
+
+    def token_family(self, user_id, family):
+        """
+        Returns a user's refresh token family, or None.
+        """
+        t = shard_refresh_tokens
+        with self.engine_for(user_id).connect() as connection:
+            return connection.execute(
+                select(t).where(t.c.family == family, t.c.user_id == user_id)
+            ).one_or_none()
+
+    def rotate_token(self, user_id, family, jti, values):
+        """
+        Updates a refresh token family if its latest token is `jti`.
+
+        Returns:
+            True if the family was updated
+        """
+        t = shard_refresh_tokens
+        with self.engine_for(user_id).begin() as connection:
+            return bool(
+                connection.execute(
+                    update(t)
+                    .where(t.c.family == family, t.c.jti == jti)
+                    .values(**values)
+                ).rowcount
+            )
+
+    def revoke_token_family(self, user_id, family):
+        t = shard_refresh_tokens
+        with self.engine_for(user_id).begin() as connection:
+            connection.execute(delete(t).where(t.c.family == family))
+
+    def counts(self):
+        """
+        Returns the number of users and organisations on each shard, and
+        how many of them belong on another shard.
+        """
+        counts = {}
+        for name, engine in sorted(self.engines.items()):
+            counts[name] = {}
+            with engine.connect() as connection:
+                for kind, (table, key, _) in PLACEMENTS.items():
+                    keys = connection.scalars(select(table.c[key])).all()
+                    counts[name][kind] = len(keys)
+                    counts[name][f"misplaced_{kind}"] = sum(
+                        self.shard_for(value) != name for value in keys
+                    )
+        return counts
+
+    def rebalance(self, drain=(), chunk_size=1000, progress=None):
+        """
+        Moves every row that belongs on another shard.
+
+        Args:
+            drain: Names of shards to empty, e.g. before removing them
+            chunk_size: Rows read and moved per transaction
+            progress: Optional callback called with the report after
+                every chunk
+
+        Returns:
+            A RebalanceReport
+        """
+        targets = [name for name in self.names if name not in drain]
+        if not targets:
+            raise ValueError("Cannot drain every shard.")
+        report = RebalanceReport()
+        for name, engine in sorted(self.engines.items()):
+            for kind, (table, key, _) in PLACEMENTS.items():
+                after = None
+                while True:
+                    query = select(table).order_by(table.c[key])
+                    if after is not None:
+                        query = query.where(table.c[key] > after)
+                    with engine.connect() as connection:
+                        rows = connection.execute(
+                            query.limit(chunk_size)
+                        ).all()
+                    if not rows:
+                        break
+                    after = rows[-1]._mapping[key]
+                    report.scanned += len(rows)
+                    moves = defaultdict(list)
+                    for row in rows:
+                        target = owner(row._mapping[key], targets)
+                        if target != name:
+                            moves[target].append(row)
+                    for target, batch in moves.items():
+                        self._move(kind, engine, self.engines[target], batch)
+                        report.moved[kind] += len(batch)
+                    if progress:
+                        progress(report)
+        return report
+
+    def _move(self, kind, source, target, rows):
+        table, key, children = PLACEMENTS[kind]
+        keys = [row._mapping[key] for row in rows]
+        with source.connect() as connection:
+            child_rows = [
+                connection.execute(
+                    select(child).where(child.c[parent_key].in_(keys))
+                ).all()
+                for child, parent_key in children
+            ]
+        # Copy first, replacing what an interrupted run may have left
+        with target.begin() as connection:
+            self._delete(connection, kind, keys)
+            connection.execute(
+                insert(table), [dict(row._mapping) for row in rows]
+            )
+            for (child, _), copied in zip(children, child_rows):
+                if copied:
+                    connection.execute(
+                        insert(child), [dict(row._mapping) for row in copied]
+                    )
+        with source.begin() as connection:
+            self._delete(connection, kind, keys)
+
+    def _delete(self, connection, kind, keys):
+        table, key, children = PLACEMENTS[kind]
+        for child, parent_key in children:
+            connection.execute(
+                delete(child).where(child.c[parent_key].in_(keys))
+            )
+        connection.execute(delete(table).where(table.c[key].in_(keys)))
+
+
+def init_app(app, db):
+    """
+    Creates the sharded store from the app's shard binds, if any.
+    """
+    with app.app_context():
+        engines = {
+            key[len("shard_"):]: engine
+            for key, engine in db.engines.items()
+            if key and key.startswith("shard_")
+        }
+        app.extensions["shards"] = (
+            ShardedStore(engines, db.engine) if engines else None
+        )
+    for name in engines:
+        # The shards have tables of their own (see ShardedStore.create_all)
+        db.metadatas.pop(f"shard_{name}", None)
+
+
+def get_store():
+    """
+    Returns the app's ShardedStore, or None when shards are not configured.
+    """
+    return current_app.extensions.get("shards")
+
+
+shards_command = AppGroup(
+    "shards", help="Manage the sharded user and organisation storage."
+)
+
+
+def _store():
+    store = current_app.extensions["shards"]
+    if store is None:
+        raise click.ClickException("DATABASE_SHARDS is not set.")
+    return store
+
+
+@shards_command.command("init")
+def init_command():
+    """
+    Creates the shard tables and the email directory.
+    """
+    _store().create_all()
+    click.echo("Shard tables are up to date.")
+
+
+@shards_command.command("status")
+def status_command():
+    """
+    Lists the rows on each shard and how many belong elsewhere.
+    """
+    for name, counts in _store().counts().items():
+        click.echo(
+            f"{name}: {counts['users']} users "
+            f"({counts['misplaced_users']} misplaced), "
+            f"{counts['organisations']} organisations "
+            f"({counts['misplaced_organisations']} misplaced)"
+        )
+
+
+@shards_command.command("rebalance")
+@click.option(
+    "--drain", multiple=True, help="Shard to empty (may be repeated)."
+)
+@click.option("--chunk-size", default=1000, show_default=True)
+def rebalance_command(drain, chunk_size):
+    """
+    Moves users and organisations to the shards they belong on.
+    """
+    store = _store()
+    unknown = set(drain) - set(store.names)
+    if unknown:
+        raise click.ClickException(f"Unknown shards: {', '.join(unknown)}")
+    report = store.rebalance(drain, chunk_size)
+    moved = report.moved
+    click.echo(
+        f"Scanned {report.scanned} rows, moved {moved['users']} users "
+        f"and {moved['organisations']} organisations."
+    )
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+This file defines how access and refresh tokens are issued and rotated.
+
+Refresh tokens are rotated on every use: /auth/refresh accepts only the
+latest token of a family and replaces it with a new one. Presenting an
+already rotated token is treated as token theft and revokes the family, so
+both the attacker and the victim have to log in again.
+
+With shards configured, a user's families are kept on the user's shard.
+"""
+import uuid
+from datetime import datetime, timezone
+from flask import current_app
+from flask_jwt_extended import create_access_token, create_refresh_token
+from sqlalchemy import update
+from models.refresh_token import RefreshToken
+from app.sharding import get_store
+from app import db
+
+
+class RefreshTokenRejected(Exception):
+    """
+    Raised when a refresh token is unknown, revoked or reused.
+    """
+
+
+def _now():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def _identity(user_id):
+    return {"userId": user_id, "sub": user_id}
+
+
+def _expiry():
+    return _now() + current_app.config["JWT_REFRESH_TOKEN_EXPIRES"]
+
+
+def _refresh_token(user_id, family, jti):
+    return create_refresh_token(
+        _identity(user_id), additional_claims={"jti": jti, "family": family}
+    )
+
+
+def issue_tokens(user_id):
+    """
+    Starts a new refresh token family for a user. The caller commits.
+
+    Returns:
+        A tuple of (access token, refresh token)
+    """
+    values = {
+        "family": str(uuid.uuid4()),
+        "user_id": user_id,
+        "jti": str(uuid.uuid4()),
+        "expires_at": _expiry(),
+    }
+    store = get_store()
+    if store is not None:
+        store.start_token_family(values, _now())
+    else:
+        RefreshToken.query.filter(
+            RefreshToken.user_id == user_id, RefreshToken.expires_at < _now()
+        ).delete()
+        db.session.add(RefreshToken(**values))
+    return create_access_token(_identity(user_id)), _refresh_token(
+        user_id, values["family"], values["jti"]
+    )
+
+
+def rotate_tokens(jwt_data):
+    """
+    Exchanges a decoded refresh token for a new access and refresh token.
+    The caller commits.
+
+    Raises:
+        RefreshTokenRejected: If the token is not the latest of a live family
+    """
+    store = get_store()
+    if store is not None:
+        return _rotate_sharded(store, jwt_data)
+    family = db.session.get(RefreshToken, jwt_data.get("family"))
+    if family is None or family.expires_at < _now():
+        raise RefreshTokenRejected()
+    jti = str(uuid.uuid4())
+    # Only the latest token may rotate; checking it in the UPDATE keeps two
+    # concurrent refreshes with the same token from both succeeding.
+    rotated = db.session.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family == family.family)
+        .where(RefreshToken.jti == jwt_data["jti"])
+        .values(jti=jti, expires_at=_expiry())
+    ).rowcount
+    if not rotated:
+        # An old token was replayed: revoke the whole family
+        db.session.delete(family)
+        db.session.commit()
+        raise RefreshTokenRejected()
+    return create_access_token(_identity(family.user_id)), _refresh_token(
+        family.user_id, family.family, jti
+    )
+
+
+def _rotate_sharded(store, jwt_data):
+    user_id = jwt_data["sub"]["userId"]
+    family = store.token_family(user_id, jwt_data.get("family"))
+    if family is None or family.expires_at < _now():
+        raise RefreshTokenRejected()
+    jti = str(uuid.uuid4())
+    values = {"jti": jti, "expires_at": _expiry()}
+    if not store.rotate_token(user_id, family.family, jwt_data["jti"], values):
+        store.revoke_token_family(user_id, family.family)
+        raise RefreshTokenRejected()
+    return create_access_token(_identity(user_id)), _refresh_token(
+        user_id, family.family, jti
+    )
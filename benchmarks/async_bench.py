@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+"""
+This file benchmarks throughput of the sync and async (gevent) worker modes.
+
+gunicorn is started with gunicorn.conf.py for each worker class against the
+same SQLite file, and a pool of client threads keeps a fixed number of
+requests in flight for a few seconds, mixing the two endpoints that block a
+worker the longest:
+
+    POST /auth/login        A password hash and two writes
+    GET  /api/users/<id>    A JWT lookup and a read
+
+Requests per second and p50/p99 latency are reported for each mode. Worker
+classes whose packages are not installed (gevent) are skipped. The async
+mode only pays off when requests wait on I/O, so point --database at a
+networked Postgres for representative numbers; against a local SQLite file
+every mode is bound by the CPU.
+
+Usage:
+    python -m benchmarks.async_bench [--workers 2] [--concurrency 32]
+                                     [--database URI]
+"""
+import argparse
+import importlib.util
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import urllib.error
+import urllib.request
+from time import perf_counter, sleep
+from benchmarks.preload_bench import free_port
+
+CREDENTIALS = {"email": "bench@test.com", "password": "password"}
+
+
+def request(url, body=None, token=None):
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=30) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as error:
+        return error.code, None
+
+
+def wait_until_ready(server, url):
+    while True:
+        try:
+            request(url)
+            return
+        except (urllib.error.URLError, ConnectionError):
+            if server.poll() is not None:
+                raise RuntimeError("gunicorn exited")
+            sleep(0.05)
+
+
+def load(base, token, user_id, concurrency, duration):
+    """
+    Keeps `concurrency` requests in flight and returns their latencies and
+    the number of failed requests.
+    """
+    latencies, failures = [], []
+    deadline = perf_counter() + duration
+
+    def client(index):
+        i = index
+        while perf_counter() < deadline:
+            start = perf_counter()
+            if i % 2:
+                status, _ = request(f"{base}/auth/login", CREDENTIALS)
+            else:
+                status, _ = request(f"{base}/api/users/{user_id}", token=token)
+            latencies.append(perf_counter() - start)
+            if status != 200:
+                failures.append(status)
+            i += 1
+
+    threads = [
+        threading.Thread(target=client, args=(i,)) for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies), failures
+
+
+def bench(worker_class, args, database):
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        DATABASE_URI=database,
+        JWT_SECTET_KEY="benchmark-secret",
+        DB_POOL_PROFILE="web",
+        DB_POOL_SIZE=str(args.concurrency),
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(args.workers),
+        GUNICORN_WORKER_CLASS=worker_class,
+        HASH_POOL_QUEUE_DEPTH=str(args.concurrency),
+        HASH_POOL_ACQUIRE_TIMEOUT="30",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "run:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(server, f"{base}/api/organisations")
+        status, body = request(f"{base}/auth/login", CREDENTIALS)
+        if status != 200:
+            status, body = request(
+                f"{base}/auth/register",
+                {"firstName": "Bench", "lastName": "User", **CREDENTIALS},
+            )
+        data = body["data"]
+        latencies, failures = load(
+            base,
+            data["accessToken"],
+            data["user"]["userId"],
+            args.concurrency,
+            args.duration,
+        )
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+    count = len(latencies)
+    return {
+        "rps": count / args.duration,
+        "p50": latencies[count // 2] * 1000,
+        "p99": latencies[min(count - 1, count * 99 // 100)] * 1000,
+        "failed": len(failures),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--database", help="defaults to a new SQLite file")
+    args = parser.parse_args()
+
+    modes = ["sync", "gthread"]
+    if importlib.util.find_spec("gevent"):
+        modes.append("gevent")
+    with tempfile.TemporaryDirectory() as directory:
+        database = (
+            args.database
+            or f"sqlite:///{os.path.join(directory, 'app.db')}"
+        )
+        subprocess.run(
+            [sys.executable, "-m", "flask", "--app", "run", "db", "upgrade"],
+            env=dict(os.environ, DATABASE_URI=database, JWT_SECTET_KEY="x"),
+            check=True,
+            capture_output=True,
+        )
+        print(f"{'mode':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'failed':>7}")
+        for mode in modes:
+            r = bench(mode, args, database)
+            print(
+                f"{mode:>8} {r['rps']:>8.1f} {r['p50']:>8.1f} "
+                f"{r['p99']:>8.1f} {r['failed']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
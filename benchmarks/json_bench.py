@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+This file benchmarks building and serialising organisation list responses.
+
+For each list size the same organisations are turned into a `jsonify`
+response in three ways:
+
+    dicts + stdlib   Model.to_dict() dicts with Flask's default provider
+    dicts + fast     The same dicts with the app's FastJSONProvider
+    DTOs + fast      OrganisationDTOs with the app's FastJSONProvider
+
+The median time per response is reported. The fast provider only differs
+from the stdlib one when orjson is installed.
+
+Usage:
+    python -m benchmarks.json_bench [--sizes 10 100 1000 10000] [--runs 50]
+"""
+import argparse
+import os
+import uuid
+from time import perf_counter
+
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+os.environ.setdefault("JWT_SECTET_KEY", "benchmark-secret")
+
+from flask.json.provider import DefaultJSONProvider
+from app import create_app, serialization
+from app.dto import OrganisationDTO
+from models.organisation import Organisation
+
+
+def median_ms(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = perf_counter()
+        fn()
+        samples.append(perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000]
+    )
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app()
+    stdlib = DefaultJSONProvider(app)
+    fast = app.json
+
+    def respond(provider, organisations):
+        return provider.response(
+            status="success",
+            message="Organisations retrieved successfully",
+            data={"organisations": organisations},
+        )
+
+    encoder = "orjson" if serialization.orjson else "stdlib (orjson missing)"
+    print(f"fast provider encoder: {encoder}")
+    print(
+        f"{'size':>6} {'dicts+stdlib ms':>16} {'dicts+fast ms':>14} "
+        f"{'DTOs+fast ms':>13}"
+    )
+    with app.app_context():
+        for size in args.sizes:
+            models = [
+                Organisation(f"Organisation {i}", "An organisation")
+                for i in range(size)
+            ]
+            for organisation in models:
+                organisation.org_id = str(uuid.uuid4())
+            rows = [(o.org_id, o.name, o.description) for o in models]
+            results = [
+                median_ms(
+                    lambda: respond(stdlib, [o.to_dict() for o in models]),
+                    args.runs,
+                ),
+                median_ms(
+                    lambda: respond(fast, [o.to_dict() for o in models]),
+                    args.runs,
+                ),
+                median_ms(
+                    lambda: respond(
+                        fast, [OrganisationDTO.from_row(r) for r in rows]
+                    ),
+                    args.runs,
+                ),
+            ]
+            print(
+                f"{size:>6} {results[0]:>16.3f} {results[1]:>14.3f} "
+                f"{results[2]:>13.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+This file benchmarks /auth/login latency for each password hash profile.
+
+For every profile a user is registered with that profile and then logged in
+repeatedly through the test client; the p50 and p99 request latencies are
+reported so the hash cost can be chosen against the latency budget.
+
+Usage:
+    python -m benchmarks.login_bench [--profiles fast pbkdf2 scrypt] [--runs 50]
+"""
+import argparse
+import os
+from time import perf_counter
+
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+os.environ.setdefault("JWT_SECTET_KEY", "benchmark-secret")
+
+from app import create_app, db
+from app.hashing import HASH_PROFILES, method_for_profile
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def bench_profile(profile, runs):
+    app = create_app()
+    app.config["HASH_METHOD"] = method_for_profile(profile)
+    client = app.test_client()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    credentials = {"email": f"{profile}@bench.com", "password": "password"}
+    response = client.post(
+        "/auth/register",
+        json={"firstName": "Bench", "lastName": "User", **credentials},
+    )
+    assert response.status_code == 201, response.data
+    samples = []
+    for _ in range(runs):
+        start = perf_counter()
+        response = client.post("/auth/login", json=credentials)
+        samples.append(perf_counter() - start)
+        assert response.status_code == 200, response.data
+    return percentile(samples, 50) * 1000, percentile(samples, 99) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--profiles", nargs="+", default=list(HASH_PROFILES), choices=HASH_PROFILES
+    )
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'profile':>8} {'method':>22} {'p50 ms':>9} {'p99 ms':>9}")
+    for profile in args.profiles:
+        p50, p99 = bench_profile(profile, args.runs)
+        print(
+            f"{profile:>8} {HASH_PROFILES[profile]:>22} {p50:>9.2f} {p99:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+"""
+This file benchmarks GET /api/organisations/<orgId>/users for large
+organisations.
+
+An organisation is given a growing number of members and the endpoint is
+timed through the test client for the first page, a page 90% of the way
+through (reached with its cursor), and the first page with includeTotal. For
+comparison, loading the whole `Organisation.users` collection is timed too.
+
+Usage:
+    python -m benchmarks.members_bench [--sizes 1000 10000 100000] [--runs 20]
+"""
+import argparse
+import os
+import uuid
+from time import perf_counter
+
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+os.environ.setdefault("JWT_SECTET_KEY", "benchmark-secret")
+
+from flask import json
+from flask_jwt_extended import create_access_token
+from sqlalchemy import insert, text
+from app import create_app, db
+from models.organisation import Organisation, organisation_user_table
+from models.user import User
+
+
+def seed(size):
+    """
+    Creates an organisation with `size` members and returns its id and the
+    sorted member ids.
+    """
+    org_id = str(uuid.uuid4())
+    user_ids = sorted(str(uuid.uuid4()) for _ in range(size))
+    db.session.execute(insert(Organisation), [{"org_id": org_id, "name": "Big"}])
+    db.session.execute(
+        insert(User),
+        [
+            {
+                "userId": user_id,
+                "firstName": "Bench",
+                "lastName": "User",
+                "email": f"{i}@bench.com",
+                "password": "x",
+            }
+            for i, user_id in enumerate(user_ids)
+        ],
+    )
+    db.session.execute(
+        insert(organisation_user_table),
+        [{"org_id": org_id, "user_id": user_id} for user_id in user_ids],
+    )
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    return org_id, user_ids
+
+
+def median_ms(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = perf_counter()
+        fn()
+        samples.append(perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(
+        f"{'members':>8} {'first ms':>9} {'deep ms':>8} {'total ms':>9} "
+        f"{'load all ms':>12}"
+    )
+    for size in args.sizes:
+        app = create_app()
+        client = app.test_client()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            org_id, user_ids = seed(size)
+            token = create_access_token(
+                identity={"userId": user_ids[0], "sub": user_ids[0]}
+            )
+        headers = {"Authorization": f"Bearer {token}"}
+        url = f"/api/organisations/{org_id}/users?limit=100"
+        deep = f"{url}&after={user_ids[size * 9 // 10]}"
+
+        def get(url):
+            response = client.get(url, headers=headers)
+            assert response.status_code == 200, response.data
+            return json.loads(response.data)
+
+        def load_all():
+            with app.app_context():
+                assert len(db.session.get(Organisation, org_id).users) == size
+
+        results = [
+            median_ms(lambda: get(url), args.runs),
+            median_ms(lambda: get(deep), args.runs),
+            median_ms(lambda: get(f"{url}&includeTotal=true"), args.runs),
+            median_ms(load_all, max(1, args.runs // 10)),
+        ]
+        print(
+            f"{size:>8} {results[0]:>9.2f} {results[1]:>8.2f} "
+            f"{results[2]:>9.2f} {results[3]:>12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
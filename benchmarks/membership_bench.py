@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+"""
+This file benchmarks the "do these two users share an organisation" check.
+
+It compares the original approach (load both `organisations` collections and
+compare them in Python) with the single EXISTS query in app.membership, for
+users that belong to a growing number of organisations.
+
+Usage:
+    python -m benchmarks.membership_bench [--sizes 1 10 100 1000] [--runs 50]
+"""
+import argparse
+import os
+from time import perf_counter
+
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+os.environ.setdefault("JWT_SECTET_KEY", "benchmark-secret")
+
+from app import create_app, db
+from app.membership import shares_organisation
+from models.organisation import Organisation, organisation_user_table
+from models.user import User
+
+
+def seed(size):
+    """
+    Creates two users that each belong to `size` organisations and share
+    only the last one.
+    """
+    users = []
+    for name in ["first", "second"]:
+        user = User(firstName=name, lastName="Bench", email=f"{name}@b.com")
+        user.password = "x"
+        users.append(user)
+    db.session.add_all(users)
+    db.session.flush()
+    rows = []
+    for user in users:
+        for i in range(size - 1):
+            org = Organisation(name=f"{user.firstName} {i}")
+            db.session.add(org)
+            db.session.flush()
+            rows.append({"org_id": org.org_id, "user_id": user.userId})
+    shared = Organisation(name="Shared")
+    db.session.add(shared)
+    db.session.flush()
+    rows += [{"org_id": shared.org_id, "user_id": u.userId} for u in users]
+    db.session.execute(organisation_user_table.insert(), rows)
+    db.session.commit()
+    return [user.userId for user in users]
+
+
+def legacy_check(user_id, other_id):
+    current_user = User.query.filter_by(userId=user_id).first()
+    user = User.query.filter_by(userId=other_id).first()
+    return any(
+        [org in user.organisations for org in current_user.organisations]
+    )
+
+
+def timed(check, ids, runs):
+    samples = []
+    for _ in range(runs):
+        db.session.expunge_all()
+        start = perf_counter()
+        assert check(*ids)
+        samples.append(perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    print(f"{'orgs/user':>10} {'legacy ms':>12} {'exists ms':>12} {'speedup':>8}")
+    for size in args.sizes:
+        app = create_app()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            ids = seed(size)
+            legacy = timed(legacy_check, ids, args.runs)
+            exists = timed(shares_organisation, ids, args.runs)
+            print(
+                f"{size:>10} {legacy:>12.3f} {exists:>12.3f} "
+                f"{legacy / exists:>7.1f}x"
+            )
+            db.session.remove()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+"""
+This file benchmarks gunicorn with and without preloading the app.
+
+For each mode gunicorn is started with gunicorn.conf.py on a local TCP port
+against a SQLite file, warmed up with a few requests, and then measured:
+
+    first request   Time from starting gunicorn to the first response
+    CPU             User + system CPU time of the master and all workers
+    RSS/worker      Resident memory of one worker, shared pages included
+    PSS/worker      Proportional memory of one worker (shared pages are
+                    split between the processes sharing them)
+    PSS total       Proportional memory of the master and all workers
+
+Linux only (reads /proc).
+
+Usage:
+    python -m benchmarks.preload_bench [--workers 5] [--worker-class sync]
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import urllib.error
+import urllib.request
+from time import perf_counter, sleep
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get(url):
+    try:
+        urllib.request.urlopen(url, timeout=5)
+    except urllib.error.HTTPError:
+        # Unauthenticated requests are answered with 401
+        pass
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def memory(pid):
+    """
+    Returns the RSS and PSS of a process in bytes.
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                values[key] = int(rest.split()[0]) * 1024
+    return values["Rss"], values["Pss"]
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rpartition(")")[2].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def bench(preload, args, database):
+    port = free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URI=database,
+        JWT_SECTET_KEY="benchmark-secret",
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(args.workers),
+        GUNICORN_WORKER_CLASS=args.worker_class,
+        GUNICORN_PRELOAD=str(preload).lower(),
+    )
+    url = f"http://127.0.0.1:{port}/api/organisations"
+    start = perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "run:app"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            try:
+                get(url)
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if server.poll() is not None:
+                    raise RuntimeError("gunicorn exited")
+                sleep(0.01)
+        first_request = perf_counter() - start
+        while len(children(server.pid)) < args.workers:
+            sleep(0.05)
+        # Let every worker finish booting and serve some requests
+        sleep(args.settle)
+        for _ in range(args.requests):
+            get(url)
+        workers = children(server.pid)
+        sizes = [memory(pid) for pid in workers]
+        cpu = sum(cpu_seconds(pid) for pid in [server.pid, *workers])
+        return {
+            "first request": first_request * 1000,
+            "CPU": cpu * 1000,
+            "RSS/worker": sum(s[0] for s in sizes) / len(sizes) / 2**20,
+            "PSS/worker": sum(s[1] for s in sizes) / len(sizes) / 2**20,
+            "PSS total": (
+                sum(s[1] for s in sizes) + memory(server.pid)[1]
+            ) / 2**20,
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=5)
+    parser.add_argument(
+        "--worker-class", choices=["sync", "gthread", "gevent"], default="sync"
+    )
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--settle", type=float, default=2.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = f"sqlite:///{os.path.join(directory, 'app.db')}"
+        subprocess.run(
+            [sys.executable, "-m", "flask", "--app", "run", "db", "upgrade"],
+            env=dict(os.environ, DATABASE_URI=database, JWT_SECTET_KEY="x"),
+            check=True,
+            capture_output=True,
+        )
+        results = {
+            "no preload": bench(False, args, database),
+            "preload": bench(True, args, database),
+        }
+
+    units = {"first request": "ms", "CPU": "ms"}
+    print(f"{'':>16} {'no preload':>12} {'preload':>12}")
+    for key in results["preload"]:
+        unit = units.get(key, "MiB")
+        before, after = results["no preload"][key], results["preload"][key]
+        print(f"{key + ' ' + unit:>16} {before:>12.1f} {after:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
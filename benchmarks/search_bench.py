@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""
+This file benchmarks GET /api/organisations/search as the number of
+organisations grows.
+
+A user is made a member of every organisation (the worst case for the
+membership filter), each named with two made-up words. The endpoint is
+timed through the test client for a rare word, a word prefix, a common
+syllable and a misspelt (fuzzy) word. For comparison, the same rare word is
+found with an unindexed LIKE scan.
+
+Usage:
+    python -m benchmarks.search_bench [--sizes 10000 100000 1000000] [--runs 20]
+"""
+import argparse
+import os
+import random
+import uuid
+from time import perf_counter
+
+os.environ.setdefault("DATABASE_URI", "sqlite:///:memory:")
+os.environ.setdefault("JWT_SECTET_KEY", "benchmark-secret")
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import func, insert, select, text
+from app import create_app, db
+from models.organisation import Organisation, organisation_user_table
+from models.user import User
+
+SYLLABLES = [
+    "ac", "be", "cor", "da", "el", "fi", "gor", "ha", "in", "jo", "ka", "lu",
+    "mar", "no", "ox", "pe", "qua", "ri", "so", "tek", "ul", "vo", "wex", "zi",
+]
+CHUNK = 10000
+
+
+def word(rng):
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def seed(size):
+    """
+    Creates `size` organisations whose only member is one user, and
+    returns the user's id and one organisation's name.
+    """
+    rng = random.Random(size)
+    user_id = str(uuid.uuid4())
+    db.session.execute(
+        insert(User),
+        [
+            {
+                "userId": user_id,
+                "firstName": "Bench",
+                "lastName": "User",
+                "email": "bench@bench.com",
+                "password": "x",
+            }
+        ],
+    )
+    name = None
+    for start in range(0, size, CHUNK):
+        rows = [
+            {
+                "org_id": str(uuid.uuid4()),
+                "name": f"{word(rng).title()} {word(rng).title()}",
+            }
+            for _ in range(min(CHUNK, size - start))
+        ]
+        name = name or rows[0]["name"]
+        db.session.execute(insert(Organisation), rows)
+        db.session.execute(
+            insert(organisation_user_table),
+            [{"org_id": row["org_id"], "user_id": user_id} for row in rows],
+        )
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(text("ANALYZE"))
+    db.session.commit()
+    return user_id, name
+
+
+def percentiles_ms(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = perf_counter()
+        fn()
+        samples.append(perf_counter() - start)
+    samples.sort()
+    p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    return samples[len(samples) // 2] * 1000, p99 * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10000, 100000, 1000000]
+    )
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(
+        f"{'orgs':>8} {'seed s':>7} {'query':>20} {'match':>6} "
+        f"{'hits':>5} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    for size in args.sizes:
+        app = create_app()
+        client = app.test_client()
+        with app.app_context():
+            db.drop_all()
+            db.create_all()
+            start = perf_counter()
+            user_id, name = seed(size)
+            seeded = perf_counter() - start
+            token = create_access_token(
+                identity={"userId": user_id, "sub": user_id}
+            )
+        headers = {"Authorization": f"Bearer {token}"}
+        rare = max(name.split(), key=len).lower()
+        queries = {
+            "rare word": rare,
+            "prefix": rare[:4],
+            "common syllable": "tek",
+            "misspelt": rare[:-1] + "qx",
+        }
+        for label, q in queries.items():
+            url = f"/api/organisations/search?q={q}&limit=20"
+
+            def get():
+                response = client.get(url, headers=headers)
+                assert response.status_code == 200, response.data
+                return response.get_json()["data"]
+
+            data = get()
+            p50, p99 = percentiles_ms(get, args.runs)
+            print(
+                f"{size:>8} {seeded:>7.1f} {label:>20} {data['match']:>6} "
+                f"{len(data['organisations']):>5} {p50:>8.2f} {p99:>8.2f}"
+            )
+
+        def scan():
+            t = organisation_user_table
+            with app.app_context():
+                return db.session.execute(
+                    select(Organisation.org_id, Organisation.name)
+                    .join(t, t.c.org_id == Organisation.org_id)
+                    .where(t.c.user_id == user_id)
+                    .where(func.lower(Organisation.name).contains(rare))
+                    .order_by(Organisation.name)
+                    .limit(21)
+                ).all()
+
+        hits = len(scan())
+        p50, p99 = percentiles_ms(scan, max(1, args.runs // 4))
+        print(
+            f"{size:>8} {seeded:>7.1f} {'rare word (LIKE)':>20} {'scan':>6} "
+            f"{hits:>5} {p50:>8.2f} {p99:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
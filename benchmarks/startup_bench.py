@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+This file benchmarks worker cold start: the time from starting a fresh
+Python process to the first served request.
+
+Each run starts a new interpreter that builds the app and serves one
+request through the test client, against a SQLite file whose schema is
+already up to date. Three startup modes are compared:
+
+    create_all      The old behaviour: create_all() on every boot
+    auto-upgrade    DB_AUTO_UPGRADE=true: check for pending migrations
+    none            The default: no schema work at boot
+
+Usage:
+    python -m benchmarks.startup_bench [--runs 10]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+CHILD = """
+from time import perf_counter
+start = perf_counter()
+from app import create_app, db
+app = create_app()
+if {create_all}:
+    with app.app_context():
+        db.create_all()
+response = app.test_client().get("/api/organisations")
+assert response.status_code == 401, response.status_code
+print(perf_counter() - start)
+"""
+
+
+def run(mode, env):
+    env = dict(env, DB_AUTO_UPGRADE=str(mode == "auto-upgrade").lower())
+    code = CHILD.format(create_all=mode == "create_all")
+    start = perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return perf_counter() - start, float(output)
+
+
+def median(samples):
+    samples = sorted(samples)
+    return samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            DATABASE_URI=f"sqlite:///{os.path.join(directory, 'app.db')}",
+            JWT_SECTET_KEY="benchmark-secret",
+        )
+        subprocess.run(
+            [sys.executable, "-m", "flask", "--app", "run", "db", "upgrade"],
+            env=env,
+            check=True,
+            capture_output=True,
+        )
+        print(f"{'mode':>14} {'process ms':>11} {'in-app ms':>10}")
+        for mode in ["create_all", "auto-upgrade", "none"]:
+            samples = [run(mode, env) for _ in range(args.runs)]
+            total = median(s[0] for s in samples) * 1000
+            in_app = median(s[1] for s in samples) * 1000
+            print(f"{mode:>14} {total:>11.1f} {in_app:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
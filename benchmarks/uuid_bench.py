@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+This file benchmarks text ids against compact GUID ids.
+
+The same users, organisations and memberships are written to two SQLite
+databases: one with the original String(50) id columns and one with the
+current GUID columns. It reports the on-disk size of the tables and indexes
+(from SQLite's dbstat) and the latency of a primary key lookup and of the
+shared-organisation join used for authorization.
+
+Usage:
+    python -m benchmarks.uuid_bench [--users 20000] [--orgs-per-user 5]
+"""
+import argparse
+import os
+import random
+import tempfile
+import uuid
+from time import perf_counter
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+    exists,
+    select,
+    text,
+)
+from sqlalchemy.orm import aliased
+from models.organisation import Organisation, organisation_user_table
+from models.user import User
+
+
+def legacy_tables():
+    """
+    Returns the users, organisations and organisation_user tables with the
+    original String(50) ids.
+    """
+    metadata = MetaData()
+    users = Table(
+        "users",
+        metadata,
+        Column("userId", String(50), primary_key=True),
+        Column("firstName", String(50), nullable=False),
+        Column("lastName", String(50), nullable=False),
+        Column("email", String(50), nullable=False, unique=True, index=True),
+        Column("password", String(255), nullable=False),
+        Column("phone", String(50)),
+    )
+    organisations = Table(
+        "organisations",
+        metadata,
+        Column("org_id", String(50), primary_key=True),
+        Column("name", String(50), nullable=False),
+        Column("description", String(50)),
+    )
+    memberships = Table(
+        "organisation_user",
+        metadata,
+        Column(
+            "org_id",
+            String(50),
+            ForeignKey("organisations.org_id"),
+            primary_key=True,
+        ),
+        Column(
+            "user_id", String(50), ForeignKey("users.userId"), primary_key=True
+        ),
+        Index("ix_organisation_user_user_id_org_id", "user_id", "org_id"),
+    )
+    return metadata, users, organisations, memberships
+
+
+def guid_tables():
+    """
+    Returns the current model tables, which use GUID ids.
+    """
+    users, organisations = User.__table__, Organisation.__table__
+    return users.metadata, users, organisations, organisation_user_table
+
+
+def seed(engine, tables, user_count, orgs_per_user):
+    metadata, users, organisations, memberships = tables
+    metadata.create_all(engine, tables=[users, organisations, memberships])
+    rng = random.Random(42)
+    users_range = range(user_count)
+    user_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in users_range]
+    org_ids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in users_range]
+    with engine.begin() as connection:
+        connection.execute(
+            users.insert(),
+            [
+                {
+                    "userId": user_id,
+                    "firstName": "Bench",
+                    "lastName": "User",
+                    "email": f"{i}@bench.com",
+                    "password": "x",
+                }
+                for i, user_id in enumerate(user_ids)
+            ],
+        )
+        connection.execute(
+            organisations.insert(),
+            [{"org_id": org_id, "name": "Org"} for org_id in org_ids],
+        )
+        connection.execute(
+            memberships.insert(),
+            [
+                {"org_id": org_id, "user_id": user_id}
+                for user_id in user_ids
+                for org_id in set(rng.sample(org_ids, orgs_per_user))
+            ],
+        )
+        connection.execute(text("ANALYZE"))
+    return user_ids
+
+
+def sizes(engine):
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text(
+                "SELECT name, SUM(pgsize) FROM dbstat "
+                "WHERE name NOT LIKE 'sqlite_%' GROUP BY name"
+            )
+        ).all()
+    return {name: size for name, size in rows}
+
+
+def median_ms(engine, statement, params, runs):
+    samples = []
+    with engine.connect() as connection:
+        for param in params[:runs]:
+            start = perf_counter()
+            connection.execute(statement(param)).first()
+            samples.append(perf_counter() - start)
+    samples.sort()
+    return samples[len(samples) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--orgs-per-user", type=int, default=5)
+    parser.add_argument("--runs", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for label, tables in [
+            ("String(50)", legacy_tables()),
+            ("GUID", guid_tables()),
+        ]:
+            engine = create_engine(
+                f"sqlite:///{os.path.join(directory, label)}.db"
+            )
+            user_ids = seed(engine, tables, args.users, args.orgs_per_user)
+            _, users, _, memberships = tables
+            mine, theirs = aliased(memberships), aliased(memberships)
+            pairs = list(zip(user_ids, reversed(user_ids)))
+            results[label] = {
+                "sizes": sizes(engine),
+                "lookup": median_ms(
+                    engine,
+                    lambda user_id: select(users).where(
+                        users.c.userId == user_id
+                    ),
+                    user_ids,
+                    args.runs,
+                ),
+                "join": median_ms(
+                    engine,
+                    lambda pair: select(
+                        exists()
+                        .where(mine.c.user_id == pair[0])
+                        .where(theirs.c.org_id == mine.c.org_id)
+                        .where(theirs.c.user_id == pair[1])
+                    ),
+                    pairs,
+                    args.runs,
+                ),
+            }
+            engine.dispose()
+
+    names = sorted(results["GUID"]["sizes"])
+    print(f"{'object':>40} {'String(50) KiB':>15} {'GUID KiB':>10}")
+    for name in names:
+        before = results["String(50)"]["sizes"].get(name, 0) / 1024
+        after = results["GUID"]["sizes"][name] / 1024
+        print(f"{name:>40} {before:>15.0f} {after:>10.0f}")
+    for key, label in [("lookup", "user by id"), ("join", "shared-org join")]:
+        before = results["String(50)"][key]
+        after = results["GUID"][key]
+        print(f"{label:>40} {before:>13.4f}ms {after:>8.4f}ms")
+
+
+if __name__ == "__main__":
+    main()
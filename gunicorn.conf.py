@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+This file configures gunicorn for app_service.
+
+By default the app is loaded once in the master (preload) and the workers
+are forked from it, so the interpreter, Flask, SQLAlchemy and the models
+are shared copy-on-write instead of being imported by every worker. After
+the fork each worker drops the database connections inherited from the
+master so no connection is shared between processes.
+
+Every setting can be overridden with an environment variable:
+
+    GUNICORN_BIND                Socket to listen on (unix:app-service.sock)
+    GUNICORN_WORKERS             Number of worker processes (5)
+    GUNICORN_WORKER_CLASS        sync, gthread or gevent (sync)
+    GUNICORN_THREADS             Threads per gthread worker (4)
+    GUNICORN_WORKER_CONNECTIONS  Connections per gevent worker (100)
+    GUNICORN_PRELOAD             Load the app in the master first (true)
+
+The gevent worker class is the async mode: the standard library is
+monkey-patched before the app is loaded, so each worker serves many
+requests at once and switches between them while they wait on the database
+(psycopg2 is made cooperative when psycogreen is installed).
+
+The hashing process pool (see app/hashing.py) bounds the hashes in flight
+among one worker's concurrent requests, so it is tied to the gthread and
+gevent classes, where it defaults to one process per CPU. A sync worker
+serves one request at a time, so its pool would never fill up and would
+only add a process hop; HASH_POOL_WORKERS is ignored with that class.
+
+Usage:
+    gunicorn -c gunicorn.conf.py run:app
+"""
+import gc
+import os
+from os import environ
+
+bind = environ.get("GUNICORN_BIND", "unix:app-service.sock")
+umask = 0o007
+workers = int(environ.get("GUNICORN_WORKERS", 5))
+worker_class = environ.get("GUNICORN_WORKER_CLASS", "sync")
+threads = int(
+    environ.get("GUNICORN_THREADS", 4 if worker_class == "gthread" else 1)
+)
+worker_connections = int(environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+preload_app = environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+green_psycopg = False
+if worker_class == "gevent":
+    from gevent import monkey
+
+    # Patch before the app and its locks, sockets and pools are created
+    monkey.patch_all()
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        pass
+    else:
+        patch_psycopg()
+        green_psycopg = True
+
+ignored_hash_pool = None
+if worker_class in ("gthread", "gevent"):
+    environ.setdefault("HASH_POOL_WORKERS", str(os.cpu_count() or 1))
+elif environ.get("HASH_POOL_WORKERS", "0") != "0":
+    ignored_hash_pool = environ.pop("HASH_POOL_WORKERS")
+
+
+def on_starting(server):
+    """
+    Starts the request metrics shared by the workers from zero.
+    """
+    from app.metrics import clear_directory
+
+    clear_directory(environ.get("METRICS_DIR"))
+    if ignored_hash_pool:
+        server.log.warning(
+            "HASH_POOL_WORKERS=%s ignored: the hashing pool needs the "
+            "gthread or gevent worker class",
+            ignored_hash_pool,
+        )
+
+
+def when_ready(server):
+    """
+    Moves everything the master has loaded out of the garbage collector's
+    reach, so collections in the workers do not touch (and copy) the pages
+    shared with the master.
+    """
+    if preload_app:
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    """
+    Makes the preloaded app safe to use in a freshly forked worker.
+    """
+    if worker_class == "gevent" and not green_psycopg:
+        worker.log.warning(
+            "psycogreen is not installed; psycopg2 queries will block the "
+            "gevent worker's other requests"
+        )
+    if not preload_app:
+        return
+    from app import pool
+    from run import app
+
+    pool.after_fork(app)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+This package holds the versioned database schema migrations.
+
+Each migration is a module named `v<number>_<name>` exposing an
+`upgrade(connection)` function that is safe to run more than once. Applied
+versions are recorded in the schema_migrations table. A database without
+any of the app's tables is created from the models in one go and stamped
+with every known version.
+
+The schema is no longer created when a worker boots; run
+
+    flask --app run db upgrade
+
+before starting (or restarting) the app after a deploy.
+"""
+import importlib
+import pkgutil
+import re
+from datetime import datetime, timezone
+import click
+from flask.cli import AppGroup
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect
+
+MIGRATION_PATTERN = re.compile(r"^v(\d+)_\w+$")
+
+version_table = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", String(100), primary_key=True),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def available():
+    """
+    Returns the names of all migrations, oldest first.
+    """
+    names = [
+        module.name
+        for module in pkgutil.iter_modules(__path__)
+        if MIGRATION_PATTERN.match(module.name)
+    ]
+    return sorted(names, key=lambda name: int(MIGRATION_PATTERN.match(name)[1]))
+
+
+def applied(connection):
+    """
+    Returns the names of the migrations recorded in the database.
+    """
+    if not inspect(connection).has_table(version_table.name):
+        return []
+    return [
+        row.version
+        for row in connection.execute(
+            version_table.select().order_by(version_table.c.version)
+        )
+    ]
+
+
+def stamp(connection, names):
+    """
+    Records migrations as applied without running them.
+    """
+    version_table.create(connection, checkfirst=True)
+    done = set(applied(connection))
+    rows = [
+        {"version": name, "applied_at": datetime.now(timezone.utc)}
+        for name in names
+        if name not in done
+    ]
+    if rows:
+        connection.execute(version_table.insert(), rows)
+
+
+def upgrade(connection, metadata):
+    """
+    Brings the database schema up to date.
+
+    Args:
+        connection: A connection inside a transaction
+        metadata: The models' metadata, used to create a fresh database
+
+    Returns:
+        The names of the migrations that were run
+    """
+    tables = set(inspect(connection).get_table_names())
+    if not tables & set(metadata.tables):
+        metadata.create_all(connection)
+        stamp(connection, available())
+        return []
+    done = set(applied(connection))
+    pending = [name for name in available() if name not in done]
+    for name in pending:
+        importlib.import_module(f"{__name__}.{name}").upgrade(connection)
+        stamp(connection, [name])
+    return pending
+
+
+db_command = AppGroup("db", help="Manage the database schema.")
+
+
+@db_command.command("upgrade")
+def upgrade_command():
+    """
+    Applies all pending migrations.
+    """
+    from app import db
+
+    with db.engine.begin() as connection:
+        pending = upgrade(connection, db.metadata)
+    for name in pending:
+        click.echo(f"Applied {name}")
+    click.echo("Database schema is up to date.")
+
+
+@db_command.command("current")
+def current_command():
+    """
+    Lists the applied and pending migrations.
+    """
+    from app import db
+
+    with db.engine.connect() as connection:
+        done = applied(connection)
+    for name in available():
+        click.echo(f"{'applied' if name in done else 'pending'}  {name}")
+
+
+@db_command.command("stamp")
+def stamp_command():
+    """
+    Marks every migration as applied without running it.
+    """
+    from app import db
+
+    with db.engine.begin() as connection:
+        stamp(connection, available())
+    click.echo("Database stamped with all migrations.")
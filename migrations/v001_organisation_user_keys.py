@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+Adds a composite primary key and a reverse index to organisation_user.
+
+The original table had no key at all, so it may contain duplicate
+memberships and rows with missing ids. Those are dropped while the rows are
+copied into the new table.
+
+Usage:
+    python -m migrations.v001_organisation_user_keys
+"""
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    text,
+)
+
+
+def upgrade(connection):
+    """
+    Rebuilds organisation_user with a primary key on (org_id, user_id).
+    """
+    inspector = inspect(connection)
+    if "organisation_user" not in inspector.get_table_names():
+        return
+    pk = inspector.get_pk_constraint("organisation_user")
+    if pk.get("constrained_columns"):
+        return
+
+    metadata = MetaData()
+    Table("organisations", metadata, Column("org_id", String(50)))
+    Table("users", metadata, Column("userId", String(50)))
+    new_table = Table(
+        "organisation_user_new",
+        metadata,
+        Column(
+            "org_id",
+            String(50),
+            ForeignKey("organisations.org_id"),
+            primary_key=True,
+        ),
+        Column(
+            "user_id",
+            String(50),
+            ForeignKey("users.userId"),
+            primary_key=True,
+        ),
+    )
+    new_table.create(connection)
+    connection.execute(
+        text(
+            "INSERT INTO organisation_user_new (org_id, user_id) "
+            "SELECT DISTINCT org_id, user_id FROM organisation_user "
+            "WHERE org_id IS NOT NULL AND user_id IS NOT NULL"
+        )
+    )
+    connection.execute(text("DROP TABLE organisation_user"))
+    connection.execute(
+        text("ALTER TABLE organisation_user_new RENAME TO organisation_user")
+    )
+    renamed = Table(
+        "organisation_user",
+        MetaData(),
+        Column("org_id", String(50)),
+        Column("user_id", String(50)),
+    )
+    Index(
+        "ix_organisation_user_user_id_org_id",
+        renamed.c.user_id,
+        renamed.c.org_id,
+    ).create(connection)
+
+
+if __name__ == "__main__":
+    from app import create_app, db
+
+    with create_app().app_context():
+        with db.engine.begin() as connection:
+            upgrade(connection)
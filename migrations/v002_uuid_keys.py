@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+"""
+Converts the String(50) id columns to native UUIDs (Postgres) or 16-byte
+BLOBs (SQLite and others).
+
+On Postgres the foreign keys between the id columns are dropped, the columns
+are converted in place with `USING col::uuid` and the foreign keys are
+recreated. Other databases cannot change column types in place, so each
+table is rebuilt and its rows are copied across in batches.
+
+Usage:
+    python -m migrations.v002_uuid_keys
+"""
+import uuid
+from sqlalchemy import (
+    Column,
+    ForeignKeyConstraint,
+    Index,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    UniqueConstraint,
+    inspect,
+    text,
+)
+
+# Id columns of each table, in dependency order
+ID_COLUMNS = {
+    "users": ["userId"],
+    "organisations": ["org_id"],
+    "organisation_user": ["org_id", "user_id"],
+    "refresh_tokens": ["family", "user_id", "jti"],
+}
+BATCH_SIZE = 5000
+
+
+def _pending(inspector):
+    """
+    Returns the tables whose id columns are still text.
+    """
+    tables = inspector.get_table_names()
+    pending = []
+    for table, columns in ID_COLUMNS.items():
+        if table not in tables:
+            continue
+        types = {c["name"]: c["type"] for c in inspector.get_columns(table)}
+        if any(isinstance(types[name], String) for name in columns):
+            pending.append(table)
+    return pending
+
+
+def _upgrade_postgresql(connection, inspector, tables):
+    foreign_keys = [
+        (table, fk)
+        for table in ID_COLUMNS
+        if table in inspector.get_table_names()
+        for fk in inspector.get_foreign_keys(table)
+    ]
+    for table, fk in foreign_keys:
+        connection.execute(
+            text(f'ALTER TABLE "{table}" DROP CONSTRAINT "{fk["name"]}"')
+        )
+    for table in tables:
+        for column in ID_COLUMNS[table]:
+            connection.execute(
+                text(
+                    f'ALTER TABLE "{table}" ALTER COLUMN "{column}" '
+                    f'TYPE uuid USING "{column}"::uuid'
+                )
+            )
+    for table, fk in foreign_keys:
+        columns = ", ".join(f'"{c}"' for c in fk["constrained_columns"])
+        referred = ", ".join(f'"{c}"' for c in fk["referred_columns"])
+        connection.execute(
+            text(
+                f'ALTER TABLE "{table}" ADD CONSTRAINT "{fk["name"]}" '
+                f'FOREIGN KEY ({columns}) '
+                f'REFERENCES "{fk["referred_table"]}" ({referred})'
+            )
+        )
+
+
+def _to_bytes(value):
+    return None if value is None else uuid.UUID(value).bytes
+
+
+def _rebuild(connection, inspector, name):
+    """
+    Rebuilds a table with BLOB id columns and copies its rows across.
+    """
+    metadata = MetaData()
+    old = Table(name, metadata, autoload_with=connection)
+    ids = ID_COLUMNS[name]
+    new = Table(
+        f"{name}_uuid",
+        metadata,
+        *[
+            Column(
+                c.name,
+                LargeBinary(16) if c.name in ids else c.type,
+                primary_key=c.primary_key,
+                nullable=c.nullable,
+            )
+            for c in old.columns
+        ],
+        *[
+            ForeignKeyConstraint(
+                fk["constrained_columns"],
+                [
+                    f"{fk['referred_table']}.{c}"
+                    for c in fk["referred_columns"]
+                ],
+            )
+            for fk in inspector.get_foreign_keys(name)
+        ],
+        *[
+            UniqueConstraint(*unique["column_names"])
+            for unique in inspector.get_unique_constraints(name)
+        ],
+    )
+    indexes = inspector.get_indexes(name)
+    new.create(connection)
+    rows = connection.execute(
+        old.select().execution_options(yield_per=BATCH_SIZE)
+    )
+    for batch in rows.partitions():
+        connection.execute(
+            new.insert(),
+            [
+                {
+                    key: _to_bytes(value) if key in ids else value
+                    for key, value in row._mapping.items()
+                }
+                for row in batch
+            ],
+        )
+    old.drop(connection)
+    connection.execute(text(f'ALTER TABLE "{name}_uuid" RENAME TO "{name}"'))
+    renamed = Table(name, MetaData(), autoload_with=connection)
+    for index in indexes:
+        Index(
+            index["name"],
+            *[renamed.c[c] for c in index["column_names"]],
+            unique=bool(index["unique"]),
+        ).create(connection)
+
+
+def upgrade(connection):
+    """
+    Converts every text id column to the GUID storage format.
+    """
+    inspector = inspect(connection)
+    tables = _pending(inspector)
+    if not tables:
+        return
+    if connection.dialect.name == "postgresql":
+        _upgrade_postgresql(connection, inspector, tables)
+        return
+    for name in tables:
+        _rebuild(connection, inspector, name)
+
+
+if __name__ == "__main__":
+    from app import create_app, db
+
+    with create_app().app_context():
+        with db.engine.begin() as connection:
+            upgrade(connection)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Creates the refresh_tokens table on databases that predate refresh token
+rotation, which used to rely on the table being created at boot.
+
+Usage:
+    python -m migrations.v003_refresh_tokens
+"""
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    MetaData,
+    Table,
+    inspect,
+)
+from models.types import GUID
+
+
+def upgrade(connection):
+    """
+    Creates the refresh_tokens table and its indexes if they are missing.
+    """
+    if inspect(connection).has_table("refresh_tokens"):
+        return
+    metadata = MetaData()
+    Table("users", metadata, Column("userId", GUID(), primary_key=True))
+    refresh_tokens = Table(
+        "refresh_tokens",
+        metadata,
+        Column("family", GUID(), primary_key=True, nullable=False),
+        Column(
+            "user_id", GUID(), ForeignKey("users.userId"), nullable=False
+        ),
+        Column("jti", GUID(), nullable=False),
+        Column("expires_at", DateTime, nullable=False),
+        Index("ix_refresh_tokens_user_id", "user_id"),
+        Index("ix_refresh_tokens_expires_at", "expires_at"),
+    )
+    refresh_tokens.create(connection)
+
+
+if __name__ == "__main__":
+    from app import create_app, db
+
+    with create_app().app_context():
+        with db.engine.begin() as connection:
+            upgrade(connection)
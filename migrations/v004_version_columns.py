@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+"""
+Adds the `version` column used for ETags to users and organisations.
+
+Usage:
+    python -m migrations.v004_version_columns
+"""
+from sqlalchemy import inspect, text
+
+TABLES = ["users", "organisations"]
+
+
+def upgrade(connection):
+    """
+    Adds `version INTEGER NOT NULL DEFAULT 1` where it is missing.
+    """
+    inspector = inspect(connection)
+    for table in TABLES:
+        if table not in inspector.get_table_names():
+            continue
+        columns = {c["name"] for c in inspector.get_columns(table)}
+        if "version" not in columns:
+            connection.execute(
+                text(
+                    f'ALTER TABLE "{table}" '
+                    "ADD COLUMN version INTEGER NOT NULL DEFAULT 1"
+                )
+            )
+
+
+if __name__ == "__main__":
+    from app import create_app, db
+
+    with create_app().app_context():
+        with db.engine.begin() as connection:
+            upgrade(connection)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""
+Adds the search indexes over organisations and users (FTS5 trigram tables
+on SQLite, pg_trgm indexes on Postgres) and indexes the existing rows.
+
+Usage:
+    python -m migrations.v005_search_indexes
+"""
+from sqlalchemy import inspect
+
+
+def upgrade(connection):
+    """
+    Creates the missing search indexes; see models/search.py.
+    """
+    from models.search import SEARCHED, create_search_indexes
+
+    if set(SEARCHED) <= set(inspect(connection).get_table_names()):
+        create_search_indexes(connection)
+
+
+if __name__ == "__main__":
+    from app import create_app, db
+
+    with create_app().app_context():
+        with db.engine.begin() as connection:
+            upgrade(connection)
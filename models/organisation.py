@@ -4,18 +4,28 @@ This file defines the Organisation model.
 """
 
 import uuid
-from sqlalchemy import Column, ForeignKey, String, Table
+from sqlalchemy import Column, ForeignKey, Index, String, Table
+from models.types import GUID
+from models.versioning import Versioned
 from app import db
 
+# The composite primary key indexes lookups by organisation and makes each
+# membership unique; the reverse index covers lookups by user.
 organisation_user_table = Table(
     "organisation_user",
     db.Model.metadata,
-    Column("org_id", String(50), ForeignKey("organisations.org_id")),
-    Column("user_id", String(50), ForeignKey("users.userId")),
+    Column(
+        "org_id",
+        GUID(),
+        ForeignKey("organisations.org_id"),
+        primary_key=True,
+    ),
+    Column("user_id", GUID(), ForeignKey("users.userId"), primary_key=True),
+    Index("ix_organisation_user_user_id_org_id", "user_id", "org_id"),
 )
 
 
-class Organisation(db.Model):
+class Organisation(Versioned, db.Model):
     """
     Organisation model.
     """
@@ -23,17 +33,19 @@ class Organisation(db.Model):
     __tablename__ = "organisations"
 
     org_id = Column(
-        String(50),
+        GUID(),
         primary_key=True,
         default=lambda: str(uuid.uuid4()),
         nullable=False,
         unique=True,
     )
-    # create a many to many relationship with the User model
+    # create a many to many relationship with the User model (see
+    # User.organisations for how it is loaded)
     users = db.relationship(
         "User",
         back_populates="organisations",
         secondary=organisation_user_table,
+        lazy="select",
     )
     name = Column(String(50), nullable=False)
     description = Column(String(50))
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""
+This file defines the RefreshToken model.
+"""
+
+from sqlalchemy import Column, DateTime, ForeignKey
+from models.types import GUID
+from app import db
+
+
+class RefreshToken(db.Model):
+    """
+    RefreshToken model.
+
+    Each row is one refresh token family, started by a login or
+    registration. Only the most recently issued token of a family (`jti`)
+    may be used; presenting an older one means the family was stolen and
+    the whole family is revoked.
+    """
+
+    __tablename__ = "refresh_tokens"
+
+    family = Column(GUID(), primary_key=True, nullable=False)
+    user_id = Column(
+        GUID(), ForeignKey("users.userId"), nullable=False, index=True
+    )
+    jti = Column(GUID(), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"<RefreshToken {self.family}>"
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+This file defines the search indexes over organisations and users.
+
+On SQLite each searched table gets an FTS5 table with the trigram
+tokenizer (organisations_search, users_search), kept up to date by
+triggers and ranked by bm25 with names weighted above the other columns
+(see SEARCHED). FTS5 rowids are mapped to the rows' ids through a key table
+(organisations_search_keys, users_search_keys), because the implicit rowids
+of the models' tables may change on VACUUM.
+
+On Postgres each searched table gets a pg_trgm GIN index on the lower-cased
+concatenation of its searched columns; `document` returns that exact
+expression so queries can use the index.
+
+Other databases have no search index and are searched with a scan.
+
+The indexes are created with the tables (after_create on the models'
+metadata) and added to existing databases by migration v005.
+"""
+from sqlalchemy import (
+    Column,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    event,
+    func,
+    literal_column,
+    text,
+)
+from models.organisation import Organisation
+from models.types import GUID
+from models.user import User
+from app import db
+
+# table -> (key column, {searched column: bm25 weight on SQLite})
+SEARCHED = {
+    "organisations": ("org_id", {"name": 10.0, "description": 1.0}),
+    "users": ("userId", {"firstName": 4.0, "lastName": 4.0, "email": 1.0}),
+}
+
+search_metadata = MetaData()
+
+
+def _search_tables(table, key):
+    # The FTS5 table, with its hidden table-named column (for MATCH) and
+    # its bm25 rank, and the key table mapping its rowids to the row ids
+    index = Table(
+        f"{table}_search",
+        search_metadata,
+        Column("rowid", Integer, primary_key=True),
+        Column(f"{table}_search", String),
+        Column("rank", String),
+    )
+    keys = Table(
+        f"{table}_search_keys",
+        search_metadata,
+        Column("rowid", Integer, primary_key=True),
+        Column(key, GUID(), nullable=False, unique=True),
+    )
+    return index, keys
+
+
+organisations_search, organisations_search_keys = _search_tables(
+    "organisations", "org_id"
+)
+users_search, users_search_keys = _search_tables("users", "userId")
+
+
+def document(model):
+    """
+    Returns the expression the Postgres trigram index of a model covers.
+    """
+    _, columns = SEARCHED[model.__tablename__]
+    expression = None
+    for name in columns:
+        column = getattr(model, name)
+        if column.nullable:
+            column = func.coalesce(column, literal_column("''"))
+        expression = (
+            column
+            if expression is None
+            else expression.concat(literal_column("' '")).concat(column)
+        )
+    return func.lower(expression)
+
+
+def _sqlite_ddl(table, key, columns):
+    quoted = ", ".join(f'"{c}"' for c in columns)
+    new = ", ".join(f'new."{c}"' for c in columns)
+    assignments = ", ".join(f'"{c}" = new."{c}"' for c in columns)
+    weights = ", ".join(str(weight) for weight in columns.values())
+
+    def rowid(row):
+        return (
+            f"(SELECT rowid FROM {table}_search_keys "
+            f'WHERE "{key}" = {row}."{key}")'
+        )
+
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {table}_search "
+        f"USING fts5({quoted}, tokenize='trigram')",
+        f"INSERT INTO {table}_search ({table}_search, rank) "
+        f"VALUES ('rank', 'bm25({weights})')",
+        f"CREATE TABLE IF NOT EXISTS {table}_search_keys ("
+        f'rowid INTEGER PRIMARY KEY, "{key}" BLOB NOT NULL UNIQUE)',
+        f"CREATE TRIGGER IF NOT EXISTS {table}_search_insert "
+        f"AFTER INSERT ON {table} BEGIN "
+        f'INSERT INTO {table}_search_keys ("{key}") VALUES (new."{key}"); '
+        f"INSERT INTO {table}_search (rowid, {quoted}) "
+        f"VALUES (last_insert_rowid(), {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_search_update "
+        f"AFTER UPDATE OF {quoted} ON {table} BEGIN "
+        f"UPDATE {table}_search SET {assignments} "
+        f"WHERE rowid = {rowid('new')}; END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_search_delete "
+        f"AFTER DELETE ON {table} BEGIN "
+        f"DELETE FROM {table}_search WHERE rowid = {rowid('old')}; "
+        f'DELETE FROM {table}_search_keys WHERE "{key}" = old."{key}"; END',
+    ]
+
+
+def _sqlite_backfill(table, key, columns):
+    quoted = ", ".join(f'"{c}"' for c in columns)
+    source = ", ".join(f't."{c}"' for c in columns)
+    return [
+        f'INSERT INTO {table}_search_keys ("{key}") '
+        f'SELECT "{key}" FROM {table} WHERE "{key}" NOT IN '
+        f'(SELECT "{key}" FROM {table}_search_keys)',
+        f"INSERT INTO {table}_search (rowid, {quoted}) "
+        f"SELECT k.rowid, {source} FROM {table}_search_keys k "
+        f'JOIN {table} t ON t."{key}" = k."{key}" '
+        f"WHERE k.rowid NOT IN (SELECT rowid FROM {table}_search)",
+    ]
+
+
+def create_search_indexes(connection):
+    """
+    Creates the missing search indexes and indexes the existing rows.
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        for table, (key, columns) in SEARCHED.items():
+            for statement in _sqlite_ddl(table, key, columns):
+                connection.execute(text(statement))
+            for statement in _sqlite_backfill(table, key, columns):
+                connection.execute(text(statement))
+    elif dialect == "postgresql":
+        connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+        for model in (Organisation, User):
+            expression = document(model).compile(
+                dialect=connection.dialect,
+                compile_kwargs={"literal_binds": True},
+            )
+            # Unqualified, as index expressions refer to the table's columns
+            expression = str(expression).replace(
+                f"{model.__tablename__}.", ""
+            )
+            connection.execute(
+                text(
+                    f"CREATE INDEX IF NOT EXISTS "
+                    f"ix_{model.__tablename__}_search "
+                    f"ON {model.__tablename__} "
+                    f"USING gin (({expression}) gin_trgm_ops)"
+                )
+            )
+
+
+def drop_search_indexes(connection):
+    """
+    Drops the SQLite search tables (Postgres indexes go with their tables).
+    """
+    if connection.dialect.name == "sqlite":
+        for table in SEARCHED:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table}_search"))
+            connection.execute(
+                text(f"DROP TABLE IF EXISTS {table}_search_keys")
+            )
+
+
+@event.listens_for(db.Model.metadata, "after_create")
+def _after_create(metadata, connection, **kw):
+    if set(SEARCHED) <= set(metadata.tables):
+        create_search_indexes(connection)
+
+
+@event.listens_for(db.Model.metadata, "before_drop")
+def _before_drop(metadata, connection, **kw):
+    drop_search_indexes(connection)
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+This file defines the custom column types shared by the models.
+"""
+
+import uuid
+from sqlalchemy import LargeBinary
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.types import TypeDecorator
+
+
+class GUID(TypeDecorator):
+    """
+    A UUID stored as a native UUID on Postgres and as 16 raw bytes
+    elsewhere, instead of 36+ characters of text.
+
+    Values are bound from strings (or uuid.UUID objects) and always loaded
+    back as canonical strings, so the rest of the app keeps working with
+    string ids. Binding a string that is not a UUID raises ValueError; use
+    `is_valid_id` to check untrusted ids first.
+    """
+
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(value)
+        return value if dialect.name == "postgresql" else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        return str(uuid.UUID(bytes=bytes(value)))
+
+
+def is_valid_id(value):
+    """
+    Checks whether a value can be bound to a GUID column.
+    """
+    if isinstance(value, uuid.UUID):
+        return True
+    try:
+        uuid.UUID(value)
+    except (TypeError, ValueError, AttributeError):
+        return False
+    return True
@@ -6,12 +6,14 @@ This file defines the User model.
 import uuid
 from flask import Flask
 from sqlalchemy import Column, String
-from werkzeug.security import generate_password_hash, check_password_hash
 from models.organisation import organisation_user_table
+from models.types import GUID
+from models.versioning import Versioned
+from app.hashing import hash_password, needs_rehash, verify_password
 from app import db
 
 
-class User(db.Model):
+class User(Versioned, db.Model):
     """
     User model.
     """
@@ -19,7 +21,7 @@ class User(db.Model):
     __tablename__ = "users"
 
     userId = Column(
-        String(50),
+        GUID(),
         primary_key=True,
         default=lambda: str(uuid.uuid4()),
         nullable=False,
@@ -30,11 +32,14 @@ class User(db.Model):
     email = Column(String(50), nullable=False, unique=True, index=True)
     password = Column(String(255), nullable=False)
     phone = Column(String(50))
-    # create a one to many relationship with the Organisation model
+    # create a one to many relationship with the Organisation model.
+    # Loaded lazily only when nothing was declared; views declare their
+    # loads with app.loading.eager_loads (DB_STRICT_LOADING raises instead)
     organisations = db.relationship(
         "Organisation",
         back_populates="users",
         secondary=organisation_user_table,
+        lazy="select",
     )
 
     def __init__(self, firstName, lastName, email, password="", phone=""):
@@ -45,10 +50,19 @@ class User(db.Model):
         self.phone = phone
 
     def set_password(self, password):
-        self.password = generate_password_hash(password)
+        self.password = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        """
+        Checks a password against the stored hash. When it matches but the
+        hash uses outdated parameters, the password is rehashed with the
+        current policy; the caller is responsible for committing.
+        """
+        if not verify_password(self.password, password):
+            return False
+        if needs_rehash(self.password):
+            self.set_password(password)
+        return True
 
     def to_dict(self):
         return {
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""
+This file defines the version column used to build ETags.
+"""
+
+from sqlalchemy import Column, Integer, event
+from sqlalchemy.orm import object_session
+
+
+class Versioned:
+    """
+    Adds a `version` column that starts at 1 and is incremented in SQL by
+    every ORM update of the row, so a row's (id, version) identifies its
+    content. Code that updates rows with Core statements must increment the
+    version itself.
+    """
+
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+
+@event.listens_for(Versioned, "before_update", propagate=True)
+def increment_version(mapper, connection, target):
+    session = object_session(target)
+    if session.is_modified(target, include_collections=False):
+        # Incremented by the database, so concurrent updates never share one
+        target.version = type(target).version + 1
@@ -10,6 +10,9 @@ fi
 # This script is used to run the project
 sudo systemctl restart nginx
 
+# Apply pending database migrations
+venv/bin/flask --app run db upgrade || exit 1
+
 # Start the service
 sudo systemctl stop app_service
 sudo systemctl start app_service
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the API blueprint.
+"""
+import unittest
+from flask import json
+from app import create_app, db
+from models.user import User
+from models.organisation import Organisation
+from tests.queries import QueryBudgetMixin
+
+
+class ApiTestCase(QueryBudgetMixin, unittest.TestCase):
+    """
+    Test cases for the API blueprint.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app()
+        self.app.config["TESTING"] = True
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            user = User(
+                firstName="John", lastName="Doe", email="john@test.com"
+            )
+            user.set_password("password")
+            user.organisations.extend(
+                Organisation(name=f"Org {i}") for i in range(25)
+            )
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.userId
+            self.org_ids = sorted(org.org_id for org in user.organisations)
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "john@test.com", "password": "password"},
+        )
+        token = json.loads(response.data)["data"]["accessToken"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def get(self, url):
+        response = self.client.get(url, headers=self.headers)
+        return response.status_code, json.loads(response.data)
+
+    def test_get_organisations_without_limit_returns_all(self):
+        """
+        Test that the organisation list is unpaginated by default.
+        """
+        status, data = self.get("/api/organisations")
+        self.assertEqual(status, 200)
+        self.assertEqual(len(data["data"]["organisations"]), 25)
+        self.assertNotIn("nextCursor", data["data"])
+
+    def test_get_organisations_keyset_pagination(self):
+        """
+        Test that pages follow each other through nextCursor.
+        """
+        seen = []
+        url = "/api/organisations?limit=10&includeTotal=true"
+        while True:
+            status, data = self.get(url)
+            self.assertEqual(status, 200)
+            self.assertEqual(data["data"]["total"], 25)
+            seen += [o["orgId"] for o in data["data"]["organisations"]]
+            cursor = data["data"]["nextCursor"]
+            if cursor is None:
+                break
+            url = f"/api/organisations?limit=10&after={cursor}&includeTotal=true"
+        self.assertEqual(seen, self.org_ids)
+
+    def test_get_organisations_rejects_invalid_limit(self):
+        """
+        Test that a non-numeric or non-positive limit is a client error.
+        """
+        for limit in ["abc", "0", "-1"]:
+            status, _ = self.get(f"/api/organisations?limit={limit}")
+            self.assertEqual(status, 400)
+
+    def test_get_organisations_stream(self):
+        """
+        Test that the streamed response matches the paginated data.
+        """
+        status, data = self.get(
+            f"/api/organisations?stream=true&after={self.org_ids[4]}"
+            "&includeTotal=true"
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(data["status"], "success")
+        self.assertEqual(data["data"]["total"], 25)
+        self.assertEqual(
+            [o["orgId"] for o in data["data"]["organisations"]],
+            self.org_ids[5:],
+        )
+
+    def test_get_organisations_stream_pagination(self):
+        """
+        Test that streamed pages carry a nextCursor like the paged ones.
+        """
+        seen = []
+        url = "/api/organisations?stream=true&limit=10"
+        while True:
+            status, data = self.get(url)
+            self.assertEqual(status, 200)
+            seen += [o["orgId"] for o in data["data"]["organisations"]]
+            cursor = data["data"]["nextCursor"]
+            if cursor is None:
+                break
+            url = f"/api/organisations?stream=true&limit=10&after={cursor}"
+        self.assertEqual(seen, self.org_ids)
+
+    def test_add_many_users_to_organisation(self):
+        """
+        Test that a list of user ids is added in one request with a result
+        for each id.
+        """
+        with self.app.app_context():
+            users = [
+                User(firstName="User", lastName=str(i), email=f"{i}@test.com")
+                for i in range(3)
+            ]
+            for user in users:
+                user.password = "x"
+            db.session.add_all(users)
+            db.session.commit()
+            new_ids = [user.userId for user in users]
+        user_ids = [self.user_id] + new_ids + ["missing", new_ids[0]]
+        # Other spellings of a valid id match the same user
+        user_ids.append(new_ids[1].upper())
+        response = self.client.post(
+            f"/api/organisations/{self.org_ids[0]}/users",
+            json={"userIds": user_ids},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)["data"]
+        self.assertEqual(
+            (data["added"], data["alreadyMember"], data["notFound"]), (4, 1, 1)
+        )
+        results = {r["userId"]: r["result"] for r in data["results"]}
+        self.assertEqual(results[self.user_id], "already-member")
+        self.assertEqual(results["missing"], "not-found")
+        self.assertEqual(results[new_ids[0]], "added")
+        self.assertEqual(results[new_ids[1].upper()], "added")
+        with self.app.app_context():
+            org = db.session.get(Organisation, self.org_ids[0])
+            self.assertEqual(len(org.users), 4)
+
+    def test_add_many_users_validates_input(self):
+        """
+        Test that malformed id lists and unknown organisations are rejected.
+        """
+        url = f"/api/organisations/{self.org_ids[0]}/users"
+        for user_ids in [[], "abc", [1, 2]]:
+            response = self.client.post(
+                url, json={"userIds": user_ids}, headers=self.headers
+            )
+            self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/api/organisations/missing/users",
+            json={"userIds": ["a"]},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_add_users_requires_membership(self):
+        """
+        Test that only members of an organisation can add users to it.
+        """
+        with self.app.app_context():
+            outsider = User(
+                firstName="Eve", lastName="Doe", email="eve@test.com"
+            )
+            outsider.set_password("password")
+            outsider.organisations.append(Organisation(name="Eve's Org"))
+            db.session.add(outsider)
+            db.session.commit()
+            outsider_id = outsider.userId
+        url = f"/api/organisations/{self.org_ids[0]}/users"
+        for body in [{"userId": outsider_id}, {"userIds": [outsider_id]}]:
+            response = self.client.post(url, json=body)
+            self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "eve@test.com", "password": "password"},
+        )
+        token = json.loads(response.data)["data"]["accessToken"]
+        response = self.client.post(
+            url,
+            json={"userIds": [outsider_id]},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        self.assertEqual(response.status_code, 401)
+        with self.app.app_context():
+            org = db.session.get(Organisation, self.org_ids[0])
+            self.assertEqual(len(org.users), 1)
+
+    def test_list_organisation_users_pages_through_members(self):
+        """
+        Test that members are listed a page at a time without password
+        hashes.
+        """
+        with self.app.app_context():
+            users = [
+                User(firstName="User", lastName=str(i), email=f"{i}@test.com")
+                for i in range(4)
+            ]
+            for user in users:
+                user.password = "x"
+            db.session.add_all(users)
+            db.session.commit()
+            member_ids = sorted([self.user_id] + [u.userId for u in users])
+        self.client.post(
+            f"/api/organisations/{self.org_ids[0]}/users",
+            json={"userIds": member_ids},
+            headers=self.headers,
+        )
+        seen = []
+        url = f"/api/organisations/{self.org_ids[0]}/users?limit=2"
+        while url:
+            status, data = self.get(url + "&includeTotal=true")
+            self.assertEqual(status, 200)
+            self.assertEqual(data["data"]["total"], 5)
+            for member in data["data"]["users"]:
+                self.assertNotIn("password", member)
+                seen.append(member["userId"])
+            cursor = data["data"]["nextCursor"]
+            url = cursor and f"{url.split('&')[0]}&after={cursor}"
+        self.assertEqual(seen, member_ids)
+        status, data = self.get(f"/api/organisations/{self.org_ids[1]}/users")
+        self.assertEqual(data["data"]["users"][0]["email"], "john@test.com")
+        self.assertNotIn("total", data["data"])
+
+    def test_list_organisation_users_checks_access(self):
+        """
+        Test that only members may list an organisation's users.
+        """
+        with self.app.app_context():
+            org = Organisation(name="Other Org")
+            db.session.add(org)
+            db.session.commit()
+            other_org = org.org_id
+        status, _ = self.get(f"/api/organisations/{other_org}/users")
+        self.assertEqual(status, 401)
+        status, _ = self.get("/api/organisations/missing/users")
+        self.assertEqual(status, 404)
+        url = f"/api/organisations/{self.org_ids[0].upper()}/users"
+        status, _ = self.get(url)
+        self.assertEqual(status, 200)
+        for limit in ["0", "1001", "abc"]:
+            status, _ = self.get(f"{url}?limit={limit}")
+            self.assertEqual(status, 400)
+
+    def conditional_get(self, url, etag):
+        return self.client.get(
+            url, headers={**self.headers, "If-None-Match": f'"{etag}"'}
+        )
+
+    def test_get_organisation_is_conditional(self):
+        """
+        Test that an unchanged organisation gets a 304 from a version
+        lookup, and an updated one a new ETag.
+        """
+        url = f"/api/organisations/{self.org_ids[0]}"
+        response = self.client.get(url, headers=self.headers)
+        etag = response.get_etag()[0]
+        self.assertTrue(etag)
+        with self.assertMaxQueries(3):
+            response = self.conditional_get(url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b"")
+        with self.app.app_context():
+            org = db.session.get(Organisation, self.org_ids[0])
+            org.description = "Changed"
+            db.session.commit()
+            self.assertEqual(org.version, 2)
+        response = self.conditional_get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.get_etag()[0], etag)
+        self.assertEqual(
+            json.loads(response.data)["data"]["description"], "Changed"
+        )
+
+    def test_get_organisations_is_conditional(self):
+        """
+        Test that the organisation list gets a 304 until a membership
+        changes.
+        """
+        url = "/api/organisations?limit=10&includeTotal=true"
+        etag = self.client.get(url, headers=self.headers).get_etag()[0]
+        self.assertEqual(self.conditional_get(url, etag).status_code, 304)
+        other = self.client.get("/api/organisations", headers=self.headers)
+        self.assertNotEqual(other.get_etag()[0], etag)
+        self.client.post(
+            "/api/organisations", json={"name": "New"}, headers=self.headers
+        )
+        response = self.conditional_get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["data"]["total"], 26)
+
+    def test_get_user_is_conditional(self):
+        """
+        Test that user reads carry an ETag that answers with a 304.
+        """
+        url = f"/api/users/{self.user_id}"
+        etag = self.client.get(url, headers=self.headers).get_etag()[0]
+        self.assertEqual(self.conditional_get(url, etag).status_code, 304)
+        self.assertEqual(self.conditional_get(url, "other").status_code, 200)
+
+
+if __name__ == "__main__":
+    unittest.main()
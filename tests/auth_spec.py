@@ -2,7 +2,10 @@
 """
 This file defines all the tests for the authentication blueprint.
 """
+import os
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import datetime as dt
 from flask import current_app, json
@@ -263,6 +266,92 @@ class AuthTestCase(unittest.TestCase):
             )
             self.assertEqual(response.status_code, 200)
 
+    def test_refresh_token_rotation(self):
+        """
+        Test that a refresh token yields new tokens and can only be used once.
+        """
+        response = self.client.post(
+            "/auth/register",
+            json={
+                "firstName": "John",
+                "lastName": "Doe",
+                "email": "john@test.com",
+                "password": "password",
+            },
+        )
+        refresh_token = json.loads(response.data)["data"]["refreshToken"]
+
+        # Exchange the refresh token for new tokens
+        response = self.client.post(
+            "/auth/refresh",
+            headers={"Authorization": f"Bearer {refresh_token}"},
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)["data"]
+        new_refresh_token = data["refreshToken"]
+        headers = {"Authorization": f"Bearer {data['accessToken']}"}
+        response = self.client.get("/api/organisations", headers=headers)
+        self.assertEqual(response.status_code, 200)
+
+        # Access tokens cannot be used to refresh
+        response = self.client.post("/auth/refresh", headers=headers)
+        self.assertEqual(response.status_code, 422)
+
+        # Reusing the old refresh token revokes the whole family
+        response = self.client.post(
+            "/auth/refresh",
+            headers={"Authorization": f"Bearer {refresh_token}"},
+        )
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            "/auth/refresh",
+            headers={"Authorization": f"Bearer {new_refresh_token}"},
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_concurrent_registrations_with_same_email(self):
+        """
+        Test that only one of many concurrent registrations with the same
+        email succeeds and the others get the duplicate email error.
+        """
+        fd, path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path}",
+                "HASH_METHOD": "pbkdf2:sha256:1000",
+            }
+        )
+        with app.app_context():
+            db.create_all()
+
+        def register(_):
+            response = app.test_client().post(
+                "/auth/register",
+                json={
+                    "firstName": "John",
+                    "lastName": "Doe",
+                    "email": "john@test.com",
+                    "password": "password",
+                },
+            )
+            return response.status_code, json.loads(response.data)
+
+        try:
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                results = list(executor.map(register, range(32)))
+            statuses = sorted(status for status, _ in results)
+            self.assertEqual(statuses, [201] + [422] * 31)
+            for status, data in results:
+                if status == 422:
+                    self.assertEqual(data["errors"][0]["field"], "email")
+            with app.app_context():
+                self.assertEqual(User.query.count(), 1)
+                self.assertEqual(Organisation.query.count(), 1)
+                db.engine.dispose()
+        finally:
+            os.unlink(path)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""
+This file defines the SQL statement budgets of the API and auth routes.
+
+Every route is called for a user with 1, 100 and 1000 memberships and must
+stay within its budget at every size, so a change that adds a query per
+organisation (an N+1) fails here. Strict loading is on, so an undeclared
+lazy load fails too.
+"""
+import unittest
+import uuid
+from flask import json
+from sqlalchemy import insert
+from app import create_app, db
+from models.organisation import Organisation, organisation_user_table
+from models.user import User
+from tests.queries import QueryBudgetMixin
+
+SIZES = (1, 100, 1000)
+
+# Most SQL statements each route may run, whatever the number of memberships.
+# Requests with a JWT include one statement to load the caller's identity.
+# Routes on one organisation add one EXISTS check of the caller's membership.
+BUDGETS = {
+    "auth.register": 5,
+    "auth.login": 3,
+    "auth.refresh": 3,
+    "api.get_user (self)": 1,
+    "api.get_user (shared organisation)": 3,
+    "api.get_organisations": 2,
+    "api.get_organisations (page with total)": 3,
+    "api.get_organisations (stream)": 2,
+    "api.get_organisation": 3,
+    "api.search_organisations": 2,
+    "api.search_organisations (fuzzy)": 3,
+    "api.search_users": 2,
+    "api.create_organisation": 3,
+    "api.add_user_to_organisation": 4,
+    "api.add_user_to_organisation (bulk)": 5,
+    "api.get_organisation_users (page with total)": 4,
+}
+
+
+class QueryBudgetTestCase(QueryBudgetMixin, unittest.TestCase):
+    """
+    Test cases for the SQL statement budgets of every route.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app(
+            {
+                "HASH_PROFILE": "fast",
+                "DB_STRICT_LOADING": True,
+                "TESTING": True,
+            }
+        )
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def seed(self, memberships):
+        """
+        Creates John with `memberships` organisations, Jane who shares the
+        first of them, and `memberships` users who belong to none.
+        """
+        with self.app.app_context():
+            db.drop_all()
+            db.create_all()
+            john = User(firstName="John", lastName="Doe", email="john@test.com")
+            jane = User(firstName="Jane", lastName="Doe", email="jane@test.com")
+            for user in (john, jane):
+                user.set_password("password")
+            db.session.add_all([john, jane])
+            db.session.flush()
+            org_ids = [str(uuid.uuid4()) for _ in range(memberships)]
+            db.session.execute(
+                insert(Organisation),
+                [{"org_id": o, "name": "Org"} for o in org_ids],
+            )
+            db.session.execute(
+                insert(organisation_user_table),
+                [{"org_id": o, "user_id": john.userId} for o in org_ids]
+                + [{"org_id": org_ids[0], "user_id": jane.userId}],
+            )
+            others = [str(uuid.uuid4()) for _ in range(memberships)]
+            db.session.execute(
+                insert(User),
+                [
+                    {
+                        "userId": user_id,
+                        "firstName": "Other",
+                        "lastName": "User",
+                        "email": f"{i}@test.com",
+                        "password": "x",
+                    }
+                    for i, user_id in enumerate(others)
+                ],
+            )
+            db.session.commit()
+            self.john_id, self.jane_id = john.userId, jane.userId
+        self.org_ids, self.others = sorted(org_ids), others
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "john@test.com", "password": "password"},
+        )
+        data = json.loads(response.data)["data"]
+        self.headers = {"Authorization": f"Bearer {data['accessToken']}"}
+        self.refresh_headers = {
+            "Authorization": f"Bearer {data['refreshToken']}"
+        }
+
+    def routes(self):
+        """
+        Returns the label, request and expected status of every call.
+        """
+        credentials = {"email": "john@test.com", "password": "password"}
+        org_users = f"/api/organisations/{self.org_ids[0]}/users"
+        return [
+            (
+                "auth.register",
+                lambda: self.client.post(
+                    "/auth/register",
+                    json={
+                        "firstName": "New",
+                        "lastName": "User",
+                        "email": "new@test.com",
+                        "password": "password",
+                    },
+                ),
+                201,
+            ),
+            (
+                "auth.login",
+                lambda: self.client.post("/auth/login", json=credentials),
+                200,
+            ),
+            (
+                "auth.refresh",
+                lambda: self.client.post(
+                    "/auth/refresh", headers=self.refresh_headers
+                ),
+                200,
+            ),
+            (
+                "api.get_user (self)",
+                lambda: self.client.get(
+                    f"/api/users/{self.john_id}", headers=self.headers
+                ),
+                200,
+            ),
+            (
+                "api.get_user (shared organisation)",
+                lambda: self.client.get(
+                    f"/api/users/{self.jane_id}", headers=self.headers
+                ),
+                200,
+            ),
+            (
+                "api.get_organisations",
+                lambda: self.client.get(
+                    "/api/organisations", headers=self.headers
+                ),
+                200,
+            ),
+            (
+                "api.get_organisations (page with total)",
+                lambda: self.client.get(
+                    "/api/organisations?limit=10&includeTotal=true",
+                    headers=self.headers,
+                ),
+                200,
+            ),
+            (
+                "api.get_organisations (stream)",
+                lambda: self.client.get(
+                    "/api/organisations?stream=true", headers=self.headers
+                ),
+                200,
+            ),
+            (
+                "api.get_organisation",
+                lambda: self.client.get(
+                    f"/api/organisations/{self.org_ids[0]}",
+                    headers=self.headers,
+                ),
+                200,
+            ),
+            (
+                "api.search_organisations",
+                lambda: self.client.get(
+                    "/api/organisations/search?q=org", headers=self.headers
+                ),
+                200,
+            ),
+            (
+                # No exact match, so the fuzzy search runs too
+                "api.search_organisations (fuzzy)",
+                lambda: self.client.get(
+                    "/api/organisations/search?q=orgg", headers=self.headers
+                ),
+                200,
+            ),
+            (
+                "api.search_users",
+                lambda: self.client.get(
+                    "/api/users/search?q=doe", headers=self.headers
+                ),
+                200,
+            ),
+            (
+                "api.create_organisation",
+                lambda: self.client.post(
+                    "/api/organisations",
+                    json={"name": "New Org"},
+                    headers=self.headers,
+                ),
+                201,
+            ),
+            (
+                "api.add_user_to_organisation",
+                lambda: self.client.post(
+                    org_users,
+                    json={"userId": self.others[0]},
+                    headers=self.headers,
+                ),
+                200,
+            ),
+            (
+                "api.add_user_to_organisation (bulk)",
+                lambda: self.client.post(
+                    org_users,
+                    json={"userIds": self.others},
+                    headers=self.headers,
+                ),
+                200,
+            ),
+            (
+                # After the bulk add, the organisation has as many members
+                "api.get_organisation_users (page with total)",
+                lambda: self.client.get(
+                    f"{org_users}?limit=100&includeTotal=true",
+                    headers=self.headers,
+                ),
+                200,
+            ),
+        ]
+
+    def test_routes_stay_within_budget(self):
+        """
+        Test that no route runs more statements than its budget as the
+        number of memberships grows.
+        """
+        for size in SIZES:
+            self.seed(size)
+            routes = self.routes()
+            self.assertEqual({route[0] for route in routes}, set(BUDGETS))
+            for label, call, status in routes:
+                with self.subTest(route=label, memberships=size):
+                    with self.assertMaxQueries(BUDGETS[label], label):
+                        response = call()
+                        # Streamed bodies run their queries as they are read
+                        response.get_data()
+                    self.assertEqual(response.status_code, status)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the bulk organisation export.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from app import create_app, db
+from models.organisation import Organisation
+from models.user import User
+
+
+class ExporterTestCase(unittest.TestCase):
+    """
+    Test cases for the bulk organisation export.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app(
+            {
+                "HASH_PROFILE": "fast",
+                "INTERNAL_TOKEN": "secret",
+                "TESTING": True,
+            }
+        )
+        self.client = self.app.test_client()
+        self.client.environ_base["HTTP_X_INTERNAL_TOKEN"] = "secret"
+
+        with self.app.app_context():
+            db.create_all()
+            users = [
+                User(firstName=name, lastName="Doe", email=f"{name}@test.com")
+                for name in ("john", "jane", "jack")
+            ]
+            for user in users:
+                user.set_password("password")
+            organisations = [
+                Organisation(name=f"Org {i}", description=f"Number {i}")
+                for i in range(5)
+            ]
+            organisations[0].users.extend(users)
+            organisations[1].users.append(users[1])
+            db.session.add_all(users + organisations)
+            db.session.commit()
+            self.members = {
+                o.org_id: sorted(u.userId for u in o.users)
+                for o in organisations
+            }
+        self.org_ids = sorted(self.members)
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def export(self, *args):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, args[0])
+            result = self.app.test_cli_runner().invoke(
+                args=["export-organisations", path, *args[1:]]
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            with open(path, "rb") as file:
+                data = file.read()
+        return result, data
+
+    def test_export_ndjson_in_chunks_with_cli(self):
+        """
+        Test that the export holds every organisation once, in orgId order,
+        with its members, across chunks.
+        """
+        result, data = self.export("orgs.ndjson", "--chunk-size", "2")
+        records = [json.loads(line) for line in data.decode().splitlines()]
+        self.assertEqual([r["orgId"] for r in records], self.org_ids)
+        for record in records:
+            self.assertEqual(record["members"], self.members[record["orgId"]])
+        self.assertIn("5 organisations, 4 memberships", result.output)
+
+        # Resuming after the second organisation exports the rest
+        _, data = self.export(
+            "rest.ndjson", "--after", self.org_ids[1], "--limit", "2"
+        )
+        records = [json.loads(line) for line in data.decode().splitlines()]
+        self.assertEqual([r["orgId"] for r in records], self.org_ids[2:4])
+
+    def test_export_gzipped_csv_with_cli(self):
+        """
+        Test that a .csv.gz export is gzipped CSV with one row per
+        membership.
+        """
+        _, data = self.export("orgs.csv.gz", "--chunk-size", "3")
+        text = gzip.decompress(data).decode()
+        rows = list(csv.DictReader(io.StringIO(text)))
+        expected = sum(len(members) or 1 for members in self.members.values())
+        self.assertEqual(len(rows), expected)
+        org_ids = [row["orgId"] for row in rows]
+        self.assertEqual(org_ids, sorted(org_ids))
+        memberless = [row for row in rows if not self.members[row["orgId"]]]
+        self.assertEqual({row["userId"] for row in memberless}, {""})
+
+    def test_export_endpoint(self):
+        """
+        Test that the endpoint streams the export, gzipped when accepted,
+        and rejects bad parameters.
+        """
+        response = self.client.get(
+            f"/internal/organisations/export?after={self.org_ids[0]}",
+            headers={"Accept-Encoding": "gzip"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        lines = gzip.decompress(response.data).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line)["orgId"] for line in lines], self.org_ids[1:]
+        )
+
+        response = self.client.get(
+            "/internal/organisations/export?format=csv&limit=1"
+        )
+        self.assertEqual(response.mimetype, "text/csv")
+        self.assertNotIn("Content-Encoding", response.headers)
+        rows = list(csv.DictReader(io.StringIO(response.data.decode())))
+        self.assertEqual({row["orgId"] for row in rows}, {self.org_ids[0]})
+
+        for query in ["format=xml", "after=nope", "limit=0"]:
+            response = self.client.get(
+                f"/internal/organisations/export?{query}"
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+    def test_export_endpoint_requires_the_internal_token(self):
+        """
+        Test that the export is refused without the internal token, and
+        to everyone when no token is configured.
+        """
+        response = self.app.test_client().get("/internal/organisations/export")
+        self.assertEqual(response.status_code, 403)
+        self.app.config["INTERNAL_TOKEN"] = None
+        for headers in [{}, {"X-Internal-Token": ""}]:
+            response = self.app.test_client().get(
+                "/internal/organisations/export", headers=headers
+            )
+            self.assertEqual(response.status_code, 403)
+            self.assertNotIn(self.org_ids[0], response.get_data(as_text=True))
+
+if __name__ == "__main__":
+    unittest.main()
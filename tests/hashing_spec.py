@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the password hashing pool.
+"""
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from flask import json
+from app import create_app, db
+from app.hashing import HashingPool, HashingPoolSaturated, needs_rehash
+from models.user import User
+
+
+class HashingTestCase(unittest.TestCase):
+    """
+    Test cases for the password hashing pool.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app()
+        self.app.config["TESTING"] = True
+        self.app.config["INTERNAL_TOKEN"] = "secret"
+        self.client = self.app.test_client()
+        self.client.environ_base["HTTP_X_INTERNAL_TOKEN"] = "secret"
+
+        with self.app.app_context():
+            db.create_all()
+            user = User(
+                firstName="John", lastName="Doe", email="john@test.com"
+            )
+            user.set_password("password")
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+        self.app.extensions["hashing"].shutdown()
+
+    def login(self):
+        return self.client.post(
+            "/auth/login",
+            json={"email": "john@test.com", "password": "password"},
+        )
+
+    def test_hashes_on_process_pool(self):
+        """
+        Test that hashes computed on worker processes can be verified.
+        """
+        self.app.extensions["hashing"] = HashingPool(workers=1)
+        with self.app.app_context():
+            user = User(firstName="Jane", lastName="Doe", email="j@test.com")
+            user.set_password("secret")
+            self.assertTrue(user.check_password("secret"))
+            self.assertFalse(user.check_password("wrong"))
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_saturated_pool_returns_503(self):
+        """
+        Test that logins fail fast with a 503 when the pool is saturated.
+        """
+        pool = HashingPool(workers=1, queue_depth=0, acquire_timeout=0)
+        self.app.extensions["hashing"] = pool
+        pool._slots.acquire()
+        response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response.headers)
+        pool._slots.release()
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(pool.stats()["rejected"], 1)
+
+    def test_concurrent_logins_saturate_pool(self):
+        """
+        Test that concurrent logins beyond the pool's capacity get a 503
+        while the others succeed, as in a gthread or gevent worker.
+        """
+        pool = HashingPool(workers=1, queue_depth=1, acquire_timeout=0)
+        self.app.extensions["hashing"] = pool
+        barrier = Barrier(6)
+
+        def login():
+            barrier.wait()
+            return self.app.test_client().post(
+                "/auth/login",
+                json={"email": "john@test.com", "password": "password"},
+            ).status_code
+
+        with ThreadPoolExecutor(6) as threads:
+            statuses = list(threads.map(lambda _: login(), range(6)))
+        self.assertIn(200, statuses)
+        self.assertIn(503, statuses)
+        self.assertEqual(statuses.count(503), pool.stats()["rejected"])
+
+    def test_counters_are_exact_under_threads(self):
+        """
+        Test that no update of the pool's counters is lost when many
+        threads run and get rejected at once.
+        """
+        pool = HashingPool(workers=1, queue_depth=0, acquire_timeout=0)
+        pool._slots.acquire()
+        inline = HashingPool()
+
+        def run(_):
+            for _ in range(500):
+                inline.run(len, "x")
+                try:
+                    pool.run(len, "x")
+                except HashingPoolSaturated:
+                    pass
+
+        with ThreadPoolExecutor(8) as threads:
+            list(threads.map(run, range(8)))
+        self.assertEqual(pool.stats()["rejected"], 4000)
+        self.assertEqual(inline.stats()["inFlight"], 0)
+        self.assertEqual(inline.stats()["latency"]["count"], 4000)
+
+    def test_metrics_report_hash_latency(self):
+        """
+        Test that hash latency is exposed on the internal metrics endpoint.
+        """
+        self.login()
+        response = self.client.get("/internal/metrics")
+        self.assertEqual(response.status_code, 200)
+        latency = json.loads(response.data)["hashing"]["latency"]
+        self.assertGreaterEqual(latency["count"], 2)
+        self.assertGreater(latency["p99Seconds"], 0)
+
+    def test_login_upgrades_outdated_hash(self):
+        """
+        Test that a successful login rehashes with the current policy.
+        """
+        self.app.config["HASH_METHOD"] = "pbkdf2:sha256:1000"
+        with self.app.app_context():
+            user = User.query.filter_by(email="john@test.com").first()
+            old_hash = user.password
+            self.assertTrue(needs_rehash(old_hash))
+        self.assertEqual(self.login().status_code, 200)
+        with self.app.app_context():
+            user = User.query.filter_by(email="john@test.com").first()
+            self.assertNotEqual(user.password, old_hash)
+            self.assertTrue(user.password.startswith("pbkdf2:sha256:1000$"))
+            self.assertFalse(needs_rehash(user.password))
+        self.assertEqual(self.login().status_code, 200)
+
+    def test_needs_rehash_compares_explicit_parameters(self):
+        """
+        Test that default and explicit spellings of a method are equal.
+        """
+        with self.app.app_context():
+            self.app.config["HASH_METHOD"] = "pbkdf2"
+            self.assertFalse(needs_rehash("pbkdf2:sha256:600000$" + "s" * 16))
+            self.assertTrue(needs_rehash("pbkdf2:sha256:1000$" + "s" * 16))
+            self.assertTrue(needs_rehash("pbkdf2:sha256:600000$short"))
+            self.assertTrue(needs_rehash("md5$" + "s" * 16))
+
+
+if __name__ == "__main__":
+    unittest.main()
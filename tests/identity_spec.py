@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the JWT identity loader and its cache.
+"""
+import unittest
+from flask import json
+from app import create_app, db, identity
+from models.user import User
+from models.organisation import Organisation
+from tests.queries import QueryCounter
+
+
+class IdentityTestCase(unittest.TestCase):
+    """
+    Test cases for the JWT identity loader and its cache.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app()
+        self.app.config["TESTING"] = True
+        self.app.config["IDENTITY_CACHE_TTL"] = 60
+        identity.init_app(self.app)
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            user = User(
+                firstName="John", lastName="Doe", email="john@test.com"
+            )
+            user.set_password("password")
+            user.organisations.append(Organisation(name="John's Org"))
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.userId
+            self.org_id = user.organisations[0].org_id
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "john@test.com", "password": "password"},
+        )
+        token = json.loads(response.data)["data"]["accessToken"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def count_statements(self, method, url, **kwargs):
+        with self.app.app_context():
+            engine = db.engine
+        with QueryCounter(engine) as counter:
+            response = getattr(self.client, method)(url, **kwargs)
+        return response, counter.statements
+
+    def test_cached_identity_needs_no_query(self):
+        """
+        Test that repeated requests reuse the cached identity.
+        """
+        url = f"/api/users/{self.user_id}"
+        response, statements = self.count_statements(
+            "get", url, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        response, statements = self.count_statements(
+            "get", url, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 0)
+
+    def test_identity_does_not_load_memberships(self):
+        """
+        Test that loading the identity reads the user row only, however
+        many organisations the user belongs to.
+        """
+        with self.app.app_context():
+            user = db.session.get(User, self.user_id)
+            user.organisations.extend(
+                Organisation(name=f"Org {i}") for i in range(20)
+            )
+            db.session.commit()
+            identity.forget(self.user_id)
+        response, statements = self.count_statements(
+            "get", f"/api/users/{self.user_id}", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn("organisation_user", statements[0])
+
+    def test_cache_is_invalidated_when_organisation_is_created(self):
+        """
+        Test that a newly created organisation is visible immediately.
+        """
+        response = self.client.get(
+            f"/api/organisations/{self.org_id}", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(
+            "/api/organisations",
+            json={"name": "New Org"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        org_id = json.loads(response.data)["data"]["orgId"]
+        response = self.client.get(
+            f"/api/organisations/{org_id}", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_identity_is_forgotten_when_password_is_rehashed(self):
+        """
+        Test that upgrading a password hash on login drops the cached
+        identity, whose version the user's ETag is built from.
+        """
+        response = self.client.get(
+            f"/api/users/{self.user_id}", headers=self.headers
+        )
+        etag = response.headers["ETag"]
+        cache = self.app.extensions["identity_cache"]
+        self.assertIsNotNone(cache.get(self.user_id))
+        self.app.config["HASH_METHOD"] = "pbkdf2:sha256:1000"
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "john@test.com", "password": "password"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(cache.get(self.user_id))
+        response = self.client.get(
+            f"/api/users/{self.user_id}", headers=self.headers
+        )
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_deleted_user_is_rejected(self):
+        """
+        Test that a token for a user that no longer exists gets a 401.
+        """
+        with self.app.app_context():
+            db.session.delete(db.session.get(User, self.user_id))
+            db.session.commit()
+            identity.forget(self.user_id)
+        response = self.client.get(
+            "/api/organisations", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the bulk user import pipeline.
+"""
+import json
+import os
+import tempfile
+import unittest
+from app import create_app, db
+from models.user import User
+
+
+class ImporterTestCase(unittest.TestCase):
+    """
+    Test cases for the bulk user import pipeline.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app()
+        self.app.config["TESTING"] = True
+        self.app.config["HASH_METHOD"] = "pbkdf2:sha256:1000"
+        self.app.config["IMPORT_HASH_WORKERS"] = 1
+        self.app.config["INTERNAL_TOKEN"] = "secret"
+        self.client = self.app.test_client()
+        self.client.environ_base["HTTP_X_INTERNAL_TOKEN"] = "secret"
+
+        with self.app.app_context():
+            db.create_all()
+            user = User(
+                firstName="John", lastName="Doe", email="john@test.com"
+            )
+            user.set_password("password")
+            db.session.add(user)
+            db.session.commit()
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_import_ndjson_with_cli(self):
+        """
+        Test importing users from an NDJSON file with the CLI command.
+        """
+        records = [
+            {
+                "firstName": f"User{i}",
+                "lastName": "Doe",
+                "email": f"user{i}@test.com",
+                "password": "password",
+            }
+            for i in range(5)
+        ]
+        records.append(dict(records[0]))
+        records.append({"firstName": "No", "email": "no@test.com"})
+        records.append(dict(records[1], email="john@test.com"))
+        with tempfile.NamedTemporaryFile(
+            "w", suffix=".ndjson", delete=False
+        ) as file:
+            file.write("\n".join(json.dumps(r) for r in records))
+            file.write("\nnot json\n")
+        try:
+            result = self.app.test_cli_runner().invoke(
+                args=["import-users", file.name, "--chunk-size", "3"]
+            )
+        finally:
+            os.unlink(file.name)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Imported 5 of 9 rows", result.output)
+        self.assertIn("2 duplicates, 2 invalid", result.output)
+
+        # Imported users can log in and own a default organisation
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "user3@test.com", "password": "password"},
+        )
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            user = User.query.filter_by(email="user3@test.com").first()
+            self.assertEqual(
+                [org.name for org in user.organisations],
+                ["User3's Organisation"],
+            )
+
+    def test_import_rejects_mistyped_and_overlong_fields(self):
+        """
+        Test that rows with non-string or overlong fields are reported as
+        invalid without failing the rest of their chunk.
+        """
+        valid = {
+            "firstName": "Jane",
+            "lastName": "Doe",
+            "email": "jane@test.com",
+            "password": "password",
+        }
+        records = [
+            dict(valid, email=["x@test.com"]),
+            dict(valid, email="a@test.com", password=12345),
+            dict(valid, email="b@test.com", phone=123),
+            dict(valid, email="c@test.com", firstName="J" * 51),
+            dict(valid, email="d" * 45 + "@test.com"),
+            dict(valid, firstName="J" * 50),
+        ]
+        response = self.client.post(
+            "/internal/users/import",
+            data="\n".join(json.dumps(r) for r in records),
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(response.status_code, 200)
+        report = json.loads(response.data)["data"]
+        self.assertEqual((report["imported"], report["invalid"]), (1, 5))
+        self.assertEqual(
+            [error["message"] for error in report["errors"]],
+            [
+                "email must be a string",
+                "password must be a string",
+                "phone must be a string",
+                "firstName must be at most 50 characters",
+                "email must be at most 50 characters",
+            ],
+        )
+        with self.app.app_context():
+            user = User.query.filter_by(email="jane@test.com").first()
+            self.assertEqual(len(user.organisations[0].name), 50)
+
+    def test_import_csv_with_endpoint(self):
+        """
+        Test importing users from a CSV request body.
+        """
+        body = (
+            "firstName,lastName,email,password,phone\n"
+            "Jane,Doe,jane@test.com,password,123\n"
+            "Jack,Doe,jack@test.com,password,\n"
+        )
+        response = self.client.post(
+            "/internal/users/import", data=body, content_type="text/csv"
+        )
+        self.assertEqual(response.status_code, 200)
+        report = json.loads(response.data)["data"]
+        self.assertEqual(report["imported"], 2)
+        self.assertIn("rowsPerSecond", report)
+        with self.app.app_context():
+            user = User.query.filter_by(email="jane@test.com").first()
+            self.assertEqual(user.phone, "123")
+
+
+    def test_import_endpoint_refuses_large_bodies(self):
+        """
+        Test that a body over IMPORT_MAX_ROWS is refused before anything
+        is imported.
+        """
+        self.app.config["IMPORT_MAX_ROWS"] = 2
+        body = "firstName,lastName,email,password\n" + "".join(
+            f"Jane,Doe,jane{i}@test.com,password\n" for i in range(3)
+        )
+        response = self.client.post(
+            "/internal/users/import", data=body, content_type="text/csv"
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertIn("import-users", json.loads(response.data)["message"])
+        with self.app.app_context():
+            self.assertIsNone(
+                User.query.filter_by(email="jane0@test.com").first()
+            )
+
+    def test_import_endpoint_requires_the_internal_token(self):
+        """
+        Test that the endpoint refuses requests without the internal token,
+        and every request when no token is configured.
+        """
+        body = "firstName,lastName,email,password\nJane,Doe,jane@test.com,pw\n"
+        cases = [
+            (None, "secret"),
+            ("nope", "secret"),
+            (None, None),
+            ("", None),
+        ]
+        for token, configured in cases:
+            self.app.config["INTERNAL_TOKEN"] = configured
+            headers = {} if token is None else {"X-Internal-Token": token}
+            response = self.app.test_client().post(
+                "/internal/users/import",
+                data=body,
+                content_type="text/csv",
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 403)
+        with self.app.app_context():
+            self.assertIsNone(
+                User.query.filter_by(email="jane@test.com").first()
+            )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for declared relationship loads and strict
+loading.
+"""
+import unittest
+from sqlalchemy import select
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm import selectinload
+from app import create_app, db
+from app.loading import eager_loads
+from models.organisation import Organisation
+from models.user import User
+from tests.queries import QueryBudgetMixin
+
+
+class LoadingTestCase(QueryBudgetMixin, unittest.TestCase):
+    """
+    Test cases for declared relationship loads and strict loading.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app({"DB_STRICT_LOADING": True})
+        with self.app.app_context():
+            db.create_all()
+            users = [
+                User(firstName="John", lastName="Doe", email=f"{i}@test.com")
+                for i in range(3)
+            ]
+            for user in users:
+                user.password = "x"
+                user.organisations.extend(
+                    Organisation(name=f"Org {j}") for j in range(5)
+                )
+            db.session.add_all(users)
+            db.session.commit()
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_undeclared_lazy_load_raises(self):
+        """
+        Test that strict loading rejects a lazy load nobody declared.
+        """
+        with self.app.test_request_context():
+            user = db.session.scalars(select(User)).first()
+            with self.assertRaises(InvalidRequestError):
+                user.organisations
+
+    def test_declared_load_runs_once_for_all_rows(self):
+        """
+        Test that a view's declared eager load covers every row in one
+        extra query.
+        """
+
+        @eager_loads(selectinload(User.organisations))
+        def view():
+            users = db.session.scalars(select(User)).all()
+            return sum(len(user.organisations) for user in users)
+
+        with self.app.test_request_context():
+            with self.assertMaxQueries(2):
+                self.assertEqual(view(), 15)
+
+    def test_lazy_loading_without_strict_mode(self):
+        """
+        Test that relationships still load lazily when strict loading is
+        off.
+        """
+        self.app.config["DB_STRICT_LOADING"] = False
+        with self.app.test_request_context():
+            user = db.session.scalars(select(User)).first()
+            self.assertEqual(len(user.organisations), 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
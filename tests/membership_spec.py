@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the membership authorization checks.
+"""
+import unittest
+from flask import json
+from app import create_app, db
+from app.membership import (
+    add_member,
+    add_members_bulk,
+    is_member,
+    shares_organisation,
+)
+from models.user import User
+from models.organisation import Organisation, organisation_user_table
+
+
+class MembershipTestCase(unittest.TestCase):
+    """
+    Test cases for the membership authorization checks.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app()
+        self.app.config["TESTING"] = True
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.create_all()
+            self.users = []
+            for name in ["John", "Jane", "Jack"]:
+                user = User(
+                    firstName=name,
+                    lastName="Doe",
+                    email=f"{name.lower()}@test.com",
+                )
+                user.set_password("password")
+                self.users.append(user)
+            shared = Organisation(name="Shared Org")
+            other = Organisation(name="Other Org")
+            self.users[0].organisations.extend([shared, other])
+            self.users[1].organisations.append(shared)
+            self.users[2].organisations.append(Organisation(name="Solo"))
+            db.session.add_all(self.users)
+            db.session.commit()
+            self.ids = [user.userId for user in self.users]
+            self.shared_id = shared.org_id
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def login(self, email):
+        response = self.client.post(
+            "/auth/login", json={"email": email, "password": "password"}
+        )
+        token = json.loads(response.data)["data"]["accessToken"]
+        return {"Authorization": f"Bearer {token}"}
+
+    def test_shares_organisation(self):
+        """
+        Test that users are matched only through a common organisation.
+        """
+        john, jane, jack = self.ids
+        with self.app.app_context():
+            self.assertTrue(shares_organisation(john, jane))
+            self.assertTrue(shares_organisation(jane, john))
+            self.assertFalse(shares_organisation(john, jack))
+            self.assertTrue(is_member(jane, self.shared_id))
+            self.assertFalse(is_member(jack, self.shared_id))
+
+    def test_get_user_requires_common_organisation(self):
+        """
+        Test that a user can only read users they share an organisation with.
+        """
+        john, jane, jack = self.ids
+        headers = self.login("john@test.com")
+        response = self.client.get(f"/api/users/{jane}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)["data"]["userId"], jane)
+        response = self.client.get(f"/api/users/{john}", headers=headers)
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(f"/api/users/{jack}", headers=headers)
+        self.assertEqual(response.status_code, 401)
+
+    def test_cache_is_invalidated_on_membership_change(self):
+        """
+        Test that a cached negative result is dropped when a user joins.
+        """
+        john, jane, jack = self.ids
+        self.app.config["MEMBERSHIP_CACHE_TTL"] = 60
+        with self.app.app_context():
+            from app import membership
+
+            membership.init_app(self.app)
+            self.assertFalse(shares_organisation(john, jack))
+        response = self.client.post(
+            f"/api/organisations/{self.shared_id}/users",
+            json={"userId": jack},
+            headers=self.login("john@test.com"),
+        )
+        self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            self.assertTrue(shares_organisation(john, jack))
+
+    def test_cache_is_invalidated_after_commit(self):
+        """
+        Test that a result cached by a concurrent request before a new
+        membership is committed is dropped by the commit.
+        """
+        john, jane, jack = self.ids
+        self.app.config["MEMBERSHIP_CACHE_TTL"] = 60
+        with self.app.app_context():
+            from app import membership
+
+            membership.init_app(self.app)
+            add_member(self.shared_id, jack)
+            # A concurrent request still sees the committed state
+            membership._cache().set(("member", jack, self.shared_id), False)
+            db.session.commit()
+            self.assertTrue(is_member(jack, self.shared_id))
+
+            key = ("shares", *sorted((john, jane)))
+            membership._cache().set(key, True)
+            add_member(self.shared_id, john)
+            db.session.rollback()
+            # Nothing changed, so nothing is dropped
+            self.assertTrue(membership._cache().get(key))
+
+    def test_bulk_add_matches_any_spelling_of_an_id(self):
+        """
+        Test that ids are matched in any valid UUID spelling and reported
+        as the client sent them.
+        """
+        john, _, jack = self.ids
+        spellings = [john.upper(), jack.upper(), "{" + jack + "}", "nope"]
+        with self.app.app_context():
+            results = add_members_bulk(self.shared_id, spellings)
+            db.session.commit()
+            self.assertEqual(
+                results,
+                [
+                    (john.upper(), "already-member"),
+                    (jack.upper(), "added"),
+                    ("{" + jack + "}", "added"),
+                    ("nope", "not-found"),
+                ],
+            )
+            self.assertTrue(is_member(jack, self.shared_id))
+
+    def test_add_member_is_idempotent(self):
+        """
+        Test that adding an existing member does not create a duplicate row.
+        """
+        john = self.ids[0]
+        with self.app.app_context():
+            self.assertFalse(add_member(self.shared_id, john))
+            self.assertTrue(add_member(self.shared_id, self.ids[2]))
+            db.session.commit()
+        headers = self.login("john@test.com")
+        for _ in range(2):
+            response = self.client.post(
+                f"/api/organisations/{self.shared_id}/users",
+                json={"userId": john},
+                headers=headers,
+            )
+            self.assertEqual(response.status_code, 200)
+        with self.app.app_context():
+            count = db.session.execute(
+                organisation_user_table.select().where(
+                    organisation_user_table.c.org_id == self.shared_id
+                )
+            ).all()
+            self.assertEqual(len(count), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
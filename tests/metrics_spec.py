@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the request metrics.
+"""
+import shutil
+import tempfile
+import unittest
+from app import create_app, db
+from app.metrics import MetricsRegistry, render
+
+
+class MetricsTestCase(unittest.TestCase):
+    """
+    Test cases for the request metrics.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app()
+        self.app.config["TESTING"] = True
+        self.app.config["INTERNAL_TOKEN"] = "secret"
+        self.client = self.app.test_client()
+        self.client.environ_base["HTTP_X_INTERNAL_TOKEN"] = "secret"
+        with self.app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_requests_are_broken_down_by_endpoint(self):
+        """
+        Test that latency, SQL statements and hashes are exported per
+        endpoint.
+        """
+        self.client.post(
+            "/auth/register",
+            json={
+                "firstName": "John",
+                "lastName": "Doe",
+                "email": "john@test.com",
+                "password": "password",
+            },
+        )
+        response = self.client.get("/internal/metrics/prometheus")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        text = response.get_data(as_text=True)
+        labels = 'endpoint="auth.register",method="POST",status="201"'
+        self.assertIn(
+            f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 1',
+            text,
+        )
+        self.assertIn(f"http_request_duration_seconds_count{{{labels}}} 1", text)
+        self.assertIn('http_request_hashes_total{endpoint="auth.register"} 1', text)
+        self.assertIn(
+            'http_request_sql_statements_total{endpoint="auth.register"}', text
+        )
+        self.assertIn(
+            'http_request_json_seconds_total{endpoint="auth.register"}', text
+        )
+
+    def test_workers_are_aggregated(self):
+        """
+        Test that a scrape adds up the totals written by every worker.
+        """
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        workers = [MetricsRegistry(directory, flush_interval=0) for _ in "ab"]
+        for worker in workers:
+            worker.observe("api.get_user", "GET", 200, 0.02, {"hashes": 0})
+            worker.observe("api.get_user", "GET", 200, 0.2, {"hashes": 1})
+        text = render(workers[0].collect())
+        labels = 'endpoint="api.get_user",method="GET",status="200"'
+        self.assertIn(f'{{{labels},le="0.025"}} 2', text)
+        self.assertIn(f'{{{labels},le="0.25"}} 4', text)
+        self.assertIn(f"http_request_duration_seconds_count{{{labels}}} 4", text)
+        self.assertIn('http_request_hashes_total{endpoint="api.get_user"} 2', text)
+
+    def test_slow_requests_are_logged(self):
+        """
+        Test that requests over SLOW_REQUEST_SECONDS are logged.
+        """
+        self.app.config["SLOW_REQUEST_SECONDS"] = 1e-9
+        with self.assertLogs(self.app.logger, "WARNING") as logs:
+            self.client.get("/api/organisations")
+        self.assertIn("Slow request: GET /api/organisations", logs.output[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the schema migrations.
+"""
+import unittest
+import uuid
+from sqlalchemy import create_engine, inspect, select, text
+import migrations
+from app import db
+from migrations import v001_organisation_user_keys, v002_uuid_keys
+from models.organisation import Organisation, organisation_user_table
+from models.user import User
+
+
+class MigrationsTestCase(unittest.TestCase):
+    """
+    Test cases for the schema migrations.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.engine = create_engine("sqlite://")
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        self.engine.dispose()
+
+    def test_migration_deduplicates_memberships(self):
+        """
+        Test that the organisation_user migration drops duplicate rows and
+        adds the primary key and reverse index.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE users (userId VARCHAR(50))"))
+            connection.execute(
+                text("CREATE TABLE organisations (org_id VARCHAR(50))")
+            )
+            connection.execute(
+                text(
+                    "CREATE TABLE organisation_user "
+                    "(org_id VARCHAR(50), user_id VARCHAR(50))"
+                )
+            )
+            connection.execute(
+                text(
+                    "INSERT INTO organisation_user VALUES "
+                    "('o1', 'u1'), ('o1', 'u1'), ('o1', 'u2'), (NULL, 'u1')"
+                )
+            )
+            v001_organisation_user_keys.upgrade(connection)
+            v001_organisation_user_keys.upgrade(connection)
+            rows = connection.execute(
+                text("SELECT org_id, user_id FROM organisation_user")
+            ).all()
+            inspector = inspect(connection)
+            pk = inspector.get_pk_constraint("organisation_user")
+            indexes = inspector.get_indexes("organisation_user")
+        self.assertEqual(sorted(rows), [("o1", "u1"), ("o1", "u2")])
+        self.assertEqual(pk["constrained_columns"], ["org_id", "user_id"])
+        self.assertEqual(indexes[0]["column_names"], ["user_id", "org_id"])
+
+
+    def test_uuid_keys_migration_converts_ids(self):
+        """
+        Test that text ids are converted to 16-byte keys with the rows,
+        constraints and indexes preserved.
+        """
+        user_id, org_id = str(uuid.uuid4()), str(uuid.uuid4())
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    'CREATE TABLE users ("userId" VARCHAR(50) NOT NULL, '
+                    '"firstName" VARCHAR(50) NOT NULL, '
+                    '"lastName" VARCHAR(50) NOT NULL, '
+                    "email VARCHAR(50) NOT NULL, "
+                    "password VARCHAR(255) NOT NULL, phone VARCHAR(50), "
+                    'PRIMARY KEY ("userId"), UNIQUE ("userId"))'
+                )
+            )
+            connection.execute(
+                text('CREATE UNIQUE INDEX ix_users_email ON users (email)')
+            )
+            connection.execute(
+                text(
+                    "CREATE TABLE organisations (org_id VARCHAR(50) NOT NULL, "
+                    "name VARCHAR(50) NOT NULL, description VARCHAR(50), "
+                    "PRIMARY KEY (org_id), UNIQUE (org_id))"
+                )
+            )
+            connection.execute(
+                text(
+                    "CREATE TABLE organisation_user ("
+                    "org_id VARCHAR(50) NOT NULL "
+                    "REFERENCES organisations (org_id), "
+                    'user_id VARCHAR(50) NOT NULL REFERENCES users ("userId"), '
+                    "PRIMARY KEY (org_id, user_id))"
+                )
+            )
+            connection.execute(
+                text(
+                    "CREATE INDEX ix_organisation_user_user_id_org_id "
+                    "ON organisation_user (user_id, org_id)"
+                )
+            )
+            connection.execute(
+                text(
+                    "INSERT INTO users VALUES "
+                    "(:id, 'John', 'Doe', 'john@test.com', 'x', NULL)"
+                ),
+                {"id": user_id},
+            )
+            connection.execute(
+                text("INSERT INTO organisations VALUES (:id, 'Org', '')"),
+                {"id": org_id},
+            )
+            connection.execute(
+                text("INSERT INTO organisation_user VALUES (:org, :user)"),
+                {"org": org_id, "user": user_id},
+            )
+            v002_uuid_keys.upgrade(connection)
+            v002_uuid_keys.upgrade(connection)
+
+            raw = connection.execute(
+                text('SELECT "userId" FROM users')
+            ).scalar()
+            self.assertEqual(raw, uuid.UUID(user_id).bytes)
+            row = connection.execute(
+                select(User.userId, User.email, Organisation.org_id)
+                .join(
+                    organisation_user_table,
+                    organisation_user_table.c.user_id == User.userId,
+                )
+                .join(
+                    Organisation,
+                    Organisation.org_id == organisation_user_table.c.org_id,
+                )
+            ).one()
+            self.assertEqual(tuple(row), (user_id, "john@test.com", org_id))
+            inspector = inspect(connection)
+            self.assertEqual(
+                inspector.get_pk_constraint("organisation_user")[
+                    "constrained_columns"
+                ],
+                ["org_id", "user_id"],
+            )
+            self.assertEqual(
+                {i["name"] for i in inspector.get_indexes("users")},
+                {"ix_users_email"},
+            )
+            self.assertEqual(
+                len(inspector.get_foreign_keys("organisation_user")), 2
+            )
+
+    def test_upgrade_creates_and_stamps_a_fresh_database(self):
+        """
+        Test that an empty database is created from the models and stamped
+        with every migration, so none of them run.
+        """
+        with self.engine.begin() as connection:
+            self.assertEqual(migrations.upgrade(connection, db.metadata), [])
+            self.assertEqual(
+                migrations.applied(connection), migrations.available()
+            )
+            tables = inspect(connection).get_table_names()
+        self.assertTrue(set(db.metadata.tables) <= set(tables))
+
+    def test_upgrade_applies_pending_migrations_once(self):
+        """
+        Test that a database from before the migrations gets every pending
+        migration applied in order, and nothing on the next run.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    'CREATE TABLE users ("userId" VARCHAR(50) NOT NULL, '
+                    '"firstName" VARCHAR(50) NOT NULL, '
+                    '"lastName" VARCHAR(50) NOT NULL, '
+                    "email VARCHAR(50) NOT NULL UNIQUE, "
+                    "password VARCHAR(255) NOT NULL, phone VARCHAR(50), "
+                    'PRIMARY KEY ("userId"))'
+                )
+            )
+            connection.execute(
+                text(
+                    "CREATE TABLE organisations (org_id VARCHAR(50) NOT NULL, "
+                    "name VARCHAR(50) NOT NULL, description VARCHAR(50), "
+                    "PRIMARY KEY (org_id))"
+                )
+            )
+            connection.execute(
+                text(
+                    "CREATE TABLE organisation_user "
+                    "(org_id VARCHAR(50), user_id VARCHAR(50))"
+                )
+            )
+            applied = migrations.upgrade(connection, db.metadata)
+            self.assertEqual(applied, migrations.available())
+            self.assertEqual(migrations.upgrade(connection, db.metadata), [])
+            inspector = inspect(connection)
+            self.assertIn("refresh_tokens", inspector.get_table_names())
+            self.assertEqual(
+                inspector.get_pk_constraint("organisation_user")[
+                    "constrained_columns"
+                ],
+                ["org_id", "user_id"],
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
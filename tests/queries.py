@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+This file defines helpers for asserting how many SQL statements code runs.
+"""
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import db
+
+
+class QueryCounter:
+    """
+    Records the SQL statements an engine runs while the counter is active.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, many):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, "before_cursor_execute", self._record)
+
+    def __len__(self):
+        return len(self.statements)
+
+
+class QueryBudgetMixin:
+    """
+    Adds assertMaxQueries to a TestCase that has an `app`.
+    """
+
+    @contextmanager
+    def assertMaxQueries(self, budget, label=""):
+        """
+        Fails if the block runs more than `budget` SQL statements, listing
+        the statements it ran.
+        """
+        with self.app.app_context():
+            engine = db.engine
+        with QueryCounter(engine) as counter:
+            yield counter
+        if len(counter) > budget:
+            self.fail(
+                f"{label or 'Block'} ran {len(counter)} SQL statements, "
+                f"over its budget of {budget}:\n"
+                + "\n".join(counter.statements)
+            )
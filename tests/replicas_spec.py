@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for routing read-only requests to replicas.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from flask import json
+from sqlalchemy import select, update
+from app import create_app, db
+from app.replicas import ReplicaSet
+from models.organisation import Organisation
+from models.user import User
+
+
+class ReplicaTestCase(unittest.TestCase):
+    """
+    Test cases for routing read-only requests to replicas, with a primary
+    and a replica in two SQLite files.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.primary = os.path.join(self.directory, "primary.db")
+        self.replica = os.path.join(self.directory, "replica.db")
+        self.app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{self.primary}",
+                "DATABASE_REPLICA_URIS": [f"sqlite:///{self.replica}"],
+                "HASH_PROFILE": "fast",
+                "TESTING": True,
+            }
+        )
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+            db.metadata.create_all(db.engines["replica_1"])
+            user = User(
+                firstName="John", lastName="Doe", email="john@test.com"
+            )
+            user.set_password("password")
+            user.organisations.append(Organisation(name="John's Org"))
+            db.session.add(user)
+            db.session.commit()
+            self.user_id = user.userId
+            self.org_id = user.organisations[0].org_id
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "john@test.com", "password": "password"},
+        )
+        token = json.loads(response.data)["data"]["accessToken"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def replicate(self):
+        """
+        Copies the primary to the replica, as replication would.
+        """
+        with self.app.app_context():
+            db.engines["replica_1"].dispose()
+        shutil.copyfile(self.primary, self.replica)
+
+    def rename_on_primary(self, name):
+        with self.app.app_context():
+            db.session.execute(
+                update(Organisation)
+                .where(Organisation.org_id == self.org_id)
+                .values(name=name)
+            )
+            db.session.commit()
+
+    def test_get_reads_from_replica(self):
+        """
+        Test that GET requests read from the replica.
+        """
+        self.replicate()
+        self.rename_on_primary("Renamed")
+        response = self.client.get(
+            f"/api/organisations/{self.org_id}", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)["data"]
+        self.assertEqual(data["name"], "John's Org")
+
+    def test_writes_go_to_primary(self):
+        """
+        Test that POST requests write to and read from the primary.
+        """
+        response = self.client.post(
+            "/api/organisations",
+            json={"name": "New Org"},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        with self.app.app_context():
+            replica = db.engines["replica_1"]
+            with replica.connect() as connection:
+                names = connection.scalars(select(Organisation.name)).all()
+            self.assertEqual(names, [])
+            names = db.session.scalars(select(Organisation.name)).all()
+            self.assertIn("New Org", names)
+
+    def test_read_after_write_stays_on_primary(self):
+        """
+        Test that a request reads its own writes once it has written.
+        """
+        self.replicate()
+        name = select(Organisation.name).where(
+            Organisation.org_id == self.org_id
+        )
+        with self.app.test_request_context(method="GET"):
+            self.app.preprocess_request()
+            self.assertEqual(db.session.scalar(name), "John's Org")
+            organisation = db.session.get(Organisation, self.org_id)
+            organisation.name = "Renamed"
+            db.session.flush()
+            self.assertEqual(db.session.scalar(name), "Renamed")
+            db.session.commit()
+            self.assertEqual(db.session.scalar(name), "Renamed")
+            self.app.do_teardown_request()
+
+    def test_user_missing_on_replica_is_loaded_from_primary(self):
+        """
+        Test that a token for a user not yet replicated still works.
+        """
+        response = self.client.get(
+            f"/api/users/{self.user_id}", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)["data"]
+        self.assertEqual(data["email"], "john@test.com")
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        """
+        Test that requests use the primary while no replica answers.
+        """
+        self.replicate()
+        app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{self.primary}",
+                "DATABASE_REPLICA_URIS": [
+                    f"sqlite:///{self.directory}/missing/replica.db"
+                ],
+                "TESTING": True,
+            }
+        )
+        client = app.test_client()
+        self.rename_on_primary("Renamed")
+        for _ in range(2):
+            response = client.get(
+                f"/api/organisations/{self.org_id}", headers=self.headers
+            )
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)["data"]
+            self.assertEqual(data["name"], "Renamed")
+        stats = app.extensions["replicas"].stats()
+        self.assertEqual(stats["fallbacks"], 2)
+        self.assertTrue(stats["replicas"][0]["down"])
+
+    def test_strategies(self):
+        """
+        Test the round-robin and least-connections replica order.
+        """
+        replicas = ReplicaSet({"a": None, "b": None})
+        first = [replicas.candidates()[0].name for _ in range(4)]
+        self.assertEqual(first, ["a", "b", "a", "b"])
+
+        replicas = ReplicaSet({"a": None, "b": None}, "least-connections")
+        replicas.replicas[0].in_use = 3
+        first = [replicas.candidates()[0].name for _ in range(4)]
+        self.assertEqual(first, ["b"] * 4)
+
+        replicas.mark_down(replicas.replicas[1])
+        self.assertEqual([r.name for r in replicas.candidates()], ["a"])
+        with self.assertRaises(ValueError):
+            ReplicaSet({"a": None}, "random")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the organisation and member searches.
+"""
+import unittest
+from flask import json
+from sqlalchemy import select, update
+from app import create_app, db
+from migrations import v005_search_indexes
+from models.organisation import Organisation
+from models.search import drop_search_indexes
+from models.user import User
+
+
+class SearchTestCase(unittest.TestCase):
+    """
+    Test cases for the organisation and member searches.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app({"HASH_PROFILE": "fast", "TESTING": True})
+        self.client = self.app.test_client()
+        with self.app.app_context():
+            db.create_all()
+            john = User(firstName="John", lastName="Doe", email="john@test.com")
+            jane = User(
+                firstName="Jane", lastName="Smith", email="jane@test.com"
+            )
+            eve = User(firstName="Eve", lastName="Smith", email="eve@test.com")
+            for user in (john, jane, eve):
+                user.set_password("password")
+            names = ["Acme Corp", "Globex", "Initech", "Big Acme Holdings"]
+            organisations = [Organisation(name=name) for name in names]
+            john.organisations.extend(organisations)
+            jane.organisations.append(organisations[1])
+            eve.organisations.append(Organisation(name="Acme Rivals"))
+            db.session.add_all([john, jane, eve])
+            db.session.commit()
+            self.org_ids = {o.name: o.org_id for o in organisations}
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "john@test.com", "password": "password"},
+        )
+        token = json.loads(response.data)["data"]["accessToken"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def search(self, url):
+        response = self.client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.data)["data"]
+
+    def names(self, data):
+        return [o["name"] for o in data["organisations"]]
+
+    def test_exact_search_matches_parts_of_words(self):
+        """
+        Test that the search matches parts of words within the caller's
+        organisations only, best matches first.
+        """
+        data = self.search("/api/organisations/search?q=ACME")
+        self.assertEqual(data["match"], "exact")
+        self.assertEqual(self.names(data), ["Acme Corp", "Big Acme Holdings"])
+        data = self.search("/api/organisations/search?q=hold acm")
+        self.assertEqual(self.names(data), ["Big Acme Holdings"])
+
+    def test_fuzzy_search_matches_misspellings(self):
+        """
+        Test that a query without exact matches is searched fuzzily.
+        """
+        data = self.search("/api/organisations/search?q=gloobex")
+        self.assertEqual(data["match"], "fuzzy")
+        self.assertEqual(self.names(data)[0], "Globex")
+        data = self.search("/api/organisations/search?q=gloobex&match=exact")
+        self.assertEqual(data["organisations"], [])
+
+    def test_pagination(self):
+        """
+        Test that results are paged with limit and offset.
+        """
+        data = self.search("/api/organisations/search?q=acme&limit=1")
+        self.assertEqual(self.names(data), ["Acme Corp"])
+        self.assertEqual(data["nextOffset"], 1)
+        data = self.search("/api/organisations/search?q=acme&limit=1&offset=1")
+        self.assertEqual(self.names(data), ["Big Acme Holdings"])
+        self.assertIsNone(data["nextOffset"])
+        for query in ["q=ab", "q=acme&limit=0", "q=acme&match=any"]:
+            response = self.client.get(
+                f"/api/organisations/search?{query}", headers=self.headers
+            )
+            self.assertEqual(response.status_code, 400)
+
+    def test_index_follows_updates_and_deletes(self):
+        """
+        Test that renamed organisations are found by their new name only.
+        """
+        with self.app.app_context():
+            db.session.execute(
+                update(Organisation)
+                .where(Organisation.org_id == self.org_ids["Initech"])
+                .values(name="Umbrella")
+            )
+            db.session.commit()
+        self.assertEqual(
+            self.names(self.search("/api/organisations/search?q=umbrella")),
+            ["Umbrella"],
+        )
+        data = self.search("/api/organisations/search?q=initech&match=exact")
+        self.assertEqual(data["organisations"], [])
+
+    def test_member_search_is_scoped_to_callers_organisations(self):
+        """
+        Test that the member search only finds users sharing one of the
+        caller's organisations.
+        """
+        data = self.search("/api/users/search?q=smith")
+        self.assertEqual([u["email"] for u in data["users"]], ["jane@test.com"])
+        self.assertNotIn("password", data["users"][0])
+        org_id = self.org_ids["Acme Corp"]
+        data = self.search(f"/api/users/search?q=smith&orgId={org_id}")
+        self.assertEqual(data["users"], [])
+        data = self.search(f"/api/users/search?q=john&orgId={org_id}")
+        self.assertEqual(len(data["users"]), 1)
+        with self.app.app_context():
+            other = db.session.scalar(
+                select(Organisation.org_id).where(
+                    Organisation.name == "Acme Rivals"
+                )
+            )
+        response = self.client.get(
+            f"/api/users/search?q=eve&orgId={other}", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_migration_indexes_existing_rows(self):
+        """
+        Test that migration v005 creates the indexes and indexes the rows
+        that already exist.
+        """
+        with self.app.app_context(), db.engine.begin() as connection:
+            drop_search_indexes(connection)
+            v005_search_indexes.upgrade(connection)
+            v005_search_indexes.upgrade(connection)
+        data = self.search("/api/organisations/search?q=globex")
+        self.assertEqual(self.names(data), ["Globex"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the JSON provider and response objects.
+"""
+import unittest
+from datetime import datetime, timezone
+from decimal import Decimal
+from flask.json.provider import DefaultJSONProvider
+from app import create_app, serialization
+from app.dto import OrganisationDTO
+
+
+class SerializationTestCase(unittest.TestCase):
+    """
+    Test cases for the JSON provider and response objects.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.app = create_app()
+        self.default = DefaultJSONProvider(self.app)
+
+    def test_output_matches_the_default_provider(self):
+        """
+        Test that the fast provider produces the same JSON as Flask's.
+        """
+        payload = {
+            "organisations": [OrganisationDTO("id", "Org", None)],
+            "created": datetime(2024, 7, 1, tzinfo=timezone.utc),
+            "amount": Decimal("1.50"),
+            "b": 1,
+            "a": [True, None],
+        }
+        fast = self.app.json
+        self.assertIsInstance(fast, serialization.FastJSONProvider)
+        self.assertEqual(
+            fast.loads(fast.dumps(payload)),
+            self.default.loads(self.default.dumps(payload)),
+        )
+        del payload["organisations"]
+        self.assertEqual(
+            fast.dumps(payload).replace(" ", ""),
+            self.default.dumps(payload).replace(" ", ""),
+        )
+
+    def test_response_is_encoded_once(self):
+        """
+        Test that jsonify responses hold the encoded payload and a newline.
+        """
+        with self.app.app_context():
+            response = self.app.json.response(
+                data=OrganisationDTO("id", "Org", "")
+            )
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertTrue(response.data.endswith(b"\n"))
+        self.assertEqual(
+            self.app.json.loads(response.data),
+            {"data": {"orgId": "id", "name": "Org", "description": ""}},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
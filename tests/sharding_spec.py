@@ -0,0 +1,483 @@
+#!/usr/bin/env python
+"""
+This file defines the tests for the hash-sharded user and organisation
+storage.
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from unittest.mock import patch
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError, OperationalError
+from app import create_app, db
+from app.sharding import (
+    owner,
+    parse,
+    shard_members,
+    shard_organisations,
+    shard_users,
+)
+from tests.queries import QueryCounter
+
+
+class ShardingTestCase(unittest.TestCase):
+    """
+    Test cases for the hash-sharded storage, on SQLite shard files.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.directory = tempfile.mkdtemp()
+        self.app = self.create_app(["a", "b", "c"])
+        self.store = self.app.extensions["shards"]
+        self.store.create_all()
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def create_app(self, names):
+        path = os.path.join(self.directory, "{}.db")
+        shards = ",".join(
+            f"{name}=sqlite:///{path.format(name)}" for name in names
+        )
+        return create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path.format('main')}",
+                "DATABASE_SHARDS": shards,
+                "TESTING": True,
+            }
+        )
+
+    def add_user(self, store, i):
+        return store.add_user(
+            {
+                "firstName": "John",
+                "lastName": "Doe",
+                "email": f"{i}@test.com",
+                "password": "x",
+            }
+        )
+
+    def populate(self, store, users=60):
+        user_ids = [self.add_user(store, i) for i in range(users)]
+        org_ids = []
+        for i, user_id in enumerate(user_ids):
+            org_id = store.add_organisation({"name": f"Org {i}"}, user_id)
+            store.add_member(org_id, user_ids[(i + 1) % users])
+            org_ids.append(org_id)
+        return user_ids, org_ids
+
+    def assert_reachable(self, store, user_ids, org_ids):
+        for i, (user_id, org_id) in enumerate(zip(user_ids, org_ids)):
+            self.assertEqual(store.user(user_id).email, f"{i}@test.com")
+            self.assertEqual(store.organisation(org_id).name, f"Org {i}")
+            members = {row.userId for row in store.members(org_id)}
+            self.assertIn(user_id, members)
+            self.assertEqual(len(members), 2)
+
+    def test_parse(self):
+        """
+        Test that DATABASE_SHARDS is parsed into names and URIs.
+        """
+        shards = parse("a=sqlite:///a.db, b=postgresql://h/db?x=1")
+        self.assertEqual(
+            shards, {"a": "sqlite:///a.db", "b": "postgresql://h/db?x=1"}
+        )
+        with self.assertRaises(ValueError):
+            parse("sqlite:///a.db")
+
+    def test_owner_is_stable_and_spread(self):
+        """
+        Test that ids spread over the shards and a new shard only takes
+        ids from the others.
+        """
+        keys = [uuid.uuid4() for _ in range(3000)]
+        before = [owner(key, ["a", "b", "c"]) for key in keys]
+        for name in "abc":
+            self.assertGreater(before.count(name), 800)
+        after = [owner(key, ["a", "b", "c", "d"]) for key in keys]
+        moved = [old for old, new in zip(before, after) if old != new]
+        self.assertEqual(
+            len(moved), sum(new == "d" for new in after)
+        )
+        self.assertLess(len(moved), 1000)
+
+    def test_rows_live_on_their_shards(self):
+        """
+        Test that users, organisations and memberships are stored on the
+        shards their ids hash to, and read back across shards.
+        """
+        user_ids, org_ids = self.populate(self.store)
+        counts = self.store.counts()
+        self.assertEqual(sum(c["users"] for c in counts.values()), 60)
+        self.assertTrue(all(c["users"] for c in counts.values()))
+        self.assertFalse(any(c["misplaced_users"] for c in counts.values()))
+        engine = self.store.engine_for(org_ids[0])
+        with engine.connect() as connection:
+            members = connection.scalars(
+                select(shard_members.c.user_id).where(
+                    shard_members.c.org_id == org_ids[0]
+                )
+            ).all()
+        self.assertEqual(set(members), {user_ids[0], user_ids[1]})
+        organisations = self.store.organisations_of(user_ids[1])
+        self.assertEqual(
+            {row.org_id for row in organisations}, {org_ids[0], org_ids[1]}
+        )
+        self.assert_reachable(self.store, user_ids, org_ids)
+
+    def test_login_lookup_is_one_directory_query(self):
+        """
+        Test that finding a user by email reads the directory once and
+        then only the user's shard.
+        """
+        user_id = self.add_user(self.store, 1)
+        shard = self.store.engine_for(user_id)
+        with QueryCounter(self.store.directory) as directory:
+            with QueryCounter(shard) as reads:
+                user = self.store.user_by_email("1@test.com")
+        self.assertEqual(user.userId, user_id)
+        self.assertEqual(len(directory.statements), 1)
+        self.assertEqual(len(reads.statements), 1)
+        self.assertIsNone(self.store.user_by_email("missing@test.com"))
+
+    def test_duplicate_email_is_rejected(self):
+        """
+        Test that emails stay unique across shards.
+        """
+        self.add_user(self.store, 1)
+        with self.assertRaises(IntegrityError):
+            self.add_user(self.store, 1)
+        counts = self.store.counts()
+        self.assertEqual(sum(c["users"] for c in counts.values()), 1)
+
+    def test_concurrent_adds_of_a_member(self):
+        """
+        Test that adding the same member concurrently creates it once and
+        fails none of the adds.
+        """
+        owner_id = self.add_user(self.store, 1)
+        user_id = self.add_user(self.store, 2)
+        org_id = self.store.add_organisation({"name": "Org"}, owner_id)
+        barrier = Barrier(4)
+
+        def add():
+            barrier.wait()
+            return self.store.add_members(org_id, [owner_id, user_id])
+
+        with ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: add(), range(4)))
+        self.assertEqual(sorted(results), [[], [], [], [user_id]])
+        members = self.store.members(org_id)
+        self.assertEqual(
+            sorted(row.userId for row in members), sorted([owner_id, user_id])
+        )
+        self.assertEqual(
+            {row.org_id for row in self.store.organisations_of(user_id)},
+            {org_id},
+        )
+
+    def test_shares_organisation_in_bounded_chunks(self):
+        """
+        Test that users on different shards are checked for a common
+        organisation without an IN list longer than the chunk size.
+        """
+        user_ids = [self.add_user(self.store, i) for i in range(12)]
+        user_id = user_ids[0]
+        shard = self.store.shard_for(user_id)
+        other_id = next(
+            u for u in user_ids if self.store.shard_for(u) != shard
+        )
+        stranger_id = next(u for u in user_ids if u not in (user_id, other_id))
+        for i in range(7):
+            self.store.add_organisation({"name": f"Theirs {i}"}, other_id)
+        self.store.add_organisation({"name": "Mine"}, user_id)
+        shared = self.store.add_organisation({"name": "Shared"}, stranger_id)
+        self.store.add_members(shared, [user_id, other_id])
+
+        engine = self.store.engine_for(user_id)
+        with patch("app.sharding.SHARED_ORGANISATIONS_CHUNK", 2):
+            with QueryCounter(engine) as counter:
+                self.assertTrue(
+                    self.store.shares_organisation(user_id, other_id)
+                )
+            self.assertFalse(
+                self.store.shares_organisation(
+                    user_id, self.add_user(self.store, 99)
+                )
+            )
+        self.assertTrue(counter.statements)
+        for statement in counter.statements:
+            self.assertLessEqual(statement.count("?"), 3)
+
+    def test_rebalance_after_adding_a_shard(self):
+        """
+        Test that a rebalance moves only the rows the new shard owns and
+        keeps everything reachable.
+        """
+        user_ids, org_ids = self.populate(self.store)
+        app = self.create_app(["a", "b", "c", "d"])
+        store = app.extensions["shards"]
+        store.create_all()
+        result = app.test_cli_runner().invoke(args=["shards", "rebalance"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        counts = store.counts()
+        self.assertFalse(any(c["misplaced_users"] for c in counts.values()))
+        self.assertEqual(
+            sum(c["organisations"] for c in counts.values()), 60
+        )
+        self.assertGreater(counts["d"]["users"], 0)
+        self.assertIn(f"moved {counts['d']['users']} users", result.output)
+        self.assert_reachable(store, user_ids, org_ids)
+
+        report = store.rebalance()
+        self.assertEqual(dict(report.moved), {})
+
+    def test_drain_a_shard(self):
+        """
+        Test that draining empties a shard into the others.
+        """
+        user_ids, org_ids = self.populate(self.store)
+        report = self.store.rebalance(drain=["c"], chunk_size=7)
+        self.assertGreater(report.moved["users"], 0)
+        with self.store.engines["c"].connect() as connection:
+            for table in (shard_users, shard_organisations, shard_members):
+                self.assertEqual(
+                    connection.execute(select(table)).all(), []
+                )
+        app = self.create_app(["a", "b"])
+        self.assert_reachable(app.extensions["shards"], user_ids, org_ids)
+
+
+
+class ShardedRoutesTestCase(unittest.TestCase):
+    """
+    Test cases for the auth and API routes on two SQLite shard files. The
+    primary database only holds the email directory, so any route reading
+    db.session instead of the shards fails.
+    """
+
+    def setUp(self):
+        """
+        Set up the test cases.
+        """
+        self.directory = tempfile.mkdtemp()
+        path = os.path.join(self.directory, "{}.db")
+        self.app = create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{path.format('main')}",
+                "DATABASE_SHARDS": ",".join(
+                    f"{name}=sqlite:///{path.format(name)}" for name in "ab"
+                ),
+                "HASH_PROFILE": "fast",
+                "TESTING": True,
+            }
+        )
+        self.store = self.app.extensions["shards"]
+        self.store.create_all()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        """
+        Tear down the test cases.
+        """
+        with self.app.app_context():
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def register(self, name):
+        response = self.client.post(
+            "/auth/register",
+            json={
+                "firstName": name.title(),
+                "lastName": "Doe",
+                "email": f"{name}@test.com",
+                "password": "password",
+            },
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.get_json()["data"]
+
+    def headers(self, data):
+        return {"Authorization": f"Bearer {data['accessToken']}"}
+
+    def test_register_and_login(self):
+        """
+        Test that registering stores the user and their organisation on
+        their shards, and that login finds them through the directory.
+        """
+        data = self.register("john")
+        user_id = data["user"]["userId"]
+        self.assertEqual(self.store.user(user_id).email, "john@test.com")
+        (organisation,) = self.store.organisations_of(user_id)
+        self.assertEqual(organisation.name, "John's Organisation")
+
+        response = self.client.post(
+            "/auth/register",
+            json={
+                "firstName": "John",
+                "lastName": "Doe",
+                "email": "john@test.com",
+                "password": "password",
+            },
+        )
+        self.assertEqual(response.status_code, 422)
+
+        response = self.client.post(
+            "/auth/login",
+            json={"email": "john@test.com", "password": "password"},
+        )
+        self.assertEqual(response.status_code, 200)
+        login = response.get_json()["data"]
+        self.assertEqual(login["user"]["userId"], user_id)
+        response = self.client.post(
+            "/auth/login", json={"email": "john@test.com", "password": "no"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.get(
+            f"/api/users/{user_id}", headers=self.headers(login)
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["data"]["email"], "john@test.com")
+        response = self.client.get(
+            "/api/organisations?includeTotal=true",
+            headers=self.headers(login),
+        )
+        data = response.get_json()["data"]
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(
+            data["organisations"][0]["orgId"], organisation.org_id
+        )
+
+    def test_failed_registration_is_undone(self):
+        """
+        Test that a registration whose organisation cannot be stored fails
+        with a 400 and leaves no user behind.
+        """
+        body = {
+            "firstName": "John",
+            "lastName": "Doe",
+            "email": "john@test.com",
+            "password": "password",
+        }
+        error = OperationalError("INSERT", {}, Exception("disk I/O error"))
+        with patch.object(self.store, "add_organisation", side_effect=error):
+            response = self.client.post("/auth/register", json=body)
+        self.assertEqual(response.status_code, 400)
+        self.assertIsNone(self.store.user_by_email("john@test.com"))
+        counts = self.store.counts()
+        self.assertEqual(sum(c["users"] for c in counts.values()), 0)
+        response = self.client.post("/auth/register", json=body)
+        self.assertEqual(response.status_code, 201)
+
+    def test_memberships_across_shards(self):
+        """
+        Test that an organisation's members, added one at a time and in
+        bulk, can be listed and can see each other wherever they live.
+        """
+        users = [self.register(f"user{i}") for i in range(8)]
+        user_ids = [u["user"]["userId"] for u in users]
+        while len({self.store.shard_for(u) for u in user_ids}) < 2:
+            # Make sure the members live on both shards
+            users.append(self.register(f"user{len(users)}"))
+            user_ids.append(users[-1]["user"]["userId"])
+        owner = users[0]
+        response = self.client.post(
+            "/api/organisations",
+            json={"name": "Shared", "description": "Across shards"},
+            headers=self.headers(owner),
+        )
+        self.assertEqual(response.status_code, 201)
+        org_id = response.get_json()["data"]["orgId"]
+        url = f"/api/organisations/{org_id}"
+
+        # Outsiders are refused before they are added
+        response = self.client.get(url, headers=self.headers(users[1]))
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            f"{url}/users",
+            json={"userId": user_ids[1]},
+            headers=self.headers(owner),
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(
+            f"{url}/users",
+            json={"userIds": user_ids[1:] + [str(uuid.uuid4())]},
+            headers=self.headers(owner),
+        )
+        data = response.get_json()["data"]
+        self.assertEqual(
+            (data["added"], data["alreadyMember"], data["notFound"]),
+            (len(users) - 2, 1, 1),
+        )
+
+        response = self.client.get(url, headers=self.headers(users[1]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()["data"]["name"], "Shared")
+        limit = (len(users) + 1) // 2
+        response = self.client.get(
+            f"{url}/users?limit={limit}&includeTotal=true",
+            headers=self.headers(users[-1]),
+        )
+        page = response.get_json()["data"]
+        response = self.client.get(
+            f"{url}/users?limit={limit}&after={page['nextCursor']}",
+            headers=self.headers(users[-1]),
+        )
+        rest = response.get_json()["data"]
+        self.assertEqual(page["total"], len(users))
+        self.assertEqual(
+            [u["userId"] for u in page["users"] + rest["users"]],
+            sorted(user_ids),
+        )
+        self.assertIsNone(rest["nextCursor"])
+
+        response = self.client.get(
+            f"/api/users/{user_ids[0]}", headers=self.headers(users[-1])
+        )
+        self.assertEqual(response.status_code, 200)
+        stranger = self.register("stranger")
+        response = self.client.get(
+            f"/api/users/{user_ids[0]}", headers=self.headers(stranger)
+        )
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get(
+            "/api/users/search?q=user", headers=self.headers(owner)
+        )
+        self.assertEqual(response.status_code, 501)
+
+    def test_refresh_token_rotation(self):
+        """
+        Test that refresh token families live on the user's shard and a
+        replayed token revokes the family.
+        """
+        data = self.register("john")
+        old = {"Authorization": f"Bearer {data['refreshToken']}"}
+        response = self.client.post("/auth/refresh", headers=old)
+        self.assertEqual(response.status_code, 200)
+        data = response.get_json()["data"]
+        new = {"Authorization": f"Bearer {data['refreshToken']}"}
+        response = self.client.post("/auth/refresh", headers=old)
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post("/auth/refresh", headers=new)
+        self.assertEqual(response.status_code, 401)
+
+
+if __name__ == "__main__":
+    unittest.main()